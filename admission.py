@@ -0,0 +1,165 @@
+"""
+Admission control for the Enhanced File Server
+Bounds how many requests of each expensive route run at once, queues a
+limited number of extra requests with a deadline and turns everything
+beyond that away immediately with 503 (server busy) or 429 (this client
+already has too many running), both with a Retry-After estimate.
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from config import *
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted"""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RouteLimiter:
+    """Concurrency limit with a bounded FIFO queue for one route (or for all requests)"""
+
+    def __init__(self, name, max_active, max_queue, queue_timeout):
+        self.name = name
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.cond = threading.Condition()
+        self.active = 0
+        self.queue = deque()          # waiting requests; a freed slot goes to the oldest
+        self.service_time = 1.0       # moving average of seconds per request
+        self.rejected = {}            # reason -> count
+
+    @property
+    def waiting(self):
+        return len(self.queue)
+
+    def retry_after(self):
+        """Seconds until a slot is likely to be free"""
+        return max(1, math.ceil(self.service_time * (len(self.queue) + 1) / self.max_active))
+
+    def _reject(self, reason):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise Rejected(503, reason, self.retry_after())
+
+    def acquire(self):
+        """Wait for a slot; returns the seconds spent queued or raises Rejected"""
+        with self.cond:
+            if self.active < self.max_active and not self.queue:
+                self.active += 1
+                return 0.0
+            if len(self.queue) >= self.max_queue:
+                self._reject('queue_full')
+
+            granted = threading.Event()
+            self.queue.append(granted)
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            while not granted.is_set():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.queue.remove(granted)
+                    self._reject('queue_timeout')
+                self.cond.wait(remaining)
+            return time.monotonic() - started
+
+    def release(self, elapsed=None):
+        """Give the slot back; elapsed is None when the slot was never used for a request"""
+        with self.cond:
+            if elapsed is not None:
+                self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+            if self.queue:
+                # Hand the slot straight to the oldest waiter
+                self.queue.popleft().set()
+                self.cond.notify_all()
+            else:
+                self.active -= 1
+
+
+class AdmissionController:
+    """Global and per-route limiters plus per-client caps on expensive routes"""
+
+    def __init__(self, route_limits=ADMISSION_ROUTE_LIMITS, client_limits=ADMISSION_CLIENT_LIMITS,
+                 max_in_flight=ADMISSION_MAX_IN_FLIGHT, global_queue=ADMISSION_GLOBAL_QUEUE,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, exempt_routes=ADMISSION_EXEMPT_ROUTES):
+        self.global_limiter = RouteLimiter('all', max_in_flight, global_queue, queue_timeout) if max_in_flight else None
+        self.limiters = {route: RouteLimiter(route, *limits) for route, limits in route_limits.items()}
+        self.client_limits = client_limits
+        self.exempt_routes = frozenset(exempt_routes)
+        self.lock = threading.Lock()
+        self.client_active = {}       # (route, client) -> running requests
+        self.client_rejected = {}     # route -> count
+
+    def admit(self, route, client):
+        """Admit a request; returns (ticket, seconds queued) or raises Rejected.
+
+        The ticket must be passed to release() when the request is done.
+        """
+        if route in self.exempt_routes:
+            return ([], None, time.monotonic()), 0.0
+        limit = self.client_limits.get(route)
+        client_key = (route, client) if limit else None
+        if client_key is not None:
+            with self.lock:
+                if self.client_active.get(client_key, 0) >= limit:
+                    self.client_rejected[route] = self.client_rejected.get(route, 0) + 1
+                    limiter = self.limiters.get(route)
+                    raise Rejected(429, 'client_limit', limiter.retry_after() if limiter else 1)
+                self.client_active[client_key] = self.client_active.get(client_key, 0) + 1
+
+        acquired = []
+        waited = 0.0
+        try:
+            for limiter in (self.global_limiter, self.limiters.get(route)):
+                if limiter is not None:
+                    waited += limiter.acquire()
+                    acquired.append(limiter)
+        except Rejected:
+            # The request never ran, so it says nothing about service time
+            for limiter in acquired:
+                limiter.release()
+            self._release_client(client_key)
+            raise
+        return (acquired, client_key, time.monotonic()), waited
+
+    def _release_client(self, client_key):
+        if client_key is None:
+            return
+        with self.lock:
+            count = self.client_active.get(client_key, 0) - 1
+            if count > 0:
+                self.client_active[client_key] = count
+            else:
+                self.client_active.pop(client_key, None)
+
+    def release(self, ticket):
+        limiters, client_key, started = ticket
+        elapsed = time.monotonic() - started
+        for limiter in reversed(limiters):
+            limiter.release(elapsed)
+        self._release_client(client_key)
+
+    def all_limiters(self):
+        return ([self.global_limiter] if self.global_limiter else []) + list(self.limiters.values())
+
+    def queue_depths(self):
+        return {(limiter.name,): limiter.waiting for limiter in self.all_limiters()}
+
+    def active_counts(self):
+        return {(limiter.name,): limiter.active for limiter in self.all_limiters()}
+
+    def rejections(self):
+        counts = {}
+        for limiter in self.all_limiters():
+            for reason, count in limiter.rejected.items():
+                counts[(limiter.name, reason)] = count
+        for route, count in self.client_rejected.items():
+            counts[(route, 'client_limit')] = count
+        return counts
@@ -0,0 +1,296 @@
+"""
+Archive browsing for the Enhanced File Server
+Lists ZIP and tar archives under the browse root like directories and reads
+single members without extracting anything. An archive's central directory
+(ZIP) or member headers (tar) are parsed once per archive version and kept
+in an LRU cache, so listing a folder inside a large archive or opening one
+member costs a dictionary lookup and a seek.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from config import *
+from pathres import open_file
+
+# name suffix -> kind; compressed tars can only be read from the start
+ARCHIVE_SUFFIXES = (
+    ('.zip', 'zip'),
+    ('.tar', 'tar'),
+    ('.tar.gz', 'tar-compressed'), ('.tgz', 'tar-compressed'),
+    ('.tar.bz2', 'tar-compressed'), ('.tbz2', 'tar-compressed'),
+    ('.tar.xz', 'tar-compressed'), ('.txz', 'tar-compressed'),
+)
+
+
+class ArchiveError(Exception):
+    """Raised when an archive cannot be browsed"""
+
+
+def archive_kind(path):
+    """'zip', 'tar' or 'tar-compressed' for a browsable archive name, else None"""
+    lower = path.lower()
+    for suffix, kind in ARCHIVE_SUFFIXES:
+        if lower.endswith(suffix):
+            return kind
+    return None
+
+
+def normalize_member(name):
+    """Member name without leading slashes or trailing slash; None if it leaves the archive root"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if '..' in parts:
+        return None
+    return '/'.join(parts)
+
+
+class ArchiveMember:
+    """One file, folder or link inside an archive"""
+
+    __slots__ = ('name', 'size', 'mtime', 'mode', 'is_dir', 'is_file', 'link', 'info')
+
+    def __init__(self, name, size=0, mtime=0, mode=None, is_dir=False, is_file=False, link=None, info=None):
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.is_dir = is_dir
+        self.is_file = is_file
+        self.link = link              # symlink target
+        self.info = info              # ZipInfo or TarInfo used to read the member
+
+
+class MemberReader:
+    """Read-only view of `size` bytes at `offset` of an open file (an uncompressed tar member); closes the file"""
+
+    def __init__(self, file, offset, size):
+        self.file = file
+        self.file.seek(offset)
+        self.remaining = size
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ArchiveIndex:
+    """Parsed member table of one archive version.
+
+    Requests hold a reference (acquire/release) while they use the index;
+    once the cache drops it, the open ZipFile is closed by whichever
+    happens last: the retirement or the last release.
+
+    With a root, the archive is only ever opened through the root's
+    directory descriptor (see pathres.open_file). The index takes over
+    `file`, the archive already opened that way, when one is given.
+    """
+
+    def __init__(self, path, kind, root=None, file=None):
+        self.path = path
+        self.kind = kind
+        self.root = root
+        self.members = {}             # normalized name -> ArchiveMember
+        self.children = {'': {}}      # folder -> {child name: ArchiveMember}
+        self.zip = None
+        self.file = None              # the open archive behind self.zip
+        self.lock = threading.Lock()
+        self.users = 0                # requests currently holding the index
+        self.retired = False          # dropped from the cache; close when unused
+        if file is None:
+            file = open_file(path, root)
+        if kind == 'zip':
+            self._load_zip(file)
+        else:
+            with file:
+                self._load_tar(file)
+
+    def _load_zip(self, file):
+        import zipfile
+        try:
+            # Keep the ZipFile: its parsed central directory is the index,
+            # and members are opened from it by seeking to their header
+            self.zip = zipfile.ZipFile(file)
+        except zipfile.BadZipFile as e:
+            file.close()
+            raise ArchiveError(f"Not a valid ZIP archive: {e}")
+        self.file = file
+        for info in self.zip.infolist():
+            mode = info.external_attr >> 16
+            is_link = info.create_system == 3 and (mode & 0o170000) == 0o120000
+            self._add(info.filename, ArchiveMember(
+                None, info.file_size, _zip_mtime(info.date_time), (mode & 0o7777) or None,
+                is_dir=info.is_dir(), is_file=not info.is_dir() and not is_link, info=info))
+
+    def _load_tar(self, file):
+        import tarfile
+        if self.kind == 'tar-compressed' and os.fstat(file.fileno()).st_size > ARCHIVE_COMPRESSED_MAX_SIZE:
+            raise ArchiveError("Compressed tar archive is too large to browse; "
+                               "only uncompressed tar and ZIP archives allow direct member access")
+        try:
+            with tarfile.open(fileobj=file, mode='r:*') as archive:
+                for info in archive:
+                    self._add(info.name, ArchiveMember(
+                        None, info.size if info.isreg() else 0, info.mtime, info.mode,
+                        is_dir=info.isdir(), is_file=info.isreg(),
+                        link=info.linkname if info.issym() else None, info=info))
+        except (tarfile.TarError, EOFError, OSError) as e:
+            raise ArchiveError(f"Not a valid tar archive: {e}")
+
+    def _add(self, raw_name, member):
+        name = normalize_member(raw_name)
+        if not name:
+            return
+        member.name = name
+        if name in self.members and self.members[name].is_dir and not member.is_dir:
+            return
+        self.members[name] = member
+        parent, _, base = name.rpartition('/')
+        self._ensure_folder(parent)[base] = member
+        if member.is_dir:
+            self.children.setdefault(name, {})
+
+    def _ensure_folder(self, folder):
+        """Children of folder, creating the folders implied by member paths"""
+        children = self.children.get(folder)
+        if children is None:
+            children = self.children[folder] = {}
+            parent, _, base = folder.rpartition('/')
+            if folder not in self.members:
+                self.members[folder] = ArchiveMember(folder, is_dir=True)
+            self._ensure_folder(parent)[base] = self.members[folder]
+        return children
+
+    def listing(self, folder):
+        """(folders, files) directly inside folder, sorted by name; None if it is not a folder"""
+        children = self.children.get(normalize_member(folder) or '')
+        if children is None:
+            return None
+        entries = sorted(children.items())
+        return ([m for _, m in entries if m.is_dir], [m for _, m in entries if not m.is_dir])
+
+    def member(self, name):
+        name = normalize_member(name)
+        return self.members.get(name) if name else None
+
+    def open(self, member):
+        """Binary file object with a member's content, reading only that member's bytes"""
+        if not member.is_file:
+            raise ArchiveError("Not a regular file")
+        if self.kind == 'zip':
+            return self.zip.open(member.info)
+        if self.kind == 'tar' and member.info.sparse is None:
+            return MemberReader(open_file(self.path, self.root), member.info.offset_data, member.size)
+        # Compressed (or sparse) members can only be reached by reading up to them
+        import tarfile
+        file = open_file(self.path, self.root)
+        archive = tarfile.open(fileobj=file, mode='r:*')
+        stream = archive.extractfile(member.info)
+
+        def close():
+            # Closing the member closes the archive and the file under it
+            archive.close()
+            file.close()
+        stream.close = close
+        return stream
+
+    def acquire(self):
+        with self.lock:
+            self.users += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.users -= 1
+            close = self.retired and self.users == 0
+        if close:
+            self.close()
+
+    def retire(self):
+        """Called by the cache when the index is evicted or replaced"""
+        with self.lock:
+            self.retired = True
+            close = self.users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        if self.zip is not None:
+            # Only called once no request holds the index, so no member is being read
+            self.zip.close()
+            self.file.close()
+
+
+def _zip_mtime(date_time):
+    import time
+    try:
+        return time.mktime(date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return 0
+
+
+class ArchiveIndexCache:
+    """LRU cache of archive indexes, rebuilt when an archive's size, mtime or inode changes"""
+
+    def __init__(self, max_entries=ARCHIVE_INDEX_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # path -> (version, ArchiveIndex)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, root=None):
+        """Index of the archive at path, or raises ArchiveError.
+
+        The archive is opened through root's descriptor when root is given
+        (PermissionError outside it), and the cached index is only reused
+        for the very file that open returns. The index is returned acquired;
+        the caller must release() it.
+        """
+        kind = archive_kind(path)
+        if kind is None:
+            raise ArchiveError("Not a browsable archive")
+        file = open_file(path, root)
+        try:
+            st = os.fstat(file.fileno())
+            version = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None and entry[0] == version:
+                    self.hits += 1
+                    self.entries.move_to_end(path)
+                    file.close()
+                    return entry[1].acquire()
+                self.misses += 1
+            index = ArchiveIndex(path, kind, root, file)
+        except BaseException:
+            file.close()
+            raise
+        stale = []
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == version:
+                # Another request indexed it meanwhile
+                stale.append(index)
+                index = entry[1]
+            else:
+                if entry is not None:
+                    stale.append(entry[1])
+                self.entries[path] = (version, index)
+            while len(self.entries) > self.max_entries:
+                stale.append(self.entries.popitem(last=False)[1][1])
+            index.acquire()
+        for old in stale:
+            old.retire()
+        return index
@@ -0,0 +1,186 @@
+"""
+Streaming archive output for the Enhanced File Server
+Writes a selection of files and folders as one ZIP, tar or tar.gz archive
+straight to the response, without a temporary file: folders are walked
+while the archive is being sent, so the first bytes go out as soon as the
+first file is read, however large the selection is. tar.gz output is
+compressed on several cores, pigz-style, as a series of gzip members.
+"""
+
+import os
+import zlib
+import threading
+from collections import deque
+from config import *
+
+ARCHIVE_FORMATS = {
+    # format -> (file extension, content type)
+    'zip': ('.zip', 'application/zip'),
+    'tar': ('.tar', 'application/x-tar'),
+    'tar.gz': ('.tar.gz', 'application/gzip'),
+}
+
+_gzip_executor = None
+_gzip_executor_lock = threading.Lock()
+
+
+def gzip_worker_count():
+    return TAR_GZIP_WORKERS if TAR_GZIP_WORKERS > 0 else (os.cpu_count() or 1)
+
+
+def _get_gzip_executor():
+    """One compression pool shared by all downloads, so concurrent ones cannot oversubscribe the cores"""
+    global _gzip_executor
+    with _gzip_executor_lock:
+        if _gzip_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _gzip_executor = ThreadPoolExecutor(max_workers=gzip_worker_count(),
+                                                thread_name_prefix='gzip')
+        return _gzip_executor
+
+
+def gzip_member(block, level):
+    """Compress one block as a complete gzip member (zlib releases the GIL while deflating)"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(block) + compressor.flush()
+
+
+class ArchiveSink:
+    """Write-only file object handed to zipfile/tarfile; tell() lets zipfile stream without seeking"""
+
+    def __init__(self, write):
+        self._write = write
+        self.offset = 0
+
+    def write(self, data):
+        self._write(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+
+class ParallelGzipWriter:
+    """File object that gzips what is written to it in parallel, keeping the output in order.
+
+    The input is cut into TAR_GZIP_BLOCK_SIZE blocks, each compressed as an
+    independent gzip member on the shared pool; concatenated members are a
+    valid gzip stream (RFC 1952) for gzip, tar and browsers. At most a few
+    blocks per worker are in flight, which bounds the memory used.
+    """
+
+    def __init__(self, sink, level=TAR_GZIP_LEVEL, block_size=TAR_GZIP_BLOCK_SIZE):
+        self.sink = sink
+        self.level = level
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.max_pending = 2 * gzip_worker_count()
+        self.executor = _get_gzip_executor()
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self._submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def _submit(self, block):
+        self.pending.append(self.executor.submit(gzip_member, block, self.level))
+        while len(self.pending) > self.max_pending:
+            self.sink.write(self.pending.popleft().result())
+
+    def close(self):
+        """Compress what is left and write every remaining member"""
+        if self.buffer or not self.pending:
+            self._submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while self.pending:
+            self.sink.write(self.pending.popleft().result())
+
+    def flush(self):
+        pass
+
+
+def iter_entries(root, rel_paths, allowed):
+    """Yield (absolute path, archive name) for every selected path, walking folders lazily.
+
+    Archive names are relative to root, so the archive keeps the tree's
+    layout; paths selected twice (or inside a selected folder) appear once.
+    allowed(path) is checked for every entry, so symlinks leading out of
+    the browse root are skipped.
+    """
+    seen = set()
+    for rel_path in rel_paths:
+        top = os.path.join(root, rel_path)
+        for abs_path in _walk(top):
+            if not allowed(abs_path):
+                continue
+            arcname = os.path.relpath(abs_path, root).replace(os.sep, '/')
+            if arcname in seen:
+                continue
+            seen.add(arcname)
+            yield abs_path, arcname
+
+
+def _walk(top):
+    yield top
+    if os.path.islink(top) or not os.path.isdir(top):
+        return
+    for dir_path, dir_names, file_names in os.walk(top):
+        dir_names.sort()
+        for name in dir_names:
+            yield os.path.join(dir_path, name)
+        for name in sorted(file_names):
+            yield os.path.join(dir_path, name)
+
+
+def write_zip(entries, sink, compression=None, on_skip=None):
+    """Stream entries as a ZIP archive (local headers with data descriptors)"""
+    import zipfile
+    if compression is None:
+        compression = zipfile.ZIP_DEFLATED
+    with zipfile.ZipFile(sink, 'w', compression) as archive:
+        for abs_path, arcname in entries:
+            try:
+                # zipfile opens the file before it writes the entry header,
+                # so an unreadable file can be skipped without corrupting the archive
+                archive.write(abs_path, arcname)
+            except OSError as e:
+                if on_skip is not None:
+                    on_skip(abs_path, e)
+
+
+def write_tar(entries, sink, compress=False, on_skip=None):
+    """Stream entries as a tar archive, keeping permissions and symlinks; compress=True for tar.gz"""
+    import tarfile
+    output = ParallelGzipWriter(sink) if compress else sink
+    with tarfile.open(fileobj=output, mode='w|', format=tarfile.PAX_FORMAT) as archive:
+        for abs_path, arcname in entries:
+            try:
+                archive.add(abs_path, arcname, recursive=False)
+            except OSError as e:
+                if on_skip is not None:
+                    on_skip(abs_path, e)
+    if compress:
+        output.close()
+
+
+def write_archive(archive_format, entries, sink, on_skip=None):
+    """Stream entries in one of ARCHIVE_FORMATS"""
+    if archive_format == 'zip':
+        write_zip(entries, sink, on_skip=on_skip)
+    else:
+        write_tar(entries, sink, compress=archive_format == 'tar.gz', on_skip=on_skip)
+
+
+def archive_filename(rel_paths, archive_format):
+    """Download name: the selected item's name, or "selection" for several"""
+    extension = ARCHIVE_FORMATS[archive_format][0]
+    if len(rel_paths) == 1 and rel_paths[0].strip('/'):
+        return os.path.basename(rel_paths[0].rstrip('/')) + extension
+    return 'selection' + extension
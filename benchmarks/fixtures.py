@@ -0,0 +1,148 @@
+"""
+Synthetic directory trees for the benchmarks
+Every tree is generated from a fixed seed, so two runs (or two versions of
+the server) are measured against byte-identical fixtures. Trees are cached
+on disk and only rebuilt when their parameters change.
+"""
+
+import os
+import json
+import random
+import shutil
+
+# Default sizes; the benchmarks multiply the SCALED_KEYS with --scale
+TREE_DEFAULTS = {
+    'tiny': {'dirs': 100, 'files_per_dir': 200, 'max_size': 512},
+    'huge': {'size_mb': 64},
+    'deep': {'depth': 64, 'files_per_level': 4},
+    'wide': {'entries': 10000},
+}
+SCALED_KEYS = ('dirs', 'size_mb', 'depth', 'entries')
+
+SOURCE_SNIPPET = '''def handler(request, depth={n}):
+    """Synthetic function number {n}"""
+    total = 0
+    for index in range(depth):
+        total += index * {n}
+    return {{"status": 200, "total": total, "path": request.path}}
+
+'''
+
+
+def scaled(kind, scale=1.0):
+    """Return the parameters of a tree kind multiplied by scale"""
+    params = dict(TREE_DEFAULTS[kind])
+    for key, value in params.items():
+        if key in SCALED_KEYS:
+            params[key] = max(1, int(value * scale))
+    return params
+
+
+def text_file(rng, size):
+    """Deterministic source-like text of roughly size bytes"""
+    parts = []
+    length = 0
+    while length < size:
+        chunk = SOURCE_SNIPPET.format(n=rng.randrange(1000000))
+        parts.append(chunk)
+        length += len(chunk)
+    return ''.join(parts)[:size]
+
+
+def build_tiny(root, dirs, files_per_dir, max_size):
+    """Many tiny files spread over a flat set of directories"""
+    rng = random.Random(1)
+    extensions = ['.py', '.txt', '.json', '.md', '.bin', '.log']
+    for d in range(dirs):
+        dir_path = os.path.join(root, f"dir{d:04d}")
+        os.makedirs(dir_path, exist_ok=True)
+        for f in range(files_per_dir):
+            ext = extensions[f % len(extensions)]
+            size = rng.randrange(max_size + 1)
+            with open(os.path.join(dir_path, f"file{f:05d}{ext}"), 'wb') as out:
+                if ext == '.bin':
+                    out.write(rng.randbytes(size))
+                else:
+                    out.write(text_file(rng, size).encode('utf-8'))
+    return {
+        'browse': 'dir0000', 'view': 'dir0000/file00000.py', 'download': 'dir0000/file00001.txt',
+        'zip': 'dir0000', 'search': 'file00042', 'checksum': 'dir0000/file00002.json',
+    }
+
+
+def build_huge(root, size_mb):
+    """One large incompressible file next to a small text file"""
+    rng = random.Random(2)
+    os.makedirs(os.path.join(root, 'huge'), exist_ok=True)
+    block = 1024 * 1024
+    with open(os.path.join(root, 'huge', 'huge.bin'), 'wb') as out:
+        for _ in range(size_mb):
+            out.write(rng.randbytes(block))
+    with open(os.path.join(root, 'huge', 'notes.txt'), 'w') as out:
+        out.write(text_file(rng, 64 * 1024))
+    return {
+        'browse': 'huge', 'view': 'huge/notes.txt', 'download': 'huge/huge.bin',
+        'zip': 'huge', 'search': 'huge', 'checksum': 'huge/huge.bin',
+    }
+
+
+def build_deep(root, depth, files_per_level):
+    """A single chain of nested directories with a few files per level"""
+    rng = random.Random(3)
+    dir_path = root
+    rel_parts = []
+    for level in range(depth):
+        rel_parts.append(f"level{level:03d}")
+        dir_path = os.path.join(dir_path, rel_parts[-1])
+        os.makedirs(dir_path, exist_ok=True)
+        for f in range(files_per_level):
+            with open(os.path.join(dir_path, f"module{f}.py"), 'w') as out:
+                out.write(text_file(rng, rng.randrange(256, 8192)))
+    deepest = '/'.join(rel_parts)
+    return {
+        'browse': deepest, 'view': f"{deepest}/module0.py", 'download': f"{deepest}/module1.py",
+        'zip': 'level000', 'search': 'module3', 'checksum': f"{deepest}/module2.py",
+    }
+
+
+def build_wide(root, entries):
+    """One directory holding many entries, a tenth of them subdirectories"""
+    rng = random.Random(4)
+    dir_path = os.path.join(root, 'wide')
+    os.makedirs(dir_path, exist_ok=True)
+    for i in range(entries):
+        if i % 10 == 0:
+            os.makedirs(os.path.join(dir_path, f"sub{i:06d}"), exist_ok=True)
+        else:
+            with open(os.path.join(dir_path, f"entry{i:06d}.txt"), 'w') as out:
+                out.write(text_file(rng, rng.randrange(64, 2048)))
+    return {
+        'browse': 'wide', 'view': 'wide/entry000001.txt', 'download': 'wide/entry000002.txt',
+        'zip': 'wide', 'search': 'entry0099', 'checksum': 'wide/entry000003.txt',
+    }
+
+
+BUILDERS = {'tiny': build_tiny, 'huge': build_huge, 'deep': build_deep, 'wide': build_wide}
+
+
+def ensure_tree(base_dir, kind, scale=1.0):
+    """Build (or reuse) a fixture tree; returns (root, targets, params).
+
+    targets maps a route to the relative path it should be exercised with.
+    """
+    params = scaled(kind, scale)
+    name = kind + '-' + '-'.join(f"{key}{value}" for key, value in sorted(params.items()))
+    root = os.path.join(base_dir, name)
+    marker = os.path.join(base_dir, name + '.json')
+    if os.path.exists(marker):
+        with open(marker) as f:
+            return root, json.load(f), params
+
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+    print(f"Generating {kind} tree in {root} ...")
+    targets = BUILDERS[kind](root, **params)
+    with open(marker, 'w') as f:
+        json.dump(targets, f)
+    return root, targets, params
@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+End-to-end HTTP load benchmark for the Enhanced File Server
+Generates synthetic trees, starts the server in a child process on a local
+port and drives every route with concurrent clients. Reports throughput,
+p50/p95/p99 latency, server CPU time and RSS, and stores the results as JSON
+so two versions can be compared.
+
+Usage:
+    python benchmarks/http_bench.py run [--trees tiny,wide] [--concurrency 8] [--duration 10]
+    python benchmarks/http_bench.py compare old.json new.json
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import signal
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.parse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import TREE_DEFAULTS, ensure_tree
+
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), 'sheri-bench-fixtures')
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+UPLOAD_BOUNDARY = 'sheri-bench-boundary'
+READ_SIZE = 1024 * 1024
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(pct / 100 * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def upload_body(name, size):
+    data = (b'benchmark upload\n' * (size // 17 + 1))[:size]
+    return (f'--{UPLOAD_BOUNDARY}\r\nContent-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            f'Content-Type: text/plain\r\n\r\n').encode() + data + f'\r\n--{UPLOAD_BOUNDARY}--\r\n'.encode()
+
+
+def route_requests(targets, root):
+    """Return [(route label, method, path, body, headers)] for one fixture tree"""
+    import delta
+
+    def q(rel_path):
+        return urllib.parse.quote(rel_path)
+
+    signature = delta.encode_signature(*delta.compute_signature(os.path.join(root, targets['download'])))
+    return [
+        ('dashboard', 'GET', '/', None, {}),
+        ('upload_page', 'GET', '/upload', None, {}),
+        ('upload', 'POST', '/upload', upload_body('bench.txt', 64 * 1024),
+         {'Content-Type': f'multipart/form-data; boundary={UPLOAD_BOUNDARY}'}),
+        ('uploads', 'GET', '/uploads/bench.txt', None, {}),
+        ('browse', 'GET', f"/browse/{q(targets['browse'])}", None, {}),
+        ('browse_json', 'GET', f"/browse/{q(targets['browse'])}?format=json", None, {}),
+        ('view', 'GET', f"/view/{q(targets['view'])}", None, {}),
+        ('download', 'GET', f"/download/{q(targets['download'])}", None, {}),
+        ('zip', 'GET', f"/zip/{q(targets['zip'])}", None, {}),
+        ('search', 'GET', f"/search?q={q(targets['search'])}", None, {}),
+        ('changes', 'GET', '/changes', None, {}),
+        ('checksum', 'GET', f"/checksum/{q(targets['checksum'])}", None, {}),
+        ('signature', 'GET', f"/signature/{q(targets['download'])}", None, {}),
+        ('delta', 'POST', f"/delta/{q(targets['download'])}", signature, {}),
+        ('metrics', 'GET', '/metrics', None, {}),
+    ]
+
+
+class ServerProcess:
+    """The server running in a child process, so its CPU and memory are measured alone"""
+
+    def __init__(self, root, workdir, workers=1):
+        self.workdir = workdir
+        self.log = open(os.path.join(workdir, 'server.log'), 'w')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), 'serve', root, '--workers', str(workers)],
+            cwd=workdir, stdout=subprocess.PIPE, stderr=self.log, text=True)
+        self.port = int(self.process.stdout.readline())
+        self.ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+    def pids(self):
+        """The server process and its workers in multi-process mode (Linux only)"""
+        pids = [self.process.pid]
+        try:
+            with open(f'/proc/{self.process.pid}/task/{self.process.pid}/children') as f:
+                pids.extend(int(pid) for pid in f.read().split())
+        except OSError:
+            pass
+        return pids
+
+    def cpu_seconds(self):
+        """User + system CPU seconds used so far by all server processes (Linux only, else None)"""
+        total = 0
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                # utime, stime and those of children already reaped (restarted workers)
+                total += sum(int(value) for value in fields[11:15])
+        except (OSError, IndexError, ValueError):
+            return None
+        return total / self.ticks
+
+    def memory_mb(self):
+        """(current RSS, peak RSS) in MB summed over all server processes (Linux only, else (None, None))"""
+        values = {}
+        try:
+            for pid in self.pids():
+                with open(f'/proc/{pid}/status') as f:
+                    for line in f:
+                        if line.startswith(('VmRSS:', 'VmHWM:')):
+                            key = line.split(':')[0]
+                            values[key] = values.get(key, 0) + int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return values.get('VmRSS'), values.get('VmHWM')
+
+    def stop(self):
+        """Stop the server and return its total (cpu seconds, peak RSS MB)"""
+        self.process.send_signal(signal.SIGINT)
+        try:
+            _, _, usage = os.wait4(self.process.pid, 0)
+        except ChildProcessError:
+            return None, None
+        self.process.returncode = 0
+        self.log.close()
+        max_rss = usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+        return round(usage.ru_utime + usage.ru_stime, 3), round(max_rss, 1)
+
+
+class LoadGenerator:
+    """Concurrent clients sending one request spec until a count or time limit"""
+
+    def __init__(self, port, auth, keep_alive=False):
+        self.port = port
+        self.auth = auth
+        self.keep_alive = keep_alive
+
+    def run(self, method, path, body, headers, concurrency, duration, max_requests):
+        latencies = []
+        statuses = {}
+        counters = {'issued': 0, 'bytes': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+        request_headers = dict(headers, Authorization=self.auth)
+        if not self.keep_alive:
+            request_headers['Connection'] = 'close'
+
+        def client():
+            conn = None
+            while True:
+                with lock:
+                    if counters['issued'] >= max_requests or time.perf_counter() >= deadline:
+                        break
+                    counters['issued'] += 1
+                start = time.perf_counter()
+                received = 0
+                try:
+                    if conn is None:
+                        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=300)
+                    conn.request(method, path, body=body, headers=request_headers)
+                    response = conn.getresponse()
+                    while True:
+                        chunk = response.read(READ_SIZE)
+                        if not chunk:
+                            break
+                        received += len(chunk)
+                    status = response.status
+                    if not self.keep_alive or response.will_close:
+                        conn.close()
+                        conn = None
+                except (OSError, http.client.HTTPException):
+                    status = 'error'
+                    if conn is not None:
+                        conn.close()
+                        conn = None
+                elapsed = time.perf_counter() - start
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+                    counters['bytes'] += received
+                    if status == 'error' or status >= 400:
+                        counters['errors'] += 1
+            if conn is not None:
+                conn.close()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        latencies.sort()
+        ms = [value * 1000 for value in latencies]
+        return {
+            'requests': len(latencies),
+            'errors': counters['errors'],
+            'statuses': {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            'elapsed_s': round(wall, 3),
+            'throughput_rps': round(len(latencies) / wall, 2) if wall else None,
+            'mb_per_s': round(counters['bytes'] / wall / 1e6, 2) if wall else None,
+            'latency_ms': {
+                'min': round(ms[0], 3) if ms else None,
+                'mean': round(sum(ms) / len(ms), 3) if ms else None,
+                'p50': round(percentile(ms, 50), 3) if ms else None,
+                'p95': round(percentile(ms, 95), 3) if ms else None,
+                'p99': round(percentile(ms, 99), 3) if ms else None,
+                'max': round(ms[-1], 3) if ms else None,
+            },
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def wait_until_ready(load, timeout=120):
+    """Wait for the path index so search results are comparable between runs"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        conn = http.client.HTTPConnection('127.0.0.1', load.port, timeout=30)
+        try:
+            conn.request('GET', '/search?q=a&format=json', headers={'Authorization': load.auth})
+        except ConnectionRefusedError:
+            time.sleep(0.2)     # workers not listening yet
+            continue
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        if response.status == 200 and json.loads(body).get('index_ready'):
+            return
+        time.sleep(0.2)
+
+
+def run_benchmarks(args):
+    import config
+    auth = 'Basic ' + base64.b64encode(f'{config.USERNAME}:{config.PASSWORD}'.encode()).decode()
+    routes = set(args.routes.split(',')) if args.routes else None
+    results = []
+    totals = {}
+
+    for kind in args.trees.split(','):
+        root, targets, params = ensure_tree(args.fixtures_dir, kind, args.scale)
+        with tempfile.TemporaryDirectory(prefix='sheri-bench-') as workdir:
+            server = ServerProcess(root, workdir, args.workers)
+            load = LoadGenerator(server.port, auth, args.keep_alive)
+            try:
+                wait_until_ready(load)
+                for route, method, path, body, headers in route_requests(targets, root):
+                    if routes is not None and route not in routes:
+                        continue
+                    # Warm-up requests fill caches and are not measured
+                    load.run(method, path, body, headers, 1, args.duration, args.warmup)
+                    cpu_before = server.cpu_seconds()
+                    result = load.run(method, path, body, headers, args.concurrency,
+                                      args.duration, args.max_requests)
+                    cpu_after = server.cpu_seconds()
+                    rss, peak_rss = server.memory_mb()
+                    result.update({
+                        'tree': kind, 'route': route, 'method': method, 'path': path,
+                        'concurrency': args.concurrency,
+                        'server_cpu_s': round(cpu_after - cpu_before, 3) if cpu_before is not None else None,
+                        'server_rss_mb': round(rss, 1) if rss is not None else None,
+                        'server_peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+                    })
+                    if result['server_cpu_s'] is not None and result['requests']:
+                        result['server_cpu_ms_per_request'] = round(result['server_cpu_s'] * 1000 / result['requests'], 3)
+                    results.append(result)
+                    print_result(result)
+            finally:
+                cpu, max_rss = server.stop()
+            totals[kind] = {'params': params, 'server_cpu_s': cpu, 'server_peak_rss_mb': max_rss}
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'concurrency': args.concurrency,
+            'duration': args.duration,
+            'max_requests': args.max_requests,
+            'keep_alive': args.keep_alive,
+            'workers': args.workers,
+            'scale': args.scale,
+        },
+        'trees': totals,
+        'results': results,
+    }
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    print(f"{result['tree']:5} {result['route']:12} {result['requests']:6} req "
+          f"{result['throughput_rps'] or 0:9.1f} req/s  p50 {latency['p50'] or 0:9.2f}  "
+          f"p95 {latency['p95'] or 0:9.2f}  p99 {latency['p99'] or 0:9.2f} ms  "
+          f"cpu {result['server_cpu_s'] if result['server_cpu_s'] is not None else '-'} s  "
+          f"errors {result['errors']}")
+
+
+def compare(old_path, new_path, threshold):
+    """Print the change per tree and route; returns 1 when any p95 or throughput regressed"""
+    with open(old_path) as f:
+        old = {(r['tree'], r['route']): r for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['tree'], r['route']): r for r in json.load(f)['results']}
+
+    def change(before, after):
+        if not before or after is None:
+            return None
+        return (after - before) / before * 100
+
+    regressed = False
+    print(f"{'tree':5} {'route':12} {'req/s':>10} {'change':>8} {'p50 ms':>10} {'change':>8} {'p95 ms':>10} {'change':>8}")
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        rps = change(before['throughput_rps'], after['throughput_rps'])
+        p50 = change(before['latency_ms']['p50'], after['latency_ms']['p50'])
+        p95 = change(before['latency_ms']['p95'], after['latency_ms']['p95'])
+        flag = ''
+        if (rps is not None and rps < -threshold) or (p95 is not None and p95 > threshold):
+            flag = '  REGRESSION'
+            regressed = True
+        print(f"{key[0]:5} {key[1]:12} {after['throughput_rps'] or 0:10.1f} {rps or 0:+7.1f}% "
+              f"{after['latency_ms']['p50'] or 0:10.2f} {p50 or 0:+7.1f}% "
+              f"{after['latency_ms']['p95'] or 0:10.2f} {p95 or 0:+7.1f}%{flag}")
+    for key in sorted(set(old) ^ set(new)):
+        print(f"{key[0]:5} {key[1]:12} only in {'old' if key in old else 'new'} results")
+    return 1 if regressed else 0
+
+
+def serve(root, workers=1):
+    """Child process: run the server on a free local port and print the port"""
+    import server
+    server.BROWSE_ROOT = os.path.abspath(root)
+    os.makedirs(server.UPLOAD_DIR, exist_ok=True)
+    # Every benchmark client shares one address; per-client caps would turn most of them away
+    from admission import AdmissionController
+    server.ADMISSION = AdmissionController(client_limits={})
+    if workers > 1:
+        from prefork import Supervisor
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        server.sessions.load_secret()
+        print(port, flush=True)
+        Supervisor(server.run_worker, '127.0.0.1', port, workers=workers).run()
+        return
+    server.start_background_services()
+    httpd = server.create_server('127.0.0.1', 0)
+    print(httpd.server_address[1], flush=True)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop_background_services()
+    finally:
+        httpd.server_close()
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="HTTP load benchmark for the file server")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run the benchmark and store the results as JSON")
+    run.add_argument('--trees', default=','.join(TREE_DEFAULTS), help="fixture trees (default: all)")
+    run.add_argument('--routes', help="comma-separated routes to run (default: all)")
+    run.add_argument('--concurrency', type=int, default=8, help="concurrent clients")
+    run.add_argument('--duration', type=float, default=10, help="seconds per route")
+    run.add_argument('--max-requests', type=int, default=2000, help="request limit per route")
+    run.add_argument('--warmup', type=int, default=3, help="unmeasured requests before each route")
+    run.add_argument('--scale', type=float, default=1.0, help="multiply fixture sizes")
+    run.add_argument('--keep-alive', action='store_true', help="reuse client connections")
+    run.add_argument('--workers', type=int, default=1, help="server worker processes (pre-forked when > 1)")
+    run.add_argument('--fixtures-dir', default=DEFAULT_FIXTURES_DIR)
+    run.add_argument('--output', help="result file (default: benchmarks/results/http-<revision>-<time>.json)")
+
+    cmp = commands.add_parser('compare', help="compare two result files")
+    cmp.add_argument('old')
+    cmp.add_argument('new')
+    cmp.add_argument('--threshold', type=float, default=10, help="percent change reported as a regression")
+
+    child = commands.add_parser('serve', help=argparse.SUPPRESS)
+    child.add_argument('root')
+    child.add_argument('--workers', type=int, default=1)
+
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.root, args.workers)
+        return 0
+    if args.command == 'compare':
+        return compare(args.old, args.new, args.threshold)
+
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    report = run_benchmarks(args)
+    output = args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"http-{report['meta']['revision'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
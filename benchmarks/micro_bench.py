@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the per-entry and per-request hot paths
+Times FileServerUtils helpers and every TemplateRenderer.render_* method at
+several input sizes, and compares the timings with a stored baseline using a
+Mann-Whitney U test, so a slowdown is only reported when it is larger than
+the run-to-run noise.
+
+Usage:
+    python benchmarks/micro_bench.py --save-baseline        # record a baseline
+    python benchmarks/micro_bench.py                        # compare with it
+    python benchmarks/micro_bench.py --filter render_browser --repeat 30
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import text_file
+from utils import FileServerUtils
+from templates import TemplateRenderer
+
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DEFAULT_BASELINE = os.path.join(DEFAULT_RESULTS_DIR, 'micro-baseline.json')
+
+
+def mann_whitney_p(a, b):
+    """Two-sided p-value of the Mann-Whitney U test (normal approximation, tie corrected)"""
+    n1, n2 = len(a), len(b)
+    if n1 < 2 or n2 < 2:
+        return 1.0
+    ranked = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    ranks = [0.0] * len(ranked)
+    tie_term = 0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def measure(func, repeat, min_time):
+    """Return per-call seconds for each of `repeat` runs, timeit-style"""
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time / 5 or number >= 1 << 20:
+            break
+        number *= 2
+    number = max(1, int(number * min_time / max(time.perf_counter() - start, 1e-9)))
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        samples.append((time.perf_counter() - start) / number)
+    return samples, number
+
+
+class Fixtures:
+    """Files and template contexts of several sizes, generated from a fixed seed"""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix='sheri-micro-')
+        self.rng = random.Random(5)
+        self.utils = FileServerUtils()
+
+    def file(self, name, size, binary=False, encoding='utf-8'):
+        path = os.path.join(self.dir, name)
+        if not os.path.exists(path):
+            with open(path, 'wb') as f:
+                if binary:
+                    f.write(self.rng.randbytes(size))
+                else:
+                    text = text_file(self.rng, size)
+                    if encoding == 'latin-1':
+                        text = text.replace('e', '\xe9')
+                    f.write(text.encode(encoding))
+        return path
+
+    def nested(self, depth):
+        path = self.dir
+        for level in range(depth):
+            path = os.path.join(path, f"level{level:03d}")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def rel_path(self, depth):
+        return '/'.join(f"folder{level}" for level in range(depth))
+
+    def browser_context(self, entries):
+        directories = [{'name': f"sub{i:05d}", 'path': f"wide/sub{i:05d}", 'details': "Folder · 12.5 MB · 1,024 files"}
+                       for i in range(entries // 10)]
+        files = [{'name': f"entry{i:05d}.py", 'path': f"wide/entry{i:05d}.py", 'size': '1.2 KB', 'size_bytes': 1234,
+                  'icon': '🐍', 'can_view': i % 3 != 0}
+                 for i in range(entries - len(directories))]
+        return {'rel_path': 'wide', 'breadcrumbs': self.utils.generate_breadcrumbs('wide'),
+                'directories': directories, 'files': files, 'has_parent': True}
+
+    def search_context(self, matches):
+        return {'query': 'entry', 'scope': '', 'truncated': False, 'index_ready': True, 'elapsed_ms': '1.0',
+                'matches': [{'name': f"entry{i}.py", 'path': f"a/b/entry{i}.py", 'parent_dir': 'a/b',
+                             'is_dir': i % 5 == 0, 'icon': '🐍', 'can_view': True} for i in range(matches)]}
+
+    def viewer_context(self, size):
+        import html
+        content = html.escape(text_file(self.rng, size))
+        return {'filename': 'module.py', 'file_size': '1 KB', 'language': 'python', 'content': content,
+                'rel_path': 'src/module.py', 'parent_dir': 'src',
+                'breadcrumbs': self.utils.generate_file_breadcrumbs('src/module.py')}
+
+    def cleanup(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def benchmarks(fx):
+    """Yield (name, callable) pairs; names encode the input size"""
+    utils = FileServerUtils()
+    renderer = TemplateRenderer()
+
+    for label, path in (('known_ext', fx.file('code.py', 4096)),
+                        ('text_unknown_ext', fx.file('notes.dat', 4096)),
+                        ('binary_unknown_ext', fx.file('blob.dat2', 4096, binary=True))):
+        yield f"is_text_file[{label}]", lambda path=path: utils.is_text_file(path)
+
+    for depth in (1, 16, 64):
+        path = os.path.join(fx.nested(depth), 'file.txt')
+        yield f"is_safe_path[depth={depth}]", lambda path=path: utils.is_safe_path(path, fx.dir)
+
+    for value in (0, 1023, 5 * 1024 * 1024, 3 * 1024 ** 4):
+        yield f"format_file_size[{value}]", lambda value=value: utils.format_file_size(value)
+
+    for ext in ('.py', '.unknown'):
+        yield f"get_file_icon[{ext}]", lambda ext=ext: utils.get_file_icon(ext)
+
+    for depth in (1, 10, 50):
+        rel_path = fx.rel_path(depth)
+        yield f"generate_breadcrumbs[depth={depth}]", lambda rel_path=rel_path: utils.generate_breadcrumbs(rel_path)
+        yield (f"generate_file_breadcrumbs[depth={depth}]",
+               lambda rel_path=rel_path: utils.generate_file_breadcrumbs(rel_path + '/file.py'))
+
+    for size in (1024, 100 * 1024, 1024 * 1024):
+        path = fx.file(f"read{size}.txt", size)
+        yield f"read_file_content[utf8,{size}]", lambda path=path: utils.read_file_content(path)
+    path = fx.file('latin1.txt', 100 * 1024, encoding='latin-1')
+    yield f"read_file_content[latin1,{100 * 1024}]", lambda: utils.read_file_content(path)
+
+    # The per-entry work browse_directory does for each file in a listing
+    for entries in (10, 100, 1000):
+        directory = os.path.join(fx.dir, f"listing{entries}")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+            for i in range(entries):
+                with open(os.path.join(directory, f"entry{i:05d}{('.py', '.dat', '.bin')[i % 3]}"), 'w') as f:
+                    f.write(text_file(fx.rng, 256))
+
+        def listing(directory=directory):
+            for name in sorted(os.listdir(directory)):
+                item_path = os.path.join(directory, name)
+                if os.path.isfile(item_path):
+                    utils.format_file_size(os.path.getsize(item_path))
+                    utils.is_text_file(item_path)
+                    utils.get_file_icon(os.path.splitext(name)[1].lower())
+        yield f"browse_entries[{entries}]", listing
+
+    dashboard = {'uploaded_count': 12, 'browse_root': '/srv/files', 'server_address': '127.0.0.1:8000',
+                 'upload_dir': '/srv/uploads'}
+    yield "render_dashboard", lambda: renderer.render_dashboard(dashboard)
+
+    for entries in (10, 100, 1000, 10000):
+        context = fx.browser_context(entries)
+        yield f"render_browser[{entries}]", lambda context=context: renderer.render_browser(context)
+
+    for matches in (10, 200):
+        context = fx.search_context(matches)
+        yield f"render_search_results[{matches}]", lambda context=context: renderer.render_search_results(context)
+
+    for size in (1024, 100 * 1024, 1024 * 1024):
+        context = fx.viewer_context(size)
+        yield f"render_file_viewer[{size}]", lambda context=context: renderer.render_file_viewer(context)
+
+    for count in (0, 10, 1000):
+        context = {'uploaded_files': [{'name': f"upload{i}.bin", 'size': '3.1 MB'} for i in range(count)],
+                   'files_count': count}
+        yield f"render_upload_page[{count}]", lambda context=context: renderer.render_upload_page(context)
+
+    for count in (1, 50):
+        context = {'uploaded_files': [f"upload{i}.bin" for i in range(count)], 'files_count': count}
+        yield f"render_upload_success[{count}]", lambda context=context: renderer.render_upload_success(context)
+
+
+def format_time(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:8.2f} {unit}"
+    return f"{seconds / 1e-9:8.1f} ns"
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for utils and templates")
+    parser.add_argument('--filter', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--repeat', type=int, default=15, help="timed runs per benchmark")
+    parser.add_argument('--min-time', type=float, default=0.05, help="minimum seconds per timed run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline file to compare with")
+    parser.add_argument('--save-baseline', action='store_true', help="store this run as the baseline")
+    parser.add_argument('--threshold', type=float, default=5, help="percent change worth reporting")
+    parser.add_argument('--alpha', type=float, default=0.01, help="significance level")
+    parser.add_argument('--fail-on-regression', action='store_true', help="exit 1 on a significant slowdown")
+    parser.add_argument('--output', help="result file (default: benchmarks/results/micro-<revision>-<time>.json)")
+    args = parser.parse_args(argv)
+
+    baseline = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+
+    fx = Fixtures()
+    results = {}
+    regressions = []
+    try:
+        print(f"{'benchmark':42} {'median':>11} {'stdev':>8} {'baseline':>11} {'change':>8}  verdict")
+        for name, func in benchmarks(fx):
+            if args.filter and args.filter not in name:
+                continue
+            samples, number = measure(func, args.repeat, args.min_time)
+            median = statistics.median(samples)
+            results[name] = {
+                'median': median, 'mean': statistics.fmean(samples), 'min': min(samples),
+                'stdev': statistics.stdev(samples) if len(samples) > 1 else 0.0,
+                'loops': number, 'samples': samples,
+            }
+
+            line = f"{name:42} {format_time(median):>11} {results[name]['stdev'] / median * 100:7.1f}%"
+            old = baseline.get(name)
+            if old:
+                change = (median - old['median']) / old['median'] * 100
+                p_value = mann_whitney_p(samples, old['samples'])
+                verdict = '~'
+                if p_value < args.alpha and abs(change) >= args.threshold:
+                    verdict = 'SLOWER' if change > 0 else 'faster'
+                    if change > 0:
+                        regressions.append(name)
+                results[name].update({'baseline_median': old['median'], 'change_pct': round(change, 2),
+                                      'p_value': p_value})
+                line += f" {format_time(old['median']):>11} {change:+7.1f}%  {verdict} (p={p_value:.3g})"
+            print(line)
+    finally:
+        fx.cleanup()
+
+    report = {
+        'meta': {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'platform': platform.platform(),
+                 'repeat': args.repeat, 'min_time': args.min_time},
+        'results': results,
+    }
+    output = args.baseline if args.save_baseline else args.output or os.path.join(
+        DEFAULT_RESULTS_DIR, f"micro-{report['meta']['revision'] or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f"\n{'Baseline' if args.save_baseline else 'Results'} written to {output}")
+    if regressions:
+        print(f"Significant slowdowns: {', '.join(regressions)}")
+    return 1 if regressions and args.fail_on_regression else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
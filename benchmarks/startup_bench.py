@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the Enhanced File Server
+Launches server.py headless in a fresh interpreter, the way a service manager
+would, and measures the time until it accepts a connection and until it
+answers its first request. A bare interpreter start and a plain
+`import server` are timed alongside so the server's own share is visible.
+
+Usage:
+    python benchmarks/startup_bench.py [--runs 10] [--tree wide] [--scale 1]
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import signal
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fixtures import TREE_DEFAULTS, ensure_tree
+
+DEFAULT_FIXTURES_DIR = os.path.join(tempfile.gettempdir(), 'sheri-bench-fixtures')
+DEFAULT_RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def child_env(**overrides):
+    """Environment for the measured interpreters; they may write bytecode like a normal install"""
+    env = dict(os.environ, **overrides)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    return env
+
+
+def time_command(args, cwd):
+    """Wall-clock seconds for a command to run to completion"""
+    started = time.perf_counter()
+    subprocess.run(args, cwd=cwd, env=child_env(), check=True,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def time_server_start(root, workdir, timeout=30):
+    """(seconds to first accepted connection, seconds to first response) of one server start"""
+    port = free_port()
+    env = child_env(PYTHONPATH=REPO_ROOT, SHERI_STATE_DIR=os.path.join(workdir, 'state'),
+                    SHERI_UPLOAD_DIR=os.path.join(workdir, 'uploads'), SHERI_SERVER_IP='127.0.0.1')
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        # -m loads server from its bytecode cache; a script path is recompiled on every start
+        [sys.executable, '-m', 'server', root,
+         '--host', '127.0.0.1', '--port', str(port), '--workers', '1', '--quiet'],
+        cwd=workdir, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        while True:
+            try:
+                sock = socket.create_connection(('127.0.0.1', port))
+                break
+            except ConnectionRefusedError:
+                if time.perf_counter() > deadline or process.poll() is not None:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.0005)
+        accepted = time.perf_counter() - started
+        with sock:
+            # /login needs no credentials and no background service
+            sock.sendall(b'GET /login HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+            first = sock.recv(65536)
+        responded = time.perf_counter() - started
+        if not first.startswith(b'HTTP/1.1 200'):
+            raise RuntimeError(f"unexpected response: {first[:60]!r}")
+        return accepted, responded
+    finally:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def summarize(samples):
+    ms = sorted(value * 1000 for value in samples)
+    return {'median_ms': round(statistics.median(ms), 2), 'min_ms': round(ms[0], 2), 'max_ms': round(ms[-1], 2)}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Startup time benchmark for the file server")
+    parser.add_argument('--runs', type=int, default=10, help="server starts to measure")
+    parser.add_argument('--tree', default='wide', choices=list(TREE_DEFAULTS), help="fixture tree to serve")
+    parser.add_argument('--scale', type=float, default=1.0, help="multiply fixture sizes")
+    parser.add_argument('--fixtures-dir', default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument('--output', help="also write the results as JSON to this file")
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.fixtures_dir, exist_ok=True)
+    root, _, params = ensure_tree(args.fixtures_dir, args.tree, args.scale)
+    samples = {'interpreter': [], 'import_server': [], 'first_accept': [], 'first_response': []}
+    # Unmeasured start: writes the bytecode caches and warms the page cache
+    with tempfile.TemporaryDirectory(prefix='sheri-startup-') as workdir:
+        time_server_start(root, workdir)
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory(prefix='sheri-startup-') as workdir:
+            samples['interpreter'].append(time_command([sys.executable, '-c', 'pass'], workdir))
+            samples['import_server'].append(
+                time_command([sys.executable, '-c', 'import server'], REPO_ROOT))
+            accepted, responded = time_server_start(root, workdir)
+            samples['first_accept'].append(accepted)
+            samples['first_response'].append(responded)
+
+    results = {name: summarize(values) for name, values in samples.items()}
+    for name, result in results.items():
+        print(f"{name:15} median {result['median_ms']:8.2f} ms   min {result['min_ms']:8.2f}   "
+              f"max {result['max_ms']:8.2f}")
+
+    if args.output:
+        report = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'runs': args.runs,
+                'tree': args.tree,
+                'params': params,
+            },
+            'results': results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
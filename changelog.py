@@ -0,0 +1,418 @@
+"""
+Change journal for the Enhanced File Server
+Records every created, modified and deleted path under the browse root with
+a sequence number so clients can sync incrementally from a cursor
+"""
+
+import os
+import json
+import fcntl
+import stat
+import time
+import threading
+from config import *
+
+
+class ChangeJournal:
+    """Persisted, append-only journal of changes under a root directory.
+
+    The journal is fed by the change watcher. Alongside it a snapshot of
+    every path's (is_dir, mtime_ns, size) is kept and saved periodically, so
+    changes made while the server was stopped are found and journaled by
+    diffing the snapshot against the tree at startup.
+
+    Cursors have the form '<journal id>:<sequence>'. A cursor from another
+    journal, or one older than the oldest retained entry, cannot be served
+    incrementally and the client is told to reset.
+
+    Several worker processes can share one state directory: the process
+    holding the lock on changes.lock writes the journal, the others follow
+    it by reading what it appends (so every worker serves the same cursors)
+    and take over when the writer exits.
+    """
+
+    def __init__(self, root, state_dir=STATE_DIR, max_entries=CHANGE_JOURNAL_MAX_ENTRIES):
+        self.root = os.path.realpath(root)
+        self.max_entries = max_entries
+        self.journal_path = os.path.join(state_dir, 'changes.jsonl')
+        self.snapshot_path = os.path.join(state_dir, 'snapshot.json')
+        self.lock_path = os.path.join(state_dir, 'changes.lock')
+        self.lock = threading.Lock()
+        self.following = False    # another process writes the journal
+        self._lock_file = None
+        self._follow_version = None   # (inode, bytes read) of the journal file being followed
+        self.journal_id = None
+        self.entries = []         # retained entries, consecutive sequence numbers
+        self.first_seq = 1        # sequence number of entries[0]
+        self.last_seq = 0
+        self.snapshot = {}        # relative path -> [is_dir, mtime_ns, size]
+        self.dirty = False
+        self._journal_file = None
+        self._stop = threading.Event()
+        os.makedirs(state_dir, exist_ok=True)
+
+        # Our own files must not show up in the journal when the state
+        # directory lives inside the browse root
+        self.ignored_path = None
+        state_real = os.path.realpath(state_dir)
+        if state_real.startswith(self.root + os.sep):
+            self.ignored_path = os.path.relpath(state_real, self.root).replace(os.sep, '/')
+
+    def is_ignored(self, rel_path):
+        return self.ignored_path is not None and (
+            rel_path == self.ignored_path or rel_path.startswith(self.ignored_path + '/'))
+
+    def open(self):
+        """Become the journal writer if no other process is, else follow the writer"""
+        if self._try_lead():
+            self.load()
+        else:
+            self.follow()
+
+    def _try_lead(self):
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held until this process exits, which releases the lock for a follower
+        self._lock_file = lock_file
+        return True
+
+    def follow(self):
+        """Read the journal another process writes, from its last snapshot on"""
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            saved = None
+        with self.lock:
+            self.following = True
+            if saved is None or saved.get('root') != self.root:
+                # The writer has not saved a journal for this root yet
+                self.journal_id = None
+                self.snapshot = {}
+                self.entries = []
+                self.first_seq = 1
+                self.last_seq = 0
+                self._follow_version = None
+                return
+            self.journal_id = saved['journal_id']
+            self.snapshot = saved['entries']
+            self.snapshot_seq = saved['seq']
+            self.entries = []
+            self.first_seq = self.snapshot_seq + 1
+            self.last_seq = self.snapshot_seq
+            self._follow_version = None
+            self._read_appended()
+
+    def _read_appended(self):
+        """Take in entries the writer appended since the last call; the caller holds the lock"""
+        try:
+            f = open(self.journal_path, 'rb')
+        except OSError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            inode, offset = self._follow_version or (st.st_ino, 0)
+            if inode != st.st_ino or st.st_size < offset:
+                return False  # rewritten by a compaction
+            f.seek(offset)
+            data = f.read()
+        # A line still being written has no newline yet; it is read next time
+        complete = data[:data.rfind(b'\n') + 1]
+        for line in complete.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry['seq'] <= self.last_seq and self.entries:
+                continue
+            if not self.entries:
+                self.first_seq = entry['seq']
+            self.entries.append(entry)
+            self.last_seq = entry['seq']
+            if entry['seq'] > self.snapshot_seq:
+                self._apply_to_snapshot(entry)
+        self._follow_version = (st.st_ino, offset + len(complete))
+        return True
+
+    def take_over(self):
+        """Become the writer once the writer process has exited; True if this process now writes"""
+        if not self._try_lead():
+            return False
+        with self.lock:
+            self.following = False
+        self.load()
+        return True
+
+    def refresh(self):
+        """Catch up with the writer (followers only)"""
+        if not self.following:
+            return
+        with self.lock:
+            current = self.journal_id is not None and self._read_appended() is not False
+        if not current:
+            self.follow()
+
+    def load(self):
+        """Load the persisted state and journal anything changed while stopped"""
+        saved = None
+        try:
+            with open(self.snapshot_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if saved is None or saved.get('root') != self.root:
+            # No usable history: start a new journal from the current tree
+            import uuid
+            self.journal_id = uuid.uuid4().hex[:12]
+            self.snapshot = self._scan()
+            self.entries = []
+            self.first_seq = 1
+            self.last_seq = 0
+            self._rewrite_journal()
+            self.save_snapshot()
+            return
+
+        self.journal_id = saved['journal_id']
+        self.snapshot = saved['entries']
+        snapshot_seq = saved['seq']
+        self.entries = []
+        try:
+            with open(self.journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        break  # torn final line from a crash
+        except OSError:
+            pass
+        if self.entries:
+            self.first_seq = self.entries[0]['seq']
+            self.last_seq = self.entries[-1]['seq']
+        else:
+            self.first_seq = snapshot_seq + 1
+            self.last_seq = snapshot_seq
+
+        # Entries written after the last snapshot save are not in it yet
+        for entry in self.entries:
+            if entry['seq'] > snapshot_seq:
+                self._apply_to_snapshot(entry)
+
+        self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+        self.resync()
+
+    def _scan(self):
+        entries = {}
+        stack = ['']
+        while stack:
+            rel_dir = stack.pop()
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            try:
+                with os.scandir(abs_dir) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                        if self.is_ignored(rel_path):
+                            continue
+                        entries[rel_path] = [is_dir, st.st_mtime_ns, 0 if is_dir else st.st_size]
+                        if is_dir:
+                            stack.append(rel_path)
+            except OSError:
+                continue
+        return entries
+
+    def resync(self):
+        """Diff the whole tree against the snapshot and journal the differences"""
+        current = self._scan()
+        with self.lock:
+            old = self.snapshot
+            for rel_path in sorted(old.keys() - current.keys()):
+                if rel_path in old:  # not already removed with a deleted parent
+                    self._record('deleted', rel_path, old[rel_path][0], None, None)
+            for rel_path, (is_dir, mtime_ns, size) in sorted(current.items()):
+                previous = old.get(rel_path)
+                if previous is None:
+                    self._record('created', rel_path, is_dir, mtime_ns, size)
+                elif previous[0] != is_dir:
+                    self._record('deleted', rel_path, previous[0], None, None)
+                    self._record('created', rel_path, is_dir, mtime_ns, size)
+                elif not is_dir and (previous[1] != mtime_ns or previous[2] != size):
+                    self._record('modified', rel_path, is_dir, mtime_ns, size)
+            self.snapshot = current
+            self.dirty = True
+
+    def _apply_to_snapshot(self, entry):
+        if entry['op'] == 'deleted':
+            self.snapshot.pop(entry['path'], None)
+            if entry['is_dir']:
+                prefix = entry['path'] + '/'
+                for rel_path in [p for p in self.snapshot if p.startswith(prefix)]:
+                    del self.snapshot[rel_path]
+        else:
+            self.snapshot[entry['path']] = [entry['is_dir'], entry['mtime_ns'], entry['size']]
+
+    def _record(self, op, rel_path, is_dir, mtime_ns, size):
+        """Append one entry; the caller holds the lock"""
+        self.last_seq += 1
+        entry = {
+            'seq': self.last_seq,
+            'time': round(time.time(), 3),
+            'op': op,
+            'path': rel_path,
+            'is_dir': is_dir,
+            'mtime_ns': mtime_ns,
+            'size': size,
+        }
+        self.entries.append(entry)
+        self._apply_to_snapshot(entry)
+        self.dirty = True
+        if self._journal_file is not None:
+            self._journal_file.write(json.dumps(entry) + '\n')
+            self._journal_file.flush()
+        if len(self.entries) > self.max_entries:
+            self._compact()
+
+    def _compact(self):
+        """Drop the oldest half of the retained entries"""
+        drop = len(self.entries) - self.max_entries // 2
+        self.entries = self.entries[drop:]
+        self.first_seq = self.entries[0]['seq']
+        # Followers rebuild from the snapshot plus the rewritten journal, so
+        # the snapshot must cover the dropped entries before they go
+        self._write_snapshot(self._snapshot_data())
+        self._rewrite_journal()
+
+    def _rewrite_journal(self):
+        if self._journal_file is not None:
+            self._journal_file.close()
+        temp_path = self.journal_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + '\n')
+        os.replace(temp_path, self.journal_path)
+        self._journal_file = open(self.journal_path, 'a', encoding='utf-8')
+
+    def save_snapshot(self):
+        """Write the snapshot atomically so a restart can detect offline changes"""
+        # Written under the lock so an older snapshot cannot replace the one
+        # a compaction has just written
+        with self.lock:
+            self._write_snapshot(self._snapshot_data())
+
+    def _snapshot_data(self):
+        """Serialize the snapshot; the caller holds the lock"""
+        self.dirty = False
+        return json.dumps({
+            'root': self.root,
+            'journal_id': self.journal_id,
+            'seq': self.last_seq,
+            'entries': self.snapshot,
+        })
+
+    def _write_snapshot(self, data):
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(temp_path, self.snapshot_path)
+
+    def apply_change(self, event):
+        """Journal a change watcher event"""
+        if self.following:
+            return  # the writer process journals it
+        if event.kind == 'rescan':
+            self.resync()
+            return
+        rel_path = event.rel_path
+        if not rel_path or self.is_ignored(rel_path):
+            return
+        with self.lock:
+            previous = self.snapshot.get(rel_path)
+            if event.kind == 'deleted':
+                if previous is not None:
+                    self._record('deleted', rel_path, previous[0], None, None)
+                return
+            try:
+                st = os.stat(event.path, follow_symlinks=False)
+            except OSError:
+                return  # already gone, the delete event follows
+            is_dir = stat.S_ISDIR(st.st_mode)
+            mtime_ns, size = st.st_mtime_ns, 0 if is_dir else st.st_size
+            if previous is None:
+                self._record('created', rel_path, is_dir, mtime_ns, size)
+            elif previous[0] != is_dir:
+                self._record('deleted', rel_path, previous[0], None, None)
+                self._record('created', rel_path, is_dir, mtime_ns, size)
+            elif not is_dir and (previous[1] != mtime_ns or previous[2] != size):
+                self._record('modified', rel_path, is_dir, mtime_ns, size)
+
+    def cursor(self, seq=None):
+        return f"{self.journal_id}:{self.last_seq if seq is None else seq}"
+
+    def changes_since(self, cursor, limit=CHANGE_FEED_PAGE_SIZE):
+        """Return the changes after cursor.
+
+        Multiple changes to the same path within a page are collapsed into
+        the latest one. Deleting a directory implies deleting its contents. The result has 'reset': True when the cursor cannot
+        be served incrementally; the client should then fetch the snapshot.
+        """
+        self.refresh()
+        with self.lock:
+            journal_id, _, seq_text = (cursor or '').partition(':')
+            try:
+                since = int(seq_text)
+            except ValueError:
+                since = -1
+            if journal_id != self.journal_id or since < self.first_seq - 1 or since > self.last_seq:
+                return {'reset': True, 'cursor': self.cursor(), 'changes': [], 'more': False}
+
+            start = since - self.first_seq + 1
+            page = self.entries[start:start + limit]
+            next_seq = page[-1]['seq'] if page else since
+
+        latest = {}
+        for entry in page:
+            previous = latest.pop(entry['path'], None)
+            if previous is not None and previous['op'] == 'created' and entry['op'] == 'modified':
+                entry = dict(entry, op='created')
+            latest[entry['path']] = entry
+        changes = sorted(latest.values(), key=lambda entry: entry['seq'])
+        return {
+            'reset': False,
+            'cursor': self.cursor(next_seq),
+            'changes': changes,
+            'more': next_seq < self.last_seq,
+        }
+
+    def snapshot_listing(self):
+        """Return every known path with the cursor it is consistent with"""
+        self.refresh()
+        with self.lock:
+            entries = [
+                {'path': rel_path, 'is_dir': is_dir, 'mtime_ns': mtime_ns, 'size': size}
+                for rel_path, (is_dir, mtime_ns, size) in sorted(self.snapshot.items())
+            ]
+            return {'cursor': self.cursor(), 'entries': entries}
+
+    def start(self, interval=CHANGE_SNAPSHOT_INTERVAL):
+        """Save the snapshot in the background whenever it has changed"""
+        def run():
+            while not self._stop.wait(interval):
+                if self.following:
+                    self.take_over()
+                elif self.dirty:
+                    self.save_snapshot()
+
+        threading.Thread(target=run, name='change-journal', daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self.dirty and not self.following:
+            self.save_snapshot()
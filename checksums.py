@@ -0,0 +1,162 @@
+"""
+Content checksum service for the Enhanced File Server
+Hashes files in a process pool and caches digests per file version so
+integrity information can be served without re-reading the file
+"""
+
+import os
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import BrokenExecutor
+from config import *
+from pathres import open_file
+
+SUPPORTED_ALGORITHMS = ('sha256', 'sha512', 'sha1', 'md5')
+
+# Names used in Digest / Repr-Digest headers
+DIGEST_HEADER_NAMES = {'sha256': 'sha-256', 'sha512': 'sha-512', 'sha1': 'sha', 'md5': 'md5'}
+
+
+def hash_file(file_path, algorithm, root=None):
+    """Hash a whole file (opened through root's descriptor when given); runs inside the worker processes"""
+    digest = hashlib.new(algorithm)
+    with open_file(file_path, root) as f:
+        while True:
+            chunk = f.read(CHECKSUM_READ_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def version_key(st):
+    """Identify one version of a file: same inode, size and mtime means same bytes"""
+    return f"{st.st_dev}:{st.st_ino}:{st.st_size}:{st.st_mtime_ns}"
+
+
+def digest_header_value(algorithm, hexdigest):
+    """Format a digest as used by the Digest header (RFC 3230), e.g. sha-256=<base64>"""
+    encoded = base64.b64encode(bytes.fromhex(hexdigest)).decode('ascii')
+    return f"{DIGEST_HEADER_NAMES[algorithm]}={encoded}"
+
+
+class ChecksumService:
+    """Cache of file digests keyed by (device, inode, size, mtime).
+
+    Hashing runs in a process pool so large files use other cores and never
+    hold the GIL of the request threads. Identical requests for a file that
+    is already being hashed share the same future.
+    """
+
+    def __init__(self, workers=CHECKSUM_WORKERS, max_entries=CHECKSUM_CACHE_ENTRIES, state_dir=STATE_DIR):
+        self.workers = workers
+        self.max_entries = max_entries
+        self.cache_path = os.path.join(state_dir, 'checksums.json')
+        self.lock = threading.Lock()
+        self.cache = OrderedDict()    # (version key, algorithm) -> hex digest
+        self.in_flight = {}           # (version key, algorithm) -> Future
+        self.executor = None
+        self.hits = 0
+        self.misses = 0
+
+    def _get_executor(self):
+        if self.executor is None:
+            # Imported here: multiprocessing is only needed once something is hashed
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # forkserver avoids forking a process that is running server threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self.executor
+
+    def store(self, st, algorithm, hexdigest):
+        """Remember a digest for the file version described by st"""
+        key = (version_key(st), algorithm)
+        with self.lock:
+            self.cache[key] = hexdigest
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def cached(self, file_path, algorithm='sha256', st=None):
+        """Return the cached digest of the current file version, or None"""
+        try:
+            st = st or os.stat(file_path)
+        except OSError:
+            return None
+        key = (version_key(st), algorithm)
+        with self.lock:
+            hexdigest = self.cache.get(key)
+            if hexdigest is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return hexdigest
+
+    def submit(self, file_path, algorithm='sha256', root=None):
+        """Start hashing a file in the background and return a Future; root confines the open as in pathres"""
+        st = os.stat(file_path)
+        key = (version_key(st), algorithm)
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+            try:
+                future = self._get_executor().submit(hash_file, file_path, algorithm, root)
+            except BrokenExecutor:
+                # A worker died (e.g. killed by the OOM killer); start a fresh pool
+                self.executor = None
+                future = self._get_executor().submit(hash_file, file_path, algorithm, root)
+            self.in_flight[key] = future
+
+        def finished(done):
+            with self.lock:
+                self.in_flight.pop(key, None)
+            if done.cancelled() or done.exception() is not None:
+                return
+            try:
+                # Only cache if the file did not change while it was hashed
+                if version_key(os.stat(file_path)) == key[0]:
+                    self.store(st, algorithm, done.result())
+            except OSError:
+                pass
+
+        future.add_done_callback(finished)
+        return future
+
+    def get(self, file_path, algorithm='sha256', timeout=None, root=None):
+        """Return the digest of a file, hashing it first if needed"""
+        hexdigest = self.cached(file_path, algorithm)
+        if hexdigest is not None:
+            return hexdigest
+        return self.submit(file_path, algorithm, root).result(timeout)
+
+    def load(self):
+        """Load digests saved by a previous run"""
+        try:
+            with open(self.cache_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for key, algorithm, hexdigest in saved[-self.max_entries:]:
+                self.cache[(key, algorithm)] = hexdigest
+
+    def save(self):
+        with self.lock:
+            data = json.dumps([[key, algorithm, hexdigest] for (key, algorithm), hexdigest in self.cache.items()])
+        temp_path = self.cache_path + '.tmp'
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.cache_path)
+
+    def stop(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.save()
@@ -3,19 +3,21 @@ Configuration file for the Enhanced File Server
 Contains all server settings and constants
 """
 
-# Server Configuration
-PORT = 8000
-USERNAME = "Vajra"
-PASSWORD = "Anja"  # Change this!
-UPLOAD_DIR = "./uploads"  # Directory for uploads
-HOST = "0.0.0.0"  # Listen on all interfaces
+import os
+import socket
 
-# This will be set during startup
-BROWSE_ROOT = None
+# Server Configuration (each setting can be overridden with a SHERI_* environment variable)
+PORT = int(os.environ.get("SHERI_PORT", 8000))
+USERNAME = os.environ.get("SHERI_USERNAME", "Vajra")
+PASSWORD = os.environ.get("SHERI_PASSWORD", "Anja")  # Change this!
+UPLOAD_DIR = os.environ.get("SHERI_UPLOAD_DIR", "./uploads")  # Directory for uploads
+STATE_DIR = os.environ.get("SHERI_STATE_DIR", "./.sheri")  # Directory for persisted server state (journals, caches)
+HOST = os.environ.get("SHERI_HOST", "0.0.0.0")  # Listen on all interfaces
 
-# IP Detection
-import socket
+# Set from the command line, SHERI_BROWSE_ROOT or the startup prompt
+BROWSE_ROOT = os.environ.get("SHERI_BROWSE_ROOT") or None
 
+# IP Detection
 def get_local_ip():
     """Get the local IP address of the machine"""
     try:
@@ -30,8 +32,14 @@ def get_local_ip():
         except:
             return "127.0.0.1"  # Final fallback
 
-# Get system IP
-SERVER_IP = get_local_ip()
+_server_ip = os.environ.get("SHERI_SERVER_IP")
+
+def get_server_ip():
+    """The address shown to users; detected on first use (which may wait for DNS) and cached"""
+    global _server_ip
+    if _server_ip is None:
+        _server_ip = get_local_ip()
+    return _server_ip
 
 # File type mappings for syntax highlighting
 LANGUAGE_MAP = {
@@ -65,10 +73,146 @@ FILE_ICONS = {
     '.jpg': '🖼️', '.jpeg': '🖼️', '.png': '🖼️', '.gif': '🖼️',
     '.mp4': '🎬', '.avi': '🎬', '.mov': '🎬',
     '.mp3': '🎵', '.wav': '🎵', '.flac': '🎵',
-    '.zip': '📦', '.rar': '📦', '.7z': '📦',
+    '.zip': '📦', '.rar': '📦', '.7z': '📦', '.tar': '📦', '.gz': '📦', '.tgz': '📦',
     '.py': '🐍', '.js': '📜', '.html': '🌐', '.css': '🎨',
     '.xlsx': '📊', '.csv': '📊',
 }
 
 # Maximum file size for viewing (10MB)
 MAX_VIEW_FILE_SIZE = 10 * 1024 * 1024
+
+# Path search index
+SEARCH_INDEX_REFRESH_INTERVAL = 30  # Seconds between incremental index refreshes
+SEARCH_MAX_RESULTS = 200  # Maximum number of results returned per search
+
+# Change watching
+WATCH_BACKEND = "auto"  # "auto" (inotify when available), "inotify" or "polling"
+WATCH_POLL_INTERVAL = 5  # Seconds between scans for the polling backend
+
+# Change feed for incremental client sync
+CHANGE_JOURNAL_MAX_ENTRIES = 100000  # Entries kept before the oldest are compacted away
+CHANGE_FEED_PAGE_SIZE = 1000  # Maximum journal entries returned per request
+CHANGE_SNAPSHOT_INTERVAL = 60  # Seconds between snapshot saves
+
+# Directory size accounting
+DIRSIZE_WORKERS = 2  # Background threads walking directory trees (bounds disk I/O)
+
+# Content checksums
+CHECKSUM_WORKERS = 2  # Processes hashing files in the background
+CHECKSUM_CACHE_ENTRIES = 100000  # Digests kept in memory (and persisted in STATE_DIR)
+CHECKSUM_READ_SIZE = 1024 * 1024  # Read size while hashing
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Copy size when saving uploaded files
+
+# Block-level delta downloads
+DELTA_MIN_BLOCK_SIZE = 2048  # Smallest block size clients may use
+DELTA_MAX_BLOCK_SIZE = 1024 * 1024  # Largest block size clients may use
+DELTA_MAX_SIGNATURE_SIZE = 64 * 1024 * 1024  # Largest signature accepted in a request body
+DELTA_ROLLING_BUDGET = 1024 * 1024  # Bytes searched byte-by-byte before falling back to aligned checks
+DELTA_LITERAL_CHUNK = 64 * 1024  # Maximum size of one literal record in a delta stream
+DELTA_READ_SIZE = 1024 * 1024  # Bytes read at a time while computing a delta
+DELTA_SIGNATURE_CACHE_ENTRIES = 64  # Server-side file signatures kept in memory
+
+# Request phase timing
+SERVER_TIMING_ENABLED = True  # Send a Server-Timing header with each response
+SLOW_REQUEST_THRESHOLD_MS = 1000  # Requests slower than this are logged (None disables the log)
+SLOW_REQUEST_LOG = STATE_DIR + "/slow_requests.jsonl"  # Slow request log (JSON lines)
+
+# On-demand profiling (/debug/profile)
+PROFILING_ENABLED = True  # Allow authenticated users to start profiling sessions
+PROFILE_DIR = STATE_DIR + "/profiles"  # Where profile results are written
+PROFILE_MAX_REQUESTS = 10000  # Largest number of requests one session may cover
+PROFILE_MAX_SECONDS = 600  # Longest sampling session
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_TRACEMALLOC_FRAMES = 10  # Frames stored per allocation traceback
+PROFILE_REPORT_LINES = 40  # Lines per section in text reports
+
+# HTTP/1.1 persistent connections
+KEEPALIVE_TIMEOUT = 15  # Seconds an idle connection is kept open for the next request
+KEEPALIVE_MAX_REQUESTS = 100  # Requests served on one connection before it is closed
+REQUEST_TIMEOUT = 300  # Socket timeout while a request is being received or sent
+STREAM_CHUNK_SIZE = 64 * 1024  # Buffer size for chunked (streamed) responses
+
+# Login sessions
+CREDENTIAL_BACKEND = "sessions:ConfigCredentials"  # "module:Class" that verifies username/password at login
+SESSION_COOKIE = "sheri_session"  # Name of the session cookie
+SESSION_LIFETIME = 12 * 60 * 60  # Seconds a session stays valid
+SESSION_COOKIE_SECURE = False  # Set True when served over HTTPS
+SESSION_SECRET_FILE = STATE_DIR + "/session_secret"  # Signing key, created on first start
+SESSION_REVOKED_FILE = STATE_DIR + "/revoked_sessions"  # Logged-out sessions, shared by all worker processes
+LOGIN_MAX_BODY = 8192  # Largest login form accepted
+
+# Bandwidth shaping for bulk transfers (downloads, ZIP archives, deltas)
+SHAPING_GLOBAL_RATE = None  # Bytes/s for all bulk transfers together, shared fairly between clients (None = unlimited)
+SHAPING_CLIENT_RATE = None  # Bytes/s per client address (None = unlimited)
+SHAPING_BURST = 256 * 1024  # Bytes that may be sent at once before the rates apply
+SHAPING_QUANTUM = 64 * 1024  # Largest piece granted at a time
+SHAPING_BULK_THRESHOLD = 1024 * 1024  # Smaller responses are never delayed
+
+# Admission control: (max concurrent, max queued, seconds a request may wait in the queue)
+ADMISSION_ROUTE_LIMITS = {
+    'zip': (2, 8, 30),
+    'view': (8, 32, 10),
+    'delta': (4, 16, 30),
+    'signature': (4, 16, 30),
+    'checksum': (4, 32, 30),
+    'upload': (4, 16, 30),
+    'search': (8, 32, 5),
+    'batch': (2, 8, 30),
+}
+ADMISSION_CLIENT_LIMITS = {'zip': 2, 'delta': 2, 'batch': 2}  # Concurrent requests per client address (429 beyond)
+ADMISSION_MAX_IN_FLIGHT = 128  # Requests handled at once across all routes (None = unlimited)
+ADMISSION_GLOBAL_QUEUE = 256  # Requests waiting for a global slot
+ADMISSION_QUEUE_TIMEOUT = 10  # Seconds a request may wait for a global slot
+ADMISSION_EXEMPT_ROUTES = ('metrics', 'debug')  # Never queued or shed, so overload stays observable
+
+# Multi-process mode
+PREFORK_WORKERS = int(os.environ.get("SHERI_WORKERS", 1))  # Worker processes; 0 = one per CPU core, 1 = single process without a supervisor
+PREFORK_REUSEPORT = False  # One SO_REUSEPORT socket per worker instead of one shared socket
+PREFORK_BACKLOG = 128  # Listen queue length
+PREFORK_GRACEFUL_TIMEOUT = 30  # Seconds a stopping worker may spend finishing its requests
+PREFORK_MIN_UPTIME = 5  # Workers dying sooner than this are restarted with a growing delay
+PREFORK_MAX_BACKOFF = 30  # Longest restart delay in seconds
+PREFORK_POLL_INTERVAL = 0.5  # How often the supervisor checks its workers
+PREFORK_METRICS_DIR = STATE_DIR + "/workers"  # Where workers export metrics for each other
+PREFORK_METRICS_INTERVAL = 2  # Seconds between metric exports
+PREFORK_METRICS_STALE = 10  # Exports older than this are from workers that are gone
+
+# Batch downloads (multi-select, streamed as one archive)
+BATCH_MAX_PATHS = 1000  # Paths per selection
+BATCH_MAX_BODY = 1024 * 1024  # Largest selection form accepted (bytes)
+
+# tar.gz output (folder downloads and batch downloads)
+TAR_GZIP_WORKERS = 0  # Compression threads shared by all downloads; 0 = one per CPU core
+TAR_GZIP_BLOCK_SIZE = 1024 * 1024  # Input bytes per gzip member, compressed independently
+TAR_GZIP_LEVEL = 6  # gzip compression level (1 fastest - 9 smallest)
+
+# Browsing inside ZIP and tar archives
+ARCHIVE_INDEX_CACHE_ENTRIES = 32  # Parsed archive member tables kept in memory (ZIP keeps its file open)
+ARCHIVE_COMPRESSED_MAX_SIZE = 256 * 1024 * 1024  # Largest .tar.gz/.tar.bz2/.tar.xz that can be browsed
+
+# In-memory cache of small, frequently requested files (/download and /view)
+HOT_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Memory for cached bodies and their gzip variants (0 disables)
+HOT_CACHE_MAX_OBJECT_SIZE = 256 * 1024  # Larger files are always read from disk
+HOT_CACHE_NOTIFIED_MAX_AGE = 1.0  # With inotify, seconds between safety stats of a cached file
+HOT_CACHE_EVICTION_SAMPLE = 8  # Least recently used entries compared by hit count on eviction
+HOT_CACHE_MIN_COMPRESS_SIZE = 1024  # Smaller bodies are not worth a gzip variant
+HOT_CACHE_GZIP_LEVEL = 6  # gzip level of the precomputed compressed variant
+
+# Shared stat/realpath cache (invalidated by the change watcher)
+STAT_CACHE_TTL = 1.0  # Seconds a stat or realpath result is reused across requests (0 = per request only)
+STAT_CACHE_MAX_ENTRIES = 20000  # Paths kept in the process-wide metadata cache
+
+# Path resolution below the browse directory
+PATH_RESOLVE_TTL = 10.0  # Seconds a resolved folder is reused (the change watcher drops changed ones sooner)
+PATH_RESOLVE_CACHE_ENTRIES = 20000  # Resolved folders kept per root
+
+# Upload catalog (dashboard count and the upload page listing)
+UPLOAD_PAGE_SIZE = 100  # Uploaded files listed per page
+UPLOAD_CATALOG_PERSIST = True  # Save the catalog on shutdown and reuse it if the directory is unchanged
+
+# Upload quotas and disk space (checked from Content-Length before the body is read; 0 = no limit)
+UPLOAD_MAX_SIZE = 0  # Largest single upload request in bytes
+UPLOAD_USER_QUOTA = 0  # Bytes each user may keep in the upload directory
+UPLOAD_TOTAL_QUOTA = 0  # Bytes all users together may keep in the upload directory
+UPLOAD_MIN_FREE_SPACE = 512 * 1024 * 1024  # Free space always left on the upload disk
+UPLOAD_PARTIAL_DIR = ".partial"  # Hidden folder in UPLOAD_DIR for files still being received
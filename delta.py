@@ -0,0 +1,339 @@
+"""
+Block-level delta transfer for the Enhanced File Server
+rsync-style signatures and deltas: the client sends block signatures of its
+old copy and receives only the changed bytes plus references to blocks it
+already has
+
+Usage from a client machine:
+    python delta.py signature old.img old.sig
+    curl -u user:pass --data-binary @old.sig http://server:8000/delta/path/to/file.img -o file.delta
+    python delta.py patch old.img file.delta new.img
+"""
+
+import os
+import sys
+import math
+import zlib
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+from config import *
+from pathres import open_file
+
+SIGNATURE_MAGIC = b'SHSG'
+DELTA_MAGIC = b'SHDL'
+SIGNATURE_HEADER = struct.Struct('>IQI')     # block size, file size, block count
+SIGNATURE_BLOCK = struct.Struct('>I16s')     # weak checksum, strong checksum
+DELTA_HEADER = struct.Struct('>IQ')          # block size, new file size
+COPY_OP = struct.Struct('>QI')               # first block index, block count
+LITERAL_OP = struct.Struct('>I')             # literal length
+
+ADLER_MOD = 65521
+
+
+def strong_checksum(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def roll_checksum(weak, out_byte, in_byte, block_size):
+    """Slide an Adler-32 checksum one byte forward"""
+    a = weak & 0xffff
+    b = weak >> 16
+    a = (a - out_byte + in_byte) % ADLER_MOD
+    b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+
+def recommended_block_size(file_size):
+    """Roughly sqrt(size), rounded to a power of two between the configured bounds"""
+    if file_size <= 0:
+        return DELTA_MIN_BLOCK_SIZE
+    size = 1 << max(0, int(math.log2(math.sqrt(file_size))))
+    return max(DELTA_MIN_BLOCK_SIZE, min(DELTA_MAX_BLOCK_SIZE, size))
+
+
+def compute_signature(file_path, block_size=None, root=None):
+    """Return (block_size, file_size, [(weak, strong), ...]) for a file, opened through root's descriptor when given"""
+    with open_file(file_path, root) as f:
+        return read_signature(f, block_size)
+
+
+def read_signature(f, block_size=None):
+    """compute_signature for a file that is already open"""
+    file_size = os.fstat(f.fileno()).st_size
+    block_size = block_size or recommended_block_size(file_size)
+    blocks = []
+    while True:
+        block = f.read(block_size)
+        if not block:
+            break
+        blocks.append((zlib.adler32(block), strong_checksum(block)))
+    return block_size, file_size, blocks
+
+
+def encode_signature(block_size, file_size, blocks):
+    parts = [SIGNATURE_MAGIC, SIGNATURE_HEADER.pack(block_size, file_size, len(blocks))]
+    parts.extend(SIGNATURE_BLOCK.pack(weak, strong) for weak, strong in blocks)
+    return b''.join(parts)
+
+
+def decode_signature(data):
+    """Parse an encoded signature, raising ValueError when it is malformed"""
+    if data[:4] != SIGNATURE_MAGIC or len(data) < 4 + SIGNATURE_HEADER.size:
+        raise ValueError("Not a block signature")
+    block_size, file_size, count = SIGNATURE_HEADER.unpack_from(data, 4)
+    offset = 4 + SIGNATURE_HEADER.size
+    if not DELTA_MIN_BLOCK_SIZE <= block_size <= DELTA_MAX_BLOCK_SIZE:
+        raise ValueError(f"Block size must be between {DELTA_MIN_BLOCK_SIZE} and {DELTA_MAX_BLOCK_SIZE}")
+    if len(data) != offset + count * SIGNATURE_BLOCK.size:
+        raise ValueError("Truncated block signature")
+    blocks = [SIGNATURE_BLOCK.unpack_from(data, offset + i * SIGNATURE_BLOCK.size) for i in range(count)]
+    return block_size, file_size, blocks
+
+
+class SignatureCache:
+    """LRU cache of server-side file signatures keyed by file version and block size"""
+
+    def __init__(self, max_entries=DELTA_SIGNATURE_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, file_path, block_size=None, root=None):
+        # Keyed by the file actually opened (through root's descriptor when given)
+        with open_file(file_path, root) as f:
+            st = os.fstat(f.fileno())
+            block_size = block_size or recommended_block_size(st.st_size)
+            key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, block_size)
+            with self.lock:
+                signature = self.entries.get(key)
+                if signature is not None:
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return signature
+                self.misses += 1
+            signature = read_signature(f, block_size)
+        with self.lock:
+            self.entries[key] = signature
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return signature
+
+    def peek(self, file_path, block_size):
+        """Return a cached signature without computing one"""
+        st = os.stat(file_path)
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, block_size)
+        with self.lock:
+            return self.entries.get(key)
+
+
+class FileWindow:
+    """Read-only view of a file indexed by absolute offset, backed by a sliding buffer.
+
+    Used instead of mmap: a file truncated by another process while it is
+    mapped raises SIGBUS and kills the server, whereas a short read here
+    only fails the request.
+    """
+
+    def __init__(self, f, size, read_size=DELTA_READ_SIZE):
+        self.f = f
+        self.size = size
+        self.read_size = read_size
+        self.base = 0                 # file offset of buf[0]
+        self.buf = b''
+        self.end = 0                  # file offset just past the buffer
+
+    def fill(self, keep_from, end):
+        """Make the buffer cover [keep_from, end); bytes before keep_from may be dropped"""
+        end = min(end, self.size)
+        if self.end >= end:
+            return
+        if keep_from - self.base >= self.read_size:
+            self.buf = self.buf[keep_from - self.base:]
+            self.base = keep_from
+        chunk = self.f.read(max(end - self.end, self.read_size))[:self.size - self.end]
+        if len(chunk) < end - self.end:
+            raise OSError(f"{self.f.name} changed while the delta was being computed")
+        self.buf += chunk
+        self.end += len(chunk)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return self.buf[key.start - self.base:key.stop - self.base]
+        return self.buf[key - self.base]
+
+
+def file_version(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def generate_delta(file_path, client_signature, write, server_signature=None, root=None):
+    """Stream the delta that turns the client's old file into file_path (opened through root's descriptor when given).
+
+    client_signature is (block_size, file_size, blocks) as decoded from the
+    client. Blocks at aligned offsets are checked first using the server's
+    cached signature when one is available, so unchanged regions cost no
+    hashing. Elsewhere an Adler-32 window rolls byte by byte to find shifted
+    blocks; after DELTA_ROLLING_BUDGET bytes without a match it mostly falls
+    back to aligned checks, which bounds the work for completely new content.
+    """
+    block_size, client_size, blocks = client_signature
+    tail_length = client_size - (len(blocks) - 1) * block_size if blocks else 0
+    table = {}
+    for index, (weak, strong) in enumerate(blocks):
+        table.setdefault(weak, {}).setdefault(strong, index)
+
+    server_blocks = server_signature[2] if server_signature else None
+    new_hash = hashlib.sha256()
+    pending_copy = None   # [first block index, count]
+
+    def flush_copy():
+        nonlocal pending_copy
+        if pending_copy is not None:
+            write(b'C' + COPY_OP.pack(*pending_copy))
+            pending_copy = None
+
+    def emit_literal(data, start, end):
+        flush_copy()
+        for offset in range(start, end, DELTA_LITERAL_CHUNK):
+            chunk = data[offset:min(end, offset + DELTA_LITERAL_CHUNK)]
+            new_hash.update(chunk)
+            write(b'L' + LITERAL_OP.pack(len(chunk)) + chunk)
+
+    def emit_copy(index, block):
+        nonlocal pending_copy
+        new_hash.update(block)
+        if pending_copy is not None and pending_copy[0] + pending_copy[1] == index:
+            pending_copy[1] += 1
+        else:
+            flush_copy()
+            pending_copy = [index, 1]
+
+    def lookup(weak, data, pos, strong=None):
+        candidates = table.get(weak)
+        if not candidates:
+            return None
+        if strong is None:
+            strong = strong_checksum(data[pos:pos + block_size])
+        return candidates.get(strong)
+
+    with open_file(file_path, root) as f:
+        version = file_version(os.fstat(f.fileno()))
+        size = version[2]
+        write(DELTA_MAGIC + DELTA_HEADER.pack(block_size, size))
+        data = FileWindow(f, size, max(DELTA_READ_SIZE, 2 * block_size))
+        pos = 0
+        literal_start = 0
+        rolled = 0
+        weak = None
+        while pos + block_size <= size:
+            if pos + block_size + 1 > data.end:
+                # Everything from literal_start on may still be emitted
+                data.fill(literal_start, pos + block_size + 1)
+            strong = None
+            if weak is None:
+                aligned = pos % block_size == 0
+                if server_blocks is not None and aligned and pos // block_size < len(server_blocks):
+                    weak, strong = server_blocks[pos // block_size]
+                else:
+                    weak = zlib.adler32(data[pos:pos + block_size])
+
+            index = lookup(weak, data, pos, strong)
+            if index is not None:
+                if literal_start < pos:
+                    emit_literal(data, literal_start, pos)
+                emit_copy(index, data[pos:pos + block_size])
+                pos += block_size
+                literal_start = pos
+                weak = None
+                rolled = 0
+                continue
+
+            if rolled >= DELTA_ROLLING_BUDGET or pos + block_size >= size:
+                # Aligned mode: jump a whole block and check again. Rolling
+                # resumes after a while in case the data re-synchronises.
+                pos += block_size
+                weak = None
+                rolled += block_size
+                if rolled >= DELTA_ROLLING_BUDGET * 8:
+                    rolled = 0
+            else:
+                weak = roll_checksum(weak, data[pos], data[pos + block_size], block_size)
+                pos += 1
+                rolled += 1
+
+            if pos - literal_start >= DELTA_LITERAL_CHUNK:
+                emit_literal(data, literal_start, pos)
+                literal_start = pos
+
+        data.fill(literal_start, size)
+        # The client's last block may be shorter than block_size
+        if literal_start == pos and 0 < size - pos == tail_length < block_size:
+            tail = data[pos:size]
+            if blocks[-1] == (zlib.adler32(tail), strong_checksum(tail)):
+                emit_copy(len(blocks) - 1, tail)
+                literal_start = size
+
+        if literal_start < size:
+            emit_literal(data, literal_start, size)
+        flush_copy()
+        # A file rewritten in place would give the client a mix of old and new
+        # content; failing before the end record makes it discard the delta
+        if file_version(os.fstat(f.fileno())) != version:
+            raise OSError(f"{file_path} changed while the delta was being computed")
+    write(b'E' + new_hash.digest())
+
+
+def apply_delta(old_file, delta_file, out_file):
+    """Rebuild the new file from the old copy and a delta stream; returns its size"""
+    magic = delta_file.read(4)
+    if magic != DELTA_MAGIC:
+        raise ValueError("Not a delta stream")
+    block_size, new_size = DELTA_HEADER.unpack(delta_file.read(DELTA_HEADER.size))
+    new_hash = hashlib.sha256()
+    written = 0
+    while True:
+        op = delta_file.read(1)
+        if op == b'C':
+            first, count = COPY_OP.unpack(delta_file.read(COPY_OP.size))
+            old_file.seek(first * block_size)
+            for _ in range(count):
+                block = old_file.read(block_size)
+                new_hash.update(block)
+                out_file.write(block)
+                written += len(block)
+        elif op == b'L':
+            (length,) = LITERAL_OP.unpack(delta_file.read(LITERAL_OP.size))
+            chunk = delta_file.read(length)
+            new_hash.update(chunk)
+            out_file.write(chunk)
+            written += len(chunk)
+        elif op == b'E':
+            if delta_file.read(32) != new_hash.digest() or written != new_size:
+                raise ValueError("Rebuilt file does not match the server's checksum")
+            return written
+        else:
+            raise ValueError("Truncated or corrupt delta stream")
+
+
+def main(argv):
+    if len(argv) == 3 and argv[0] == 'signature':
+        with open(argv[2], 'wb') as out:
+            out.write(encode_signature(*compute_signature(argv[1])))
+    elif len(argv) == 4 and argv[0] == 'patch':
+        with open(argv[1], 'rb') as old, open(argv[2], 'rb') as delta, open(argv[3], 'wb') as out:
+            apply_delta(old, delta, out)
+    else:
+        print(__doc__)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
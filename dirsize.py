@@ -0,0 +1,221 @@
+"""
+Recursive directory size accounting for the Enhanced File Server
+Computes total size and file count of directory trees in background workers
+and keeps them up to date from the change feed
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import *
+
+
+class DirectorySizes:
+    """Cache of recursive (bytes, file count) totals per directory.
+
+    For every directory we remember its own direct files (own), its
+    subdirectory names and, once the whole subtree has been walked, its
+    recursive totals. A change inside a directory only re-lists that one
+    directory and applies the difference to it and its ancestors, so the
+    tree is never re-walked after the first pass.
+
+    All walking happens on a small thread pool so concurrent disk I/O stays
+    bounded and page loads never wait for it: get() returns None until the
+    totals are ready.
+    """
+
+    def __init__(self, root, workers=DIRSIZE_WORKERS):
+        self.root = os.path.realpath(root)
+        self.lock = threading.Lock()
+        self.own = {}             # relative dir -> [bytes, files] of direct files
+        self.subdirs = {}         # relative dir -> set of subdirectory names
+        self.totals = {}          # relative dir -> [bytes, files] of the whole subtree
+        self.pending = set()      # directories with a queued walk or rescan
+        self.walking = {}         # directory -> walks that listed it but have not committed yet
+        self.dirty = set()        # walking directories that changed after they were listed
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dirsize')
+
+    def _abs(self, rel_dir):
+        return os.path.join(self.root, rel_dir) if rel_dir else self.root
+
+    @staticmethod
+    def _join(rel_dir, name):
+        return f"{rel_dir}/{name}" if rel_dir else name
+
+    def _list(self, rel_dir):
+        """Return ([bytes, files], subdirectory names) for one directory"""
+        size = files = 0
+        names = set()
+        try:
+            with os.scandir(self._abs(rel_dir)) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            names.add(entry.name)
+                        elif entry.is_file(follow_symlinks=False):
+                            size += entry.stat(follow_symlinks=False).st_size
+                            files += 1
+                    except OSError:
+                        continue
+        except OSError:
+            return None, set()
+        return [size, files], names
+
+    def _walk(self, top):
+        """Walk a subtree, reusing any subtree totals that are already known"""
+        listed = {}
+        order = []
+        stack = [top]
+        while stack:
+            rel_dir = stack.pop()
+            with self.lock:
+                # Marked before listing: a change from here on is caught by apply_change
+                self.walking[rel_dir] = self.walking.get(rel_dir, 0) + 1
+            own, names = self._list(rel_dir)
+            if own is None:
+                self._walk_done(rel_dir)
+                continue
+            listed[rel_dir] = (own, names)
+            order.append(rel_dir)
+            with self.lock:
+                stack.extend(child for child in (self._join(rel_dir, name) for name in names)
+                             if child not in self.totals)
+
+        # Children were appended after their parents, so reversed order is bottom-up
+        changed = []
+        with self.lock:
+            for rel_dir in reversed(order):
+                own, names = listed[rel_dir]
+                total = list(own)
+                for name in names:
+                    child_total = self.totals.get(self._join(rel_dir, name))
+                    if child_total is not None:
+                        total[0] += child_total[0]
+                        total[1] += child_total[1]
+                self.own[rel_dir] = own
+                self.subdirs[rel_dir] = names
+                self.totals[rel_dir] = total
+                if self._walk_done(rel_dir, locked=True):
+                    changed.append(rel_dir)
+            result = self.totals.get(top)
+        # What we committed for these may predate a change; list them again
+        for rel_dir in changed:
+            self._schedule(rel_dir, self._rescan)
+        return result
+
+    def _walk_done(self, rel_dir, locked=False):
+        """Unmark a listed directory; returns True if it changed while the walk was in flight"""
+        if not locked:
+            with self.lock:
+                return self._walk_done(rel_dir, locked=True)
+        count = self.walking.get(rel_dir, 0) - 1
+        if count > 0:
+            self.walking[rel_dir] = count
+            return False
+        self.walking.pop(rel_dir, None)
+        if rel_dir in self.dirty:
+            self.dirty.discard(rel_dir)
+            return True
+        return False
+
+    def _forget(self, rel_dir):
+        """Drop cached data for a subtree; the caller holds the lock"""
+        prefix = rel_dir + '/'
+        for cache in (self.own, self.subdirs, self.totals):
+            for key in [k for k in cache if k == rel_dir or k.startswith(prefix)]:
+                del cache[key]
+
+    def _add_to_ancestors(self, rel_dir, delta_size, delta_files):
+        """Apply a delta to rel_dir and every ancestor; the caller holds the lock"""
+        current = rel_dir
+        while True:
+            total = self.totals.get(current)
+            if total is not None:
+                total[0] += delta_size
+                total[1] += delta_files
+            if not current:
+                break
+            current = current.rpartition('/')[0]
+
+    def _run(self, rel_dir, job):
+        # Leave the pending set before starting so that a change arriving
+        # while we list the directory queues a fresh rescan
+        with self.lock:
+            self.pending.discard(rel_dir)
+        try:
+            job(rel_dir)
+        except Exception as e:
+            print(f"⚠️  Directory size update failed for /{rel_dir}: {e}")
+
+    def _schedule(self, rel_dir, job):
+        with self.lock:
+            if rel_dir in self.pending:
+                return
+            self.pending.add(rel_dir)
+        self.executor.submit(self._run, rel_dir, job)
+
+    def _rescan(self, rel_dir):
+        """Re-list one directory and push the difference up the tree"""
+        own, names = self._list(rel_dir)
+        with self.lock:
+            if rel_dir not in self.totals:
+                return
+            if own is None:
+                return  # the directory is gone, its parent's rescan removes it
+            old_own = self.own.get(rel_dir, [0, 0])
+            old_names = self.subdirs.get(rel_dir, set())
+            delta_size = own[0] - old_own[0]
+            delta_files = own[1] - old_own[1]
+            for name in old_names - names:
+                child = self._join(rel_dir, name)
+                child_total = self.totals.get(child, [0, 0])
+                delta_size -= child_total[0]
+                delta_files -= child_total[1]
+                self._forget(child)
+            self.own[rel_dir] = own
+            self.subdirs[rel_dir] = names
+            self._add_to_ancestors(rel_dir, delta_size, delta_files)
+            new_names = names - old_names
+
+        for name in new_names:
+            child_total = self._walk(self._join(rel_dir, name))
+            if child_total is not None:
+                with self.lock:
+                    self._add_to_ancestors(rel_dir, child_total[0], child_total[1])
+
+    def get(self, rel_dir):
+        """Return [bytes, files] for a directory, or None while it is computed"""
+        rel_dir = rel_dir.strip('/')
+        with self.lock:
+            total = self.totals.get(rel_dir)
+            if total is not None:
+                return list(total)
+        self._schedule(rel_dir, self._walk)
+        return None
+
+    def apply_change(self, event):
+        """Update totals from a change watcher event"""
+        if event.kind == 'rescan':
+            with self.lock:
+                self.own.clear()
+                self.subdirs.clear()
+                self.totals.clear()
+            self._schedule('', self._walk)
+            return
+        if not event.rel_path or (event.kind == 'modified' and event.is_dir):
+            return
+        parent = event.rel_path.rpartition('/')[0]
+        with self.lock:
+            if parent in self.walking:
+                # Listed but not committed yet: rescan once the walk commits
+                self.dirty.add(parent)
+            if parent not in self.totals:
+                return
+        self._schedule(parent, self._rescan)
+
+    def start(self):
+        """Warm the cache by walking the whole tree in the background"""
+        self._schedule('', self._walk)
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,168 @@
+"""
+In-memory hot-object cache for the Enhanced File Server
+Keeps the body, response headers and a gzip variant of small, frequently
+requested files, so repeated downloads and views are answered from memory
+without stat, open or read calls. Entries are invalidated by the change
+watcher and revalidated with a stat when notifications cannot be relied on.
+"""
+
+import os
+import time
+import gzip
+import threading
+import mimetypes
+from collections import OrderedDict
+from config import *
+
+# Content types worth compressing; everything else is usually compressed already
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml',
+                      'application/x-sh', 'application/toml', 'image/svg+xml')
+
+
+def file_version(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+class CachedObject:
+    """One cached file: its bytes plus everything needed to answer without the disk"""
+
+    __slots__ = ('path', 'body', 'gzip_body', 'content_type', 'headers', 'stat', 'version',
+                 'validated', 'hits', 'text', 'trusted')
+
+    def __init__(self, path, body, st, trusted):
+        self.path = path
+        self.body = body
+        self.stat = st
+        self.version = file_version(st)
+        self.validated = time.monotonic()
+        self.hits = 0
+        self.text = None              # decoded text, filled in by the first /view
+        self.trusted = trusted        # change notifications cover this path (no symlink on the way)
+        content_type, _ = mimetypes.guess_type(path)
+        self.content_type = content_type or 'application/octet-stream'
+        self.headers = [
+            ('Content-Type', self.content_type),
+            ('Content-Disposition', f'attachment; filename="{os.path.basename(path)}"'),
+        ]
+        self.gzip_body = None
+        if len(body) >= HOT_CACHE_MIN_COMPRESS_SIZE and self.content_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(body, HOT_CACHE_GZIP_LEVEL, mtime=0)
+            if len(compressed) < len(body) * 0.9:
+                self.gzip_body = compressed
+
+    @property
+    def size(self):
+        return len(self.body) + (len(self.gzip_body) if self.gzip_body else 0)
+
+
+class HotObjectCache:
+    """Size-bounded cache of small files with frequency-aware LRU eviction.
+
+    Entries are kept in recency order; when space is needed, the least
+    recently used HOT_CACHE_EVICTION_SAMPLE entries are compared and the
+    one with the fewest hits is dropped, so a burst of one-off requests
+    cannot push out the files that are requested all the time.
+    """
+
+    def __init__(self, max_bytes=HOT_CACHE_MAX_BYTES, max_object_size=HOT_CACHE_MAX_OBJECT_SIZE):
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # normalized path -> CachedObject
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.notified = False         # True once an inotify watcher invalidates entries
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def cacheable(self, size):
+        return self.enabled and size <= self.max_object_size
+
+    def get(self, path):
+        """The cached object for path if it is still current, else None"""
+        if not self.enabled:
+            return None
+        path = os.path.normpath(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+        # Without notifications (or for paths they may miss) a stat proves the entry current
+        max_age = HOT_CACHE_NOTIFIED_MAX_AGE if self.notified and entry.trusted else 0
+        now = time.monotonic()
+        if now - entry.validated > max_age:
+            try:
+                current = file_version(os.stat(path))
+            except OSError:
+                current = None
+            if current != entry.version:
+                self.invalidate(path)
+                with self.lock:
+                    self.misses += 1
+                return None
+            entry.validated = now
+        with self.lock:
+            self.hits += 1
+            entry.hits += 1
+            if path in self.entries:
+                self.entries.move_to_end(path)
+        return entry
+
+    def put(self, path, body, st):
+        """Cache a file read by the caller; st must be the stat taken before reading it"""
+        if not self.cacheable(len(body)):
+            return None
+        path = os.path.normpath(path)
+        entry = CachedObject(path, body, st, trusted=os.path.realpath(path) == path)
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.bytes_used -= old.size
+            self.entries[path] = entry
+            self.bytes_used += entry.size
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self.bytes_used > self.max_bytes and self.entries:
+            candidates = []
+            for path, entry in self.entries.items():
+                candidates.append((entry.hits, path))
+                if len(candidates) >= HOT_CACHE_EVICTION_SAMPLE:
+                    break
+            _, victim = min(candidates)
+            self.bytes_used -= self.entries.pop(victim).size
+            self.evictions += 1
+
+    def invalidate(self, path, recursive=False):
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            if recursive:
+                victims = [p for p in self.entries if p == path or p.startswith(prefix)]
+            else:
+                victims = [path] if path in self.entries else []
+            for victim in victims:
+                self.bytes_used -= self.entries.pop(victim).size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes_used = 0
+
+    def track(self, watcher, root='browse'):
+        """Invalidate entries from a change watcher; inotify events make per-hit stats unnecessary"""
+        watcher.subscribe(self.apply_change, root=root)
+        self.notified = watcher.backend == 'inotify'
+
+    def apply_change(self, event):
+        if event.kind == 'rescan':
+            self.clear()
+            return
+        # A folder that is moved or deleted takes its cached files with it
+        self.invalidate(event.path, recursive=event.is_dir)
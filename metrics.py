@@ -0,0 +1,244 @@
+"""
+Request metrics for the Enhanced File Server
+A small Prometheus-compatible registry (counters, gauges, histograms and
+scrape-time collectors) rendered in the text exposition format on /metrics
+"""
+
+import bisect
+import threading
+import time
+from config import *
+
+# Route labels are limited to this set to keep label cardinality bounded
+ROUTES = {
+    '': 'dashboard', 'browse': 'browse', 'view': 'view', 'download': 'download',
+    'zip': 'zip', 'upload': 'upload', 'uploads': 'uploads', 'search': 'search',
+    'changes': 'changes', 'checksum': 'checksum', 'signature': 'signature',
+    'delta': 'delta', 'metrics': 'metrics', 'debug': 'debug', 'login': 'login',
+    'logout': 'logout', 'batch': 'batch',
+}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def route_name(path):
+    """Map a request path to its route label, e.g. /browse/a/b -> browse"""
+    first = path.lstrip('/').split('/', 1)[0].split('?', 1)[0]
+    return ROUTES.get(first, 'other')
+
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def samples(self):
+        """Return [(name suffix, label values, extra labels, value)] for rendering and aggregation"""
+        with self.lock:
+            return [('', labels, (), value) for labels, value in self.values.items()]
+
+    def render(self):
+        lines = self.header()
+        for suffix, labels, extra, value in self.samples():
+            names = self.labelnames + tuple(name for name, _ in extra)
+            values = tuple(labels) + tuple(value for _, value in extra)
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        with self.lock:
+            self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self.lock:
+            items = [(labels, list(state[0]), state[1], state[2]) for labels, state in self.values.items()]
+        samples = []
+        for labels, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', labels, (('le', format_value(float(bound))),), cumulative))
+            samples.append(('_sum', labels, (), total))
+            samples.append(('_count', labels, (), count))
+        return samples
+
+
+class CollectorMetric(Metric):
+    """A metric whose values are produced by a callback when scraped"""
+
+    def __init__(self, name, help_text, labelnames, kind, callback):
+        super().__init__(name, help_text, labelnames)
+        self.kind = kind
+        self.callback = callback
+
+    def samples(self):
+        try:
+            values = self.callback()
+        except Exception:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', labels if isinstance(labels, tuple) else (labels,), (), value)
+                for labels, value in values.items() if value is not None]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+        self.start_time = time.time()
+
+    def _register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def collector(self, name, help_text, callback, labelnames=(), kind='gauge'):
+        """Register callback() -> value or {label values: value}, called at scrape time"""
+        return self._register(CollectorMetric(name, help_text, labelnames, kind, callback))
+
+    def render(self):
+        """Render every metric in the Prometheus text exposition format"""
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+
+REQUESTS = METRICS.counter(
+    'sheri_http_requests_total', 'HTTP requests handled', ('route', 'method', 'status'))
+ERRORS = METRICS.counter(
+    'sheri_http_errors_total', 'HTTP responses with a 4xx or 5xx status', ('route', 'status'))
+LATENCY = METRICS.histogram(
+    'sheri_http_request_duration_seconds', 'Time from parsed request line to finished response', ('route',))
+IN_FLIGHT = METRICS.gauge(
+    'sheri_http_requests_in_flight', 'Requests currently being handled', ('route',))
+BYTES_IN = METRICS.counter(
+    'sheri_http_request_bytes_total', 'Request body bytes received (from Content-Length)', ('route',))
+BYTES_OUT = METRICS.counter(
+    'sheri_http_response_bytes_total', 'Response bytes written, headers included', ('route',))
+
+METRICS.collector('sheri_uptime_seconds', 'Seconds since the server started',
+                  lambda: round(time.time() - METRICS.start_time, 3))
+METRICS.collector('sheri_threads', 'Live threads in the server process', threading.active_count)
+
+
+# Caches exposing .hits and .misses, reported under a 'cache' label
+CACHES = {}
+
+
+def register_cache(name, cache):
+    """Report hit/miss counters and the hit ratio of a cache on /metrics"""
+    CACHES[name] = cache
+
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, cache in list(CACHES.items()):
+        total = cache.hits + cache.misses
+        ratios[(name,)] = round(cache.hits / total, 4) if total else None
+    return ratios
+
+
+METRICS.collector('sheri_cache_hits_total', 'Cache lookups answered from the cache',
+                  lambda: {(name,): cache.hits for name, cache in list(CACHES.items())},
+                  ('cache',), kind='counter')
+METRICS.collector('sheri_cache_misses_total', 'Cache lookups that missed',
+                  lambda: {(name,): cache.misses for name, cache in list(CACHES.items())},
+                  ('cache',), kind='counter')
+METRICS.collector('sheri_cache_hit_ratio', 'Share of cache lookups that hit',
+                  cache_hit_ratios, ('cache',))
+
+
+class CountingWriter:
+    """Wraps a handler's wfile and counts the bytes and time spent writing"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_written = 0
+        self.write_seconds = 0.0
+
+    def write(self, data):
+        start = time.perf_counter()
+        result = self.raw.write(data)
+        self.write_seconds += time.perf_counter() - start
+        self.bytes_written += len(data)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
@@ -0,0 +1,131 @@
+"""
+Streaming multipart/form-data parsing for the Enhanced File Server
+Reads an upload body straight from the connection, at most Content-Length
+bytes, and hands each part's content to the caller chunk by chunk, so
+files can be written to their destination (and counted against their
+reservation) as they arrive instead of being spooled to a temporary file.
+"""
+
+from email.parser import HeaderParser
+from config import *
+
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+
+class MultipartError(ValueError):
+    """Raised for a malformed multipart body"""
+
+
+class BodyTruncated(MultipartError):
+    """The client stopped sending before Content-Length bytes arrived"""
+
+
+class Part:
+    """One part of the body; read its content with chunks() before moving on"""
+
+    def __init__(self, reader, headers):
+        self.reader = reader
+        self.headers = headers
+        self.name = headers.get_param('name', header='content-disposition')
+        self.filename = headers.get_filename()
+        self.done = False
+
+    def chunks(self):
+        """Yield the part's content in pieces of at most UPLOAD_CHUNK_SIZE bytes"""
+        while not self.done:
+            data, self.done = self.reader._read_content()
+            if data:
+                yield data
+
+    def drain(self):
+        for _ in self.chunks():
+            pass
+
+
+class MultipartReader:
+    """Iterate over the parts of a multipart body of `length` bytes read from fp"""
+
+    def __init__(self, fp, boundary, length, chunk_size=UPLOAD_CHUNK_SIZE):
+        if not boundary:
+            raise MultipartError("Missing multipart boundary")
+        self.fp = fp
+        self.remaining = length
+        self.chunk_size = chunk_size
+        self.delimiter = b'\r\n--' + boundary.encode('latin-1')
+        self.buffer = b''
+        self.part = None
+        self.finished = False
+
+    def _fill(self, size):
+        """Read until the buffer holds size bytes; False at the end of the body"""
+        while len(self.buffer) < size:
+            if self.remaining <= 0:
+                return False
+            data = self.fp.read(min(self.chunk_size, self.remaining))
+            if not data:
+                raise BodyTruncated("Upload ended early")
+            self.remaining -= len(data)
+            self.buffer += data
+        return True
+
+    def _read_content(self):
+        """(data, done): the next piece of the current part's content"""
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                data = self.buffer[:index]
+                self.buffer = self.buffer[index + len(self.delimiter):]
+                return data, True
+            # Keep a tail that could be the start of the delimiter
+            keep = len(self.delimiter) - 1
+            if len(self.buffer) > keep + self.chunk_size // 2:
+                data = self.buffer[:-keep]
+                self.buffer = self.buffer[-keep:]
+                return data, False
+            if not self._fill(len(self.buffer) + 1):
+                raise MultipartError("Body ended before the closing boundary")
+
+    def _next_part(self):
+        """Parse what follows a delimiter: the next part's headers, or the end"""
+        if not self._fill(2):
+            raise MultipartError("Body ended before the closing boundary")
+        if self.buffer.startswith(b'--'):
+            self.finished = True
+            return None
+        while True:
+            end = self.buffer.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(self.buffer) > MAX_PART_HEADER_SIZE:
+                raise MultipartError("Part headers too large")
+            if not self._fill(len(self.buffer) + 1):
+                raise MultipartError("Body ended before the closing boundary")
+        # The delimiter line ends with CRLF (possibly after padding), then the headers
+        header_block = self.buffer[:end].partition(b'\r\n')[2]
+        self.buffer = self.buffer[end + 4:]
+        headers = HeaderParser().parsestr(header_block.decode('utf-8', 'replace'))
+        return Part(self, headers)
+
+    def __iter__(self):
+        # The body starts with the first delimiter (without its leading CRLF)
+        self.buffer = b'\r\n'
+        self._fill(len(self.delimiter))
+        while True:
+            _, done = self._read_content()
+            if done:
+                break
+        while not self.finished:
+            self.part = self._next_part()
+            if self.part is None:
+                break
+            yield self.part
+            self.part.drain()
+
+    def discard_rest(self):
+        """Read the epilogue, so the connection can carry the next request"""
+        self.buffer = b''
+        while self.remaining > 0:
+            data = self.fp.read(min(self.chunk_size, self.remaining))
+            if not data:
+                raise BodyTruncated("Upload ended early")
+            self.remaining -= len(data)
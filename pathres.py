@@ -0,0 +1,163 @@
+"""
+Path resolution for the Enhanced File Server
+Resolves request paths against a served root without calling realpath on
+every request: the root is resolved once and held open as a directory
+descriptor, resolved directory prefixes are cached (and invalidated by the
+change watcher), so a containment check costs a dictionary lookup and one
+lstat. Files are opened relative to the root descriptor and checked again
+through /proc, which closes the gap between checking a path and opening it.
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from config import *
+
+
+class PathResolver:
+    """Containment checks and safe opens for paths below one root directory"""
+
+    def __init__(self, root, ttl=PATH_RESOLVE_TTL, max_entries=PATH_RESOLVE_CACHE_ENTRIES):
+        self.root = os.path.abspath(root)
+        self.root_prefix = self.root if self.root.endswith(os.sep) else self.root + os.sep
+        self.root_real = os.path.realpath(root)
+        # A separator-terminated prefix, so /data does not contain /data2
+        self.prefix = self.root_real if self.root_real.endswith(os.sep) else self.root_real + os.sep
+        self.root_fd = os.open(self.root_real, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | os.O_CLOEXEC)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.dirs = OrderedDict()     # directory as requested -> (expires, resolved directory)
+        self.generation = 0           # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def contains_real(self, real_path):
+        """Whether an already resolved path is the root or inside it"""
+        return real_path == self.root_real or real_path.startswith(self.prefix)
+
+    def _under_root(self, path):
+        return path == self.root or path.startswith(self.root_prefix)
+
+    def _resolve_dir(self, directory):
+        if directory == self.root:
+            return self.root_real
+        if not self._under_root(directory):
+            # Outside the served tree: not cached, and never admitted anyway
+            return os.path.realpath(directory)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.dirs.get(directory)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self.dirs.move_to_end(directory)
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        parent, name = os.path.split(directory)
+        resolved = self._resolve_name(self._resolve_dir(parent), name)
+        with self.lock:
+            if generation != self.generation:
+                return resolved
+            self.dirs[directory] = (now + self.ttl, resolved)
+            while len(self.dirs) > self.max_entries:
+                self.dirs.popitem(last=False)
+        return resolved
+
+    @staticmethod
+    def _resolve_name(real_parent, name):
+        candidate = os.path.join(real_parent, name)
+        return os.path.realpath(candidate) if os.path.islink(candidate) else candidate
+
+    def resolve(self, path):
+        """The real path of path; only the last component is looked at when its folder is cached"""
+        if not os.path.isabs(path):
+            path = os.path.join(os.getcwd(), path)
+        if '..' in path.split(os.sep):
+            # '..' after a symlink means something else than the text says
+            return os.path.realpath(path)
+        path = os.path.normpath(path)
+        if path == self.root:
+            return self.root_real
+        parent, name = os.path.split(path)
+        return self._resolve_name(self._resolve_dir(parent), name)
+
+    def is_within(self, path, strict=False):
+        """Whether path is inside the root; strict resolves every component instead of trusting cached folders.
+
+        Use strict for paths that are then used directly (walked, archived)
+        rather than opened through open() or listdir(), which check again.
+        """
+        if strict:
+            return self.contains_real(os.path.realpath(path))
+        return self.contains_real(self.resolve(path))
+
+    def open(self, path, flags=os.O_RDONLY):
+        """Open a file below the root through the root descriptor; raises PermissionError outside it"""
+        real_path = self.resolve(path)
+        if not self.contains_real(real_path):
+            raise PermissionError(f"Outside of {self.root}: {path}")
+        relative = os.path.relpath(real_path, self.root_real)
+        fd = os.open(relative, flags | os.O_CLOEXEC, dir_fd=self.root_fd)
+        try:
+            # A folder swapped for a symlink after resolve() shows up here
+            opened = os.readlink(f'/proc/self/fd/{fd}')
+        except OSError:
+            opened = None
+        if opened is not None and not self.contains_real(opened):
+            os.close(fd)
+            # The cached folder is stale (the watcher missed the change)
+            self.invalidate(os.path.dirname(os.path.normpath(path)))
+            raise PermissionError(f"Outside of {self.root}: {path}")
+        return fd
+
+    def listdir(self, path):
+        """Names in a folder below the root, listed through a descriptor checked like open()"""
+        fd = self.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+        try:
+            return os.listdir(fd)
+        finally:
+            os.close(fd)
+
+    def invalidate(self, path):
+        """Forget resolved folders at or below path"""
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            self.generation += 1
+            for key in [k for k in self.dirs if k == path or k.startswith(prefix)]:
+                del self.dirs[key]
+
+    def track(self, watcher, root_name):
+        """Drop cached folders when the watcher sees them (or symlinks to them) change"""
+        def apply_change(event):
+            if event.kind == 'rescan':
+                with self.lock:
+                    self.generation += 1
+                    self.dirs.clear()
+            elif event.is_dir or event.path in self.dirs:
+                self.invalidate(event.path)
+        watcher.subscribe(apply_change, root=root_name)
+
+
+_resolvers = {}
+_resolvers_lock = threading.Lock()
+
+
+def resolver_for(root):
+    """The shared PathResolver of a root directory"""
+    resolver = _resolvers.get(root)
+    if resolver is None:
+        with _resolvers_lock:
+            resolver = _resolvers.get(root)
+            if resolver is None:
+                resolver = _resolvers[root] = PathResolver(root)
+    return resolver
+
+
+def open_file(path, root=None):
+    """Open a file for binary reading, through root's directory descriptor when root is given"""
+    if root is None:
+        return open(path, 'rb')
+    return os.fdopen(resolver_for(root).open(path), 'rb')
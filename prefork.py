@@ -0,0 +1,344 @@
+"""
+Pre-forked multi-process mode for the Enhanced File Server
+A supervisor process forks PREFORK_WORKERS workers that accept connections
+from one shared listening socket (inherited, or one SO_REUSEPORT socket per
+worker), so CPU-heavy requests run on every core. The supervisor restarts
+workers that die, replaces them all on SIGHUP without dropping connections,
+and each worker exports its metrics to a shared directory so that /metrics
+on any worker reports all of them.
+"""
+
+import os
+import re
+import time
+import signal
+import socket
+import threading
+from config import *
+
+
+def worker_count(configured=PREFORK_WORKERS):
+    """Number of workers to run; 0 means one per CPU core"""
+    return configured if configured > 0 else (os.cpu_count() or 1)
+
+
+def create_listener(host, port, reuse_port=False):
+    """A listening TCP socket, non-blocking so idle workers never hang in accept()"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(PREFORK_BACKLOG)
+    sock.setblocking(False)
+    return sock
+
+
+class WorkerProcess:
+    """Bookkeeping for one forked worker"""
+
+    def __init__(self, slot, pid, generation):
+        self.slot = slot
+        self.pid = pid
+        self.generation = generation
+        self.started = time.monotonic()
+        self.retiring_since = None    # set once asked to stop
+
+
+class Supervisor:
+    """Forks the workers and keeps PREFORK_WORKERS of them running.
+
+    run_worker(slot, listener) runs inside each child and returns when the
+    worker has shut down; listener is the shared socket, or None when each
+    worker binds its own SO_REUSEPORT socket.
+
+    Signals: SIGHUP starts a graceful reload (new workers are started, then
+    the old ones finish their requests and exit); SIGTERM and SIGINT stop
+    everything gracefully.
+    """
+
+    def __init__(self, run_worker, host, port, workers=None, reuse_port=PREFORK_REUSEPORT,
+                 graceful_timeout=PREFORK_GRACEFUL_TIMEOUT, metrics_dir=PREFORK_METRICS_DIR):
+        self.run_worker = run_worker
+        self.host = host
+        self.port = port
+        self.workers = workers or worker_count()
+        self.reuse_port = reuse_port and hasattr(socket, 'SO_REUSEPORT')
+        self.graceful_timeout = graceful_timeout
+        self.metrics_dir = metrics_dir
+        self.listener = None
+        self.processes = {}           # pid -> WorkerProcess
+        self.generation = 0
+        self.restarts = 0
+        self.reloads = 0
+        self.backoff = {}             # slot -> (seconds, not before)
+        self.reload_requested = False
+        self.stop_requested = False
+
+    # -- child side ---------------------------------------------------------
+
+    def _spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                # The supervisor decides when workers stop; Ctrl+C reaches the
+                # whole process group, so workers wait for its SIGTERM instead
+                signal.signal(signal.SIGINT, signal.SIG_IGN)
+                signal.signal(signal.SIGHUP, signal.SIG_IGN)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                listener = self.listener
+                if self.reuse_port:
+                    listener = create_listener(self.host, self.port, reuse_port=True)
+                self.run_worker(slot, listener)
+            except BaseException as e:
+                print(f"❌ Worker {slot} (pid {os.getpid()}) failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        self.processes[pid] = WorkerProcess(slot, pid, self.generation)
+        return pid
+
+    # -- supervisor side ----------------------------------------------------
+
+    def _handle_signal(self, signum, frame):
+        if signum == signal.SIGHUP:
+            self.reload_requested = True
+        else:
+            self.stop_requested = True
+
+    def _slots_running(self):
+        return {p.slot for p in self.processes.values() if p.retiring_since is None}
+
+    def _retire(self, process):
+        if process.retiring_since is None:
+            process.retiring_since = time.monotonic()
+            self._signal(process.pid, signal.SIGTERM)
+
+    def _signal(self, pid, signum):
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _reap(self):
+        """Collect exited workers; returns the slots that died unexpectedly"""
+        died = []
+        while self.processes:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            process = self.processes.pop(pid, None)
+            if process is None or process.retiring_since is not None:
+                continue
+            uptime = time.monotonic() - process.started
+            print(f"⚠️  Worker {process.slot} (pid {pid}) exited with status "
+                  f"{os.waitstatus_to_exitcode(status)} after {uptime:.1f}s")
+            # Back off when a worker keeps dying right after it starts
+            delay, _ = self.backoff.get(process.slot, (0, 0))
+            delay = min(max(delay * 2, 1), PREFORK_MAX_BACKOFF) if uptime < PREFORK_MIN_UPTIME else 0
+            self.backoff[process.slot] = (delay, time.monotonic() + delay)
+            died.append(process.slot)
+        return died
+
+    def _reload(self):
+        """Start a new generation of workers, then retire the old one"""
+        self.reloads += 1
+        self.generation += 1
+        old = list(self.processes.values())
+        print(f"🔄 Reloading: starting {self.workers} new workers (generation {self.generation})")
+        for slot in range(self.workers):
+            self._spawn(slot)
+        for process in old:
+            self._retire(process)
+
+    def _kill_overdue(self):
+        now = time.monotonic()
+        for process in self.processes.values():
+            if process.retiring_since is not None and now - process.retiring_since > self.graceful_timeout:
+                self._signal(process.pid, signal.SIGKILL)
+
+    def write_metrics(self):
+        """Supervisor metrics, merged into /metrics by the workers"""
+        lines = [
+            '# HELP sheri_prefork_workers Worker processes currently running',
+            '# TYPE sheri_prefork_workers gauge',
+            f'sheri_prefork_workers {len(self._slots_running())}',
+            '# HELP sheri_prefork_restarts_total Workers restarted after exiting unexpectedly',
+            '# TYPE sheri_prefork_restarts_total counter',
+            f'sheri_prefork_restarts_total {self.restarts}',
+            '# HELP sheri_prefork_reloads_total Graceful reloads (SIGHUP)',
+            '# TYPE sheri_prefork_reloads_total counter',
+            f'sheri_prefork_reloads_total {self.reloads}',
+        ]
+        write_metrics_file(self.metrics_dir, 'supervisor', '\n'.join(lines) + '\n')
+
+    def run(self):
+        """Fork the workers and supervise them until SIGTERM or SIGINT"""
+        os.makedirs(self.metrics_dir, exist_ok=True)
+        for name in os.listdir(self.metrics_dir):
+            if name.endswith('.prom'):
+                os.unlink(os.path.join(self.metrics_dir, name))
+        if not self.reuse_port:
+            self.listener = create_listener(self.host, self.port)
+        for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._handle_signal)
+
+        for slot in range(self.workers):
+            self._spawn(slot)
+        print(f"👷 Supervisor pid {os.getpid()} running {self.workers} workers "
+              f"({'SO_REUSEPORT' if self.reuse_port else 'shared socket'})")
+
+        try:
+            while not self.stop_requested:
+                if self.reload_requested:
+                    self.reload_requested = False
+                    self._reload()
+                self.restarts += len(self._reap())
+                now = time.monotonic()
+                running = self._slots_running()
+                for slot in range(self.workers):
+                    if slot not in running and self.backoff.get(slot, (0, 0))[1] <= now:
+                        self._spawn(slot)
+                self._kill_overdue()
+                self.write_metrics()
+                time.sleep(PREFORK_POLL_INTERVAL)
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        """Ask every worker to finish its requests, then kill what is left"""
+        for process in list(self.processes.values()):
+            self._retire(process)
+        deadline = time.monotonic() + self.graceful_timeout
+        while self.processes and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.processes):
+            self._signal(pid, signal.SIGKILL)
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.processes.clear()
+        if self.listener is not None:
+            self.listener.close()
+
+
+class GracefulStop:
+    """Worker-side SIGTERM handling: stop accepting, let requests in flight finish"""
+
+    def __init__(self, httpd, in_flight, timeout=PREFORK_GRACEFUL_TIMEOUT):
+        self.httpd = httpd
+        self.in_flight = in_flight    # callable returning the number of running requests
+        self.timeout = timeout
+        self.requested = threading.Event()
+
+    def install(self):
+        signal.signal(signal.SIGTERM, self._handle_signal)
+
+    def _handle_signal(self, signum, frame):
+        if not self.requested.is_set():
+            self.requested.set()
+            # shutdown() waits for serve_forever, which runs in this thread
+            threading.Thread(target=self.httpd.shutdown, daemon=True).start()
+
+    def wait_for_requests(self):
+        deadline = time.monotonic() + self.timeout
+        while self.in_flight() > 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+def write_metrics_file(directory, name, text):
+    path = os.path.join(directory, name + '.prom')
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    """Periodically writes one worker's metrics for the other workers to merge"""
+
+    def __init__(self, slot, render, directory=PREFORK_METRICS_DIR, interval=PREFORK_METRICS_INTERVAL):
+        self.slot = slot
+        self.render = render
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+
+    def export(self):
+        try:
+            write_metrics_file(self.directory, f"worker-{self.slot}", self.render())
+        except OSError:
+            pass
+
+    def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.export()
+        threading.Thread(target=run, daemon=True, name='metrics-exporter').start()
+
+    def stop(self):
+        self._stop.set()
+
+    def aggregate(self):
+        """All workers' metrics (this one rendered live) with a worker label, plus the supervisor's"""
+        sources = [(str(self.slot), self.render())]
+        cutoff = time.time() - PREFORK_METRICS_STALE
+        try:
+            names = sorted(os.listdir(self.directory))
+        except OSError:
+            names = []
+        for name in names:
+            match = re.fullmatch(r'worker-(\d+)\.prom|(supervisor)\.prom', name)
+            if not match or match.group(1) == str(self.slot):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    continue      # a slot that is no longer running
+                with open(path, 'r') as f:
+                    sources.append((match.group(1), f.read()))
+            except OSError:
+                continue
+        return merge_metrics(sources)
+
+
+SAMPLE_NAME = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*)?( .*)$')
+
+
+def merge_metrics(sources):
+    """Merge Prometheus text from several processes, keeping each family's samples together.
+
+    sources is a list of (worker label or None, text); samples get a
+    worker="<label>" label so per-worker series stay distinct.
+    """
+    families = {}                 # family name -> [header lines, sample lines]
+    for worker, text in sources:
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# '):
+                parts = line.split(' ', 3)
+                if len(parts) >= 3 and parts[1] in ('HELP', 'TYPE'):
+                    family = families.setdefault(parts[2], [[], []])
+                    if len(family[0]) < 2 and line not in family[0]:
+                        family[0].append(line)
+                continue
+            match = SAMPLE_NAME.match(line)
+            if family is None or not match:
+                continue
+            name, labels, value = match.groups()
+            if worker is not None:
+                labels = f'{{worker="{worker}"' + (',' + labels[1:] if labels and labels != '{}' else '}')
+            family[1].append(name + (labels or '') + value)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,357 @@
+"""
+On-demand profiling for the Enhanced File Server
+Lets an operator profile a running server without restarting it: cProfile for
+the next N requests, a sampled wall-clock profile of every thread, and
+tracemalloc peaks per route. Results are written as files that can be
+downloaded from /debug/profile
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import itertools
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+from config import *
+
+
+SESSION_IDS = itertools.count(1)
+
+
+def session_name(kind):
+    """Unique file name stem, e.g. cprofile-20240501-120000-4242-3"""
+    return f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(SESSION_IDS)}"
+
+
+class RequestSession:
+    """Base for sessions that cover the next N requests, optionally of one route"""
+
+    kind = None
+
+    def __init__(self, requests, route=None):
+        self.name = session_name(self.kind)
+        self.requests = requests
+        self.route = route
+        self.started = 0
+        self.finished = 0
+        self.created = time.time()
+        self.lock = threading.Lock()
+
+    def claim(self, route):
+        """Reserve a slot for a request; returns False once N requests were taken"""
+        if self.route is not None and route != self.route:
+            return False
+        with self.lock:
+            if self.started >= self.requests:
+                return False
+            self.started += 1
+            return True
+
+    def done(self):
+        with self.lock:
+            return self.finished >= self.requests
+
+    def status(self):
+        return {'name': self.name, 'kind': self.kind, 'route': self.route,
+                'requests': self.requests, 'finished': self.finished}
+
+
+class CProfileSession(RequestSession):
+    """Deterministic profile of each request, merged into one pstats file"""
+
+    kind = 'cprofile'
+
+    def __init__(self, requests, route=None):
+        super().__init__(requests, route)
+        self.stats = None
+
+    def begin(self):
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already active in this thread (Python 3.12+)
+            return None
+        return profile
+
+    def end(self, profile):
+        import pstats   # only needed once a profile has been taken
+        profile.disable()
+        with self.lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.finished += 1
+
+    def write(self, directory):
+        """Write <name>.prof (for pstats/snakeviz) and a text report; returns the file names"""
+        with self.lock:
+            if self.stats is None:
+                return []
+            self.stats.dump_stats(os.path.join(directory, self.name + '.prof'))
+            report = io.StringIO()
+            self.stats.stream = report
+            self.stats.sort_stats('cumulative').print_stats(PROFILE_REPORT_LINES)
+            self.stats.sort_stats('tottime').print_stats(PROFILE_REPORT_LINES)
+        with open(os.path.join(directory, self.name + '.txt'), 'w') as f:
+            f.write(f"cProfile of {self.finished} request(s), route: {self.route or 'any'}\n")
+            f.write(report.getvalue())
+        return [self.name + '.prof', self.name + '.txt']
+
+
+class TracemallocSession(RequestSession):
+    """Peak Python allocations per route while tracemalloc is tracing.
+
+    tracemalloc counts allocations process-wide, so with concurrent requests
+    a peak also includes memory allocated by the other requests in flight;
+    profile a single route under light load for exact numbers.
+    """
+
+    kind = 'tracemalloc'
+
+    def __init__(self, requests, route=None):
+        super().__init__(requests, route)
+        self.started_tracing = False
+        self.routes = {}          # route -> [requests, total peak, max peak, max peak path]
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self.started_tracing = True
+
+    def begin(self):
+        tracemalloc.reset_peak()
+        return tracemalloc.get_traced_memory()[0]
+
+    def end(self, baseline, route, path):
+        peak = max(0, tracemalloc.get_traced_memory()[1] - baseline)
+        with self.lock:
+            entry = self.routes.setdefault(route, [0, 0, 0, None])
+            entry[0] += 1
+            entry[1] += peak
+            if peak >= entry[2]:
+                entry[2] = peak
+                entry[3] = path
+            self.finished += 1
+
+    def write(self, directory):
+        """Write per-route peaks (JSON), a snapshot dump and its top allocation sites"""
+        files = []
+        with self.lock:
+            routes = {route: {'requests': count, 'mean_peak_bytes': total // count,
+                              'max_peak_bytes': max_peak, 'max_peak_path': path}
+                      for route, (count, total, max_peak, path) in self.routes.items()}
+        with open(os.path.join(directory, self.name + '.json'), 'w') as f:
+            json.dump({'route': self.route, 'requests': self.finished, 'routes': routes}, f, indent=2)
+        files.append(self.name + '.json')
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            snapshot.dump(os.path.join(directory, self.name + '.snapshot'))
+            with open(os.path.join(directory, self.name + '.txt'), 'w') as f:
+                f.write("Peak allocation per route (bytes):\n")
+                for route, info in sorted(routes.items(), key=lambda item: -item[1]['max_peak_bytes']):
+                    f.write(f"  {route:12} max {info['max_peak_bytes']:>12,}  mean {info['mean_peak_bytes']:>12,}"
+                            f"  ({info['requests']} requests, worst: {info['max_peak_path']})\n")
+                f.write(f"\nTop {PROFILE_REPORT_LINES} allocation sites still held at the end of the session:\n")
+                for stat in snapshot.statistics('lineno')[:PROFILE_REPORT_LINES]:
+                    f.write(f"  {stat}\n")
+            files.extend([self.name + '.snapshot', self.name + '.txt'])
+            if self.started_tracing:
+                tracemalloc.stop()
+        return files
+
+
+class SamplingSession:
+    """Wall-clock sampler: records the stack of every thread at a fixed interval"""
+
+    kind = 'sample'
+
+    def __init__(self, seconds, interval):
+        self.name = session_name(self.kind)
+        self.seconds = seconds
+        self.interval = interval
+        self.created = time.time()
+        self.samples = 0
+        self.stacks = Counter()       # folded stack -> samples
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def run(self, on_finished):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline and not self.stop_event.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+            self.stop_event.wait(self.interval)
+        on_finished(self)
+
+    def start(self, on_finished):
+        self.thread = threading.Thread(target=self.run, args=(on_finished,), name='profile-sampler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def done(self):
+        return self.thread is not None and not self.thread.is_alive()
+
+    def status(self):
+        return {'name': self.name, 'kind': self.kind, 'seconds': self.seconds,
+                'interval': self.interval, 'samples': self.samples}
+
+    def write(self, directory):
+        """Write folded stacks (for flamegraph.pl / speedscope) and a text summary"""
+        with open(os.path.join(directory, self.name + '.folded'), 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')[1:]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                inclusive[frame] += count
+        total = sum(self.stacks.values()) or 1
+        with open(os.path.join(directory, self.name + '.txt'), 'w') as f:
+            f.write(f"{self.samples} samples every {self.interval * 1000:g} ms over {self.seconds:g} s "
+                    f"({total} thread stacks)\n\nTop frames by own samples:\n")
+            for frame, count in own.most_common(PROFILE_REPORT_LINES):
+                f.write(f"  {count * 100 / total:6.2f}%  {frame}\n")
+            f.write("\nTop frames including callees:\n")
+            for frame, count in inclusive.most_common(PROFILE_REPORT_LINES):
+                f.write(f"  {count * 100 / total:6.2f}%  {frame}\n")
+        return [self.name + '.folded', self.name + '.txt']
+
+
+class Profiler:
+    """Runs profiling sessions and keeps track of the files they produced.
+
+    The request handler calls request_started() and request_finished()
+    around every request; both return immediately unless a session is
+    active, so the hooks cost nothing in normal operation.
+    """
+
+    def __init__(self, directory=PROFILE_DIR):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.request_sessions = []
+        self.samplers = []
+
+    def _finish(self, session):
+        """Write a session's results and forget it"""
+        with self.lock:
+            if session in self.request_sessions:
+                self.request_sessions.remove(session)
+            elif session in self.samplers:
+                self.samplers.remove(session)
+            else:
+                return
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            session.write(self.directory)
+        except Exception as e:
+            print(f"⚠️  Could not write profile {session.name}: {e}")
+
+    def start_cprofile(self, requests, route=None):
+        session = CProfileSession(requests, route)
+        with self.lock:
+            self.request_sessions.append(session)
+        return session
+
+    def start_tracemalloc(self, requests, route=None):
+        with self.lock:
+            if any(isinstance(s, TracemallocSession) for s in self.request_sessions):
+                raise ValueError("A tracemalloc session is already running")
+            session = TracemallocSession(requests, route)
+            session.start()
+            self.request_sessions.append(session)
+        return session
+
+    def start_sampler(self, seconds, interval=PROFILE_SAMPLE_INTERVAL):
+        session = SamplingSession(seconds, interval)
+        with self.lock:
+            self.samplers.append(session)
+        session.start(self._finish)
+        return session
+
+    def stop_all(self):
+        """End every active session early, writing what was collected so far"""
+        with self.lock:
+            request_sessions = list(self.request_sessions)
+            samplers = list(self.samplers)
+        for sampler in samplers:
+            sampler.stop()
+        for session in request_sessions:
+            self._finish(session)
+
+    def request_started(self, route):
+        """Return the per-request profiling state, or None when nothing is profiled"""
+        if not self.request_sessions or route == 'debug':
+            return None
+        with self.lock:
+            sessions = list(self.request_sessions)
+        active = []
+        for session in sessions:
+            if isinstance(session, TracemallocSession) and session.claim(route):
+                active.append((session, session.begin()))
+        # cProfile starts last so it does not profile the other sessions' setup
+        for session in sessions:
+            if isinstance(session, CProfileSession) and session.claim(route):
+                profile = session.begin()
+                if profile is None:
+                    with session.lock:
+                        session.started -= 1
+                    continue
+                active.append((session, profile))
+        return active or None
+
+    def request_finished(self, active, route, path):
+        if not active:
+            return
+        for session, state in reversed(active):
+            if isinstance(session, CProfileSession):
+                session.end(state)
+            else:
+                session.end(state, route, path)
+            if session.done():
+                self._finish(session)
+
+    def status(self):
+        """Active sessions and the result files available for download"""
+        with self.lock:
+            active = [s.status() for s in self.request_sessions + self.samplers]
+        files = []
+        if os.path.isdir(self.directory):
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name, reverse=True):
+                if entry.is_file():
+                    files.append({'name': entry.name, 'size': entry.stat().st_size,
+                                  'url': f"/debug/profile/files/{entry.name}"})
+        return {'active': active, 'files': files}
+
+    def file_path(self, name):
+        """Return the path of a result file, or None for unknown names"""
+        if not name or name != os.path.basename(name) or name.startswith('.'):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
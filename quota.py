@@ -0,0 +1,252 @@
+"""
+Upload quotas and disk-space accounting for the Enhanced File Server
+Uploads reserve their declared size (Content-Length) before the body is
+read: the reservation is checked against the uploader's quota, the global
+upload quota and the free space on the upload disk, minus what uploads
+already in flight have reserved, so concurrent uploads cannot oversubscribe
+the disk and a doomed upload is refused before any bandwidth is spent.
+"""
+
+import os
+import json
+import shutil
+import threading
+from config import *
+
+
+class QuotaExceeded(Exception):
+    """Raised when an upload cannot be accepted; status is the HTTP status to answer with (413 quota, 507 disk space)"""
+
+    def __init__(self, status, reason, message):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason
+
+
+class Reservation:
+    """Space held for one upload request until it is finished or cancelled"""
+
+    def __init__(self, quota, user, size):
+        self.quota = quota
+        self.user = user
+        self.size = size
+        self.written = 0              # bytes already on disk, no longer held as free space
+        self.files = []               # (name, size) saved by this upload
+        self.done = False
+
+    def consume(self, amount):
+        """Account bytes as they are written; refuses to write past the reservation"""
+        if self.written + amount > self.size:
+            raise QuotaExceeded(413, 'reservation', "Upload is larger than its Content-Length")
+        with self.quota.lock:
+            self.written += amount
+            self.quota.unwritten -= amount
+
+    def saved(self, name, size):
+        self.files.append((name, size))
+
+    def finish(self):
+        """Charge the saved files to the user and release the rest of the reservation"""
+        self.quota._close(self, commit=True)
+
+    def cancel(self):
+        self.quota._close(self, commit=False)
+
+
+class UploadQuota:
+    """Per-user and global upload quotas plus free-space checks for the upload directory.
+
+    Global usage comes from the upload catalog; per-user usage is kept in
+    an owner table (file name -> user, size) saved to the state directory.
+    A limit of 0 disables that check.
+
+    Worker processes pass a shared_dir: each one then publishes its
+    outstanding reservations and per-user usage in a small file of its own
+    there (rewritten when they change), and adds what the other live
+    workers published to its checks. A single process shares nothing.
+    """
+
+    def __init__(self, catalog, upload_dir=UPLOAD_DIR, state_dir=STATE_DIR,
+                 user_limit=UPLOAD_USER_QUOTA, total_limit=UPLOAD_TOTAL_QUOTA,
+                 min_free=UPLOAD_MIN_FREE_SPACE, max_upload=UPLOAD_MAX_SIZE, shared_dir=None):
+        self.catalog = catalog
+        self.upload_dir = upload_dir
+        self.owners_path = os.path.join(state_dir, 'upload_owners.json')
+        self.shared_path = os.path.join(shared_dir, 'upload_quota') if shared_dir else None
+        self.user_limit = user_limit
+        self.total_limit = total_limit
+        self.min_free = min_free
+        self.max_upload = max_upload
+        self.lock = threading.Lock()
+        self.owners = {}              # file name -> (user, size)
+        self.user_usage = {}          # user -> bytes owned
+        self.reserved = {}            # user -> bytes held by uploads in flight
+        self.reserved_total = 0
+        self.unwritten = 0            # reserved bytes not written yet (still free on disk)
+        self.rejected = {}            # reason -> count
+
+    def _reject(self, status, reason, message):
+        self.rejected[reason] = self.rejected.get(reason, 0) + 1
+        raise QuotaExceeded(status, reason, message)
+
+    def reserve(self, user, size):
+        """Hold size bytes for an upload by user, or raise QuotaExceeded"""
+        try:
+            free = shutil.disk_usage(self.upload_dir).free
+        except OSError:
+            free = None
+        other_reserved, other_total, other_used = self._others()
+        with self.lock:
+            if self.max_upload and size > self.max_upload:
+                self._reject(413, 'max_upload', f"Uploads are limited to {self.max_upload} bytes")
+            if self.user_limit:
+                used = (self.user_usage.get(user, 0) + other_used.get(user, 0) +
+                        self.reserved.get(user, 0) + other_reserved.get(user, 0))
+                if used + size > self.user_limit:
+                    self._reject(413, 'user_quota', f"Upload quota exceeded: {used} of {self.user_limit} bytes "
+                                                    f"used, {size} more requested")
+            reserved = self.reserved_total + other_total
+            if self.total_limit and self.catalog.total_bytes + reserved + size > self.total_limit:
+                self._reject(413, 'total_quota', "The upload area is full")
+            # Other workers' reservations count in full, written or not, which errs on the side of refusing
+            if free is not None and free - self.unwritten - other_total - self.min_free < size:
+                self._reject(507, 'disk_space', "Not enough free disk space for this upload")
+            self.reserved[user] = self.reserved.get(user, 0) + size
+            self.reserved_total += size
+            self.unwritten += size
+            self._publish()
+            return Reservation(self, user, size)
+
+    def _close(self, reservation, commit):
+        with self.lock:
+            if reservation.done:
+                return
+            reservation.done = True
+            user = reservation.user
+            remaining = self.reserved.get(user, 0) - reservation.size
+            if remaining > 0:
+                self.reserved[user] = remaining
+            else:
+                self.reserved.pop(user, None)
+            self.reserved_total -= reservation.size
+            self.unwritten -= reservation.size - reservation.written
+            if commit:
+                for name, size in reservation.files:
+                    self._set_owner(name, user, size)
+            self._publish()
+
+    def _set_owner(self, name, user, size):
+        old = self.owners.pop(name, None)
+        if old is not None:
+            self.user_usage[old[0]] = self.user_usage.get(old[0], 0) - old[1]
+        if user is not None:
+            self.owners[name] = (user, size)
+            self.user_usage[user] = self.user_usage.get(user, 0) + size
+
+    def usage(self, user):
+        """(bytes used by user, user limit) for display"""
+        other_used = self._others()[2]
+        with self.lock:
+            return self.user_usage.get(user, 0) + other_used.get(user, 0), self.user_limit
+
+    def _publish(self):
+        """Write this process's reservations and usage for the other workers; the caller holds the lock"""
+        if self.shared_path is None:
+            return
+        data = json.dumps({'reserved': self.reserved, 'used': self.user_usage})
+        path = os.path.join(self.shared_path, f"{os.getpid()}.json")
+        os.makedirs(self.shared_path, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+    def _others(self):
+        """(reserved by user, total reserved, used by user) as published by the other live workers"""
+        reserved, total, used = {}, 0, {}
+        if self.shared_path is None:
+            return reserved, total, used
+        try:
+            names = os.listdir(self.shared_path)
+        except OSError:
+            return reserved, total, used
+        for name in names:
+            pid, _, ext = name.partition('.')
+            if ext != 'json' or not pid.isdecimal() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(self.shared_path, name)
+            if not process_alive(int(pid)):
+                # The worker died before it could close its reservations
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, 'r') as f:
+                    published = json.load(f)
+            except (OSError, ValueError):
+                continue
+            for user, size in published['reserved'].items():
+                reserved[user] = reserved.get(user, 0) + size
+                total += size
+            for user, size in published['used'].items():
+                used[user] = used.get(user, 0) + size
+        return reserved, total, used
+
+    def apply_change(self, event):
+        """Keep owners current when uploaded files are deleted or replaced outside the upload form"""
+        if event.kind == 'rescan':
+            with self.lock:
+                for name in list(self.owners):
+                    if not os.path.isfile(os.path.join(self.upload_dir, name)):
+                        self._set_owner(name, None, 0)
+                self._publish()
+            return
+        if not event.rel_path or '/' in event.rel_path or event.rel_path not in self.owners:
+            return
+        try:
+            size = os.stat(event.path).st_size if event.kind != 'deleted' else None
+        except OSError:
+            size = None
+        with self.lock:
+            owner = self.owners.get(event.rel_path)
+            if owner is not None:
+                self._set_owner(event.rel_path, owner[0] if size is not None else None, size or 0)
+                self._publish()
+
+    def load(self):
+        try:
+            with open(self.owners_path, 'r') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            for name, user, size in saved:
+                # Files deleted while the server was down are not charged
+                if self.catalog.files.get(name) is not None:
+                    self._set_owner(name, user, self.catalog.files[name][0])
+            self._publish()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps([[name, user, size] for name, (user, size) in self.owners.items()])
+        temp_path = self.owners_path + '.tmp'
+        os.makedirs(os.path.dirname(self.owners_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.owners_path)
+        if self.shared_path is not None:
+            try:
+                os.unlink(os.path.join(self.shared_path, f"{os.getpid()}.json"))
+            except OSError:
+                pass
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,334 @@
+"""
+Path search index for the Enhanced File Server
+Keeps a trigram index of every path under the browse root so that substring,
+glob and extension queries do not have to walk the directory tree
+"""
+
+import os
+import re
+import fnmatch
+import heapq
+import threading
+import time
+from config import *
+
+GLOB_CHARS = '*?['
+
+
+def trigrams(text):
+    """Return the set of 3-character substrings of text"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def glob_literals(pattern):
+    """Return the literal runs of a glob pattern (the parts between wildcards)"""
+    return [part for part in re.split(r'\[[^\]]*\]|[*?]', pattern) if part]
+
+
+class SearchTerm:
+    """A single query term: ext:<ext>, a glob pattern or a plain substring"""
+
+    def __init__(self, text):
+        text = text.lower()
+        self.extension = None
+        self.regex = None
+        self.match_basename = False
+        self.literals = []
+
+        if text.startswith('ext:'):
+            ext = text[4:].lstrip('.')
+            self.extension = f".{ext}"
+        elif any(c in text for c in GLOB_CHARS):
+            # "*.py" is answered straight from the extension index
+            if re.fullmatch(r'\*\.[^*?\[/.]+', text):
+                self.extension = text[1:]
+            else:
+                self.regex = re.compile(fnmatch.translate(text))
+                self.match_basename = '/' not in text
+                self.literals = glob_literals(text)
+        else:
+            self.literals = [text]
+
+    def matches(self, lower_path):
+        """Check a lowercased relative path against this term"""
+        if self.extension is not None:
+            return os.path.splitext(lower_path)[1] == self.extension
+        if self.regex is not None:
+            target = lower_path.rsplit('/', 1)[-1] if self.match_basename else lower_path
+            return self.regex.match(target) is not None
+        return self.literals[0] in lower_path
+
+
+class PathIndex:
+    """In-memory index of all paths below a root directory.
+
+    Paths are stored relative to the root with '/' separators. Every path is
+    broken into trigrams so a query only has to verify the few paths that
+    share all trigrams of its literal parts. Directory modification times are
+    remembered so refresh() only re-lists directories whose entries changed.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.lock = threading.RLock()
+        self.paths = []           # id -> relative path, None once removed
+        self.lower_paths = []     # id -> lowercased relative path
+        self.dir_flags = []       # id -> True for directories
+        self.ids = {}             # relative path -> id
+        self.free_ids = []
+        self.postings = {}        # trigram -> set of ids
+        self.extensions = {}      # extension -> set of ids
+        self.children = {}        # relative dir -> set of child names
+        self.dir_mtimes = {}      # relative dir -> st_mtime_ns at last listing
+        self.ready = False
+        self.last_refresh = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def _add_path(self, rel_path, is_dir):
+        if rel_path in self.ids:
+            return
+        lower = rel_path.lower()
+        if self.free_ids:
+            path_id = self.free_ids.pop()
+            self.paths[path_id] = rel_path
+            self.lower_paths[path_id] = lower
+            self.dir_flags[path_id] = is_dir
+        else:
+            path_id = len(self.paths)
+            self.paths.append(rel_path)
+            self.lower_paths.append(lower)
+            self.dir_flags.append(is_dir)
+        self.ids[rel_path] = path_id
+
+        for gram in trigrams(lower):
+            self.postings.setdefault(gram, set()).add(path_id)
+        if not is_dir:
+            ext = os.path.splitext(lower)[1]
+            if ext:
+                self.extensions.setdefault(ext, set()).add(path_id)
+
+    def _remove_path(self, rel_path):
+        path_id = self.ids.pop(rel_path, None)
+        if path_id is None:
+            return
+        lower = self.lower_paths[path_id]
+        for gram in trigrams(lower):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(path_id)
+                if not posting:
+                    del self.postings[gram]
+        ext = os.path.splitext(lower)[1]
+        if ext in self.extensions:
+            self.extensions[ext].discard(path_id)
+            if not self.extensions[ext]:
+                del self.extensions[ext]
+
+        was_dir = self.dir_flags[path_id]
+        self.paths[path_id] = None
+        self.lower_paths[path_id] = None
+        self.dir_flags[path_id] = False
+        self.free_ids.append(path_id)
+
+        if was_dir:
+            self._remove_subtree(rel_path)
+
+    def _remove_subtree(self, rel_dir):
+        for name in self.children.pop(rel_dir, ()):
+            self._remove_path(f"{rel_dir}/{name}" if rel_dir else name)
+        self.dir_mtimes.pop(rel_dir, None)
+
+    def _scan_directory(self, rel_dir, recursive):
+        """List one directory and reconcile its children with the index.
+
+        Returns the relative paths of subdirectories that still need to be
+        visited (new ones always, existing ones only when recursive is set).
+        """
+        abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        try:
+            mtime = os.stat(abs_dir).st_mtime_ns
+            with os.scandir(abs_dir) as it:
+                entries = {}
+                for entry in it:
+                    try:
+                        entries[entry.name] = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+        except OSError:
+            with self.lock:
+                self._remove_subtree(rel_dir)
+            return []
+
+        pending = []
+        with self.lock:
+            old_names = self.children.get(rel_dir, set())
+            for name in old_names - entries.keys():
+                self._remove_path(f"{rel_dir}/{name}" if rel_dir else name)
+            for name, is_dir in entries.items():
+                child = f"{rel_dir}/{name}" if rel_dir else name
+                existing = self.ids.get(child)
+                if existing is not None and self.dir_flags[existing] != is_dir:
+                    self._remove_path(child)
+                    existing = None
+                if existing is None:
+                    self._add_path(child, is_dir)
+                    if is_dir:
+                        pending.append(child)
+                elif is_dir and recursive:
+                    pending.append(child)
+            self.children[rel_dir] = set(entries)
+            self.dir_mtimes[rel_dir] = mtime
+        return pending
+
+    def build(self):
+        """Walk the whole tree and index every path"""
+        stack = ['']
+        while stack and not self._stop.is_set():
+            stack.extend(self._scan_directory(stack.pop(), recursive=True))
+        self.ready = True
+        self.last_refresh = time.time()
+
+    def refresh(self):
+        """Re-list only the directories whose mtime changed since the last scan.
+
+        Adding, removing or renaming an entry updates its parent directory's
+        mtime, so a stat per directory is enough to find every change.
+        """
+        with self.lock:
+            known_dirs = list(self.dir_mtimes.items())
+        for rel_dir, old_mtime in known_dirs:
+            if self._stop.is_set():
+                return
+            abs_dir = os.path.join(self.root, rel_dir) if rel_dir else self.root
+            try:
+                changed = os.stat(abs_dir).st_mtime_ns != old_mtime
+            except OSError:
+                changed = True
+            if changed:
+                self.refresh_directory(rel_dir)
+        self.last_refresh = time.time()
+
+    def refresh_directory(self, rel_dir):
+        """Re-list one directory, indexing any new subdirectories fully"""
+        with self.lock:
+            if rel_dir and rel_dir not in self.ids:
+                return
+        stack = self._scan_directory(rel_dir, recursive=False)
+        while stack and not self._stop.is_set():
+            stack.extend(self._scan_directory(stack.pop(), recursive=False))
+
+    def apply_change(self, event):
+        """Update the index from a change watcher event"""
+        if event.kind == 'rescan':
+            self.refresh()
+            return
+        rel_path = event.rel_path
+        if not rel_path:
+            return
+        parent, _, name = rel_path.rpartition('/')
+
+        if event.kind == 'deleted':
+            with self.lock:
+                self._remove_path(rel_path)
+                self.children.get(parent, set()).discard(name)
+        elif event.kind == 'created':
+            with self.lock:
+                if parent not in self.children:
+                    return  # parent not indexed yet, it will be listed in full
+                if rel_path in self.ids:
+                    return
+                self._add_path(rel_path, event.is_dir)
+                self.children[parent].add(name)
+            if event.is_dir:
+                self.refresh_directory(rel_path)
+
+    def start(self, interval=SEARCH_INDEX_REFRESH_INTERVAL):
+        """Build the index and keep refreshing it in a background thread.
+
+        Pass interval=None when a change watcher feeds apply_change(), in
+        which case no periodic refresh is needed.
+        """
+        def run():
+            self.build()
+            if interval is None:
+                return
+            while not self._stop.wait(interval):
+                self.refresh()
+
+        self._thread = threading.Thread(target=run, name='path-index', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _candidates(self, term):
+        """Return the set of ids that may match a term, or None for 'all'"""
+        if term.extension is not None:
+            return set(self.extensions.get(term.extension, ()))
+        grams = set()
+        for literal in term.literals:
+            grams |= trigrams(literal)
+        if not grams:
+            return None
+        postings = []
+        for gram in grams:
+            posting = self.postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            result &= posting
+            if not result:
+                break
+        return result
+
+    def search(self, query, scope='', limit=SEARCH_MAX_RESULTS):
+        """Find paths matching every whitespace-separated term of query.
+
+        scope restricts results to a relative directory. Returns a tuple
+        (results, truncated) where results is a sorted list of
+        (relative_path, is_dir) pairs.
+        """
+        terms = [SearchTerm(text) for text in query.split()]
+        if not terms:
+            return [], False
+        scope = scope.strip('/').lower()
+        scope_prefix = f"{scope}/" if scope else ''
+
+        with self.lock:
+            candidates = None
+            for term in terms:
+                ids = self._candidates(term)
+                if ids is None:
+                    continue
+                candidates = ids if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = range(len(self.paths))
+
+            matches = ((self.paths[path_id], self.dir_flags[path_id]) for path_id in candidates
+                       if self._matches(path_id, scope_prefix, terms))
+            # The first `limit` in sorted order, so a truncated result is stable between calls
+            results = heapq.nsmallest(limit + 1, matches)
+
+        truncated = len(results) > limit
+        return results[:limit], truncated
+
+    def _matches(self, path_id, scope_prefix, terms):
+        lower = self.lower_paths[path_id]
+        if lower is None or not lower.startswith(scope_prefix):
+            return False
+        return all(term.matches(lower) for term in terms)
+
+    def stats(self):
+        """Return a summary of the index size"""
+        with self.lock:
+            return {
+                'paths': len(self.ids),
+                'directories': len(self.dir_mtimes),
+                'trigrams': len(self.postings),
+                'ready': self.ready,
+                'last_refresh': self.last_refresh,
+            }
@@ -6,35 +6,372 @@ Main server file that handles HTTP requests and routing
 
 import http.server
 import socketserver
+from http import HTTPStatus
 import os
-import cgi
+import sys
+import errno
 import base64
+import hashlib
 import urllib.parse
 from pathlib import Path
 import mimetypes
-import zipfile
-import tempfile
 import html
 import datetime
+import json
+import time
+import argparse
+import threading
+from contextlib import contextmanager
 
 # Import local modules
 from config import *
 from utils import FileServerUtils
 from templates import TemplateRenderer
+from search import PathIndex
+from watcher import create_watcher
+from changelog import ChangeJournal
+from dirsize import DirectorySizes
+from checksums import ChecksumService, SUPPORTED_ALGORITHMS, digest_header_value
+from delta import SignatureCache, encode_signature, decode_signature, generate_delta
+import metrics
+from metrics import METRICS, CountingWriter, route_name
+from timing import PhaseTimer, SlowRequestLog
+from profiling import Profiler
+from sessions import SessionManager, cookie_value
+from shaping import TransferShaper, ShapedWriter
+from admission import AdmissionController, Rejected
+from archives import ARCHIVE_FORMATS, ArchiveSink, iter_entries, write_archive, archive_filename
+from archive_index import ArchiveIndexCache, ArchiveError, archive_kind
+from hotcache import HotObjectCache
+from statcache import MetadataCache, RequestStats
+from pathres import resolver_for
+from upload_catalog import UploadCatalog
+from quota import UploadQuota, QuotaExceeded
+from multipart import MultipartReader, BodyTruncated
+from prefork import Supervisor, GracefulStop, MetricsExporter, worker_count
+import sessions
+
+# Shared services, created in main() once the browse directory is known
+CHANGE_WATCHER = None
+PATH_INDEX = None
+CHANGE_JOURNAL = None
+DIR_SIZES = None
+UPLOADS = None
+QUOTAS = None
+CHECKSUMS = None
+SESSIONS = None
+STARTUP_THREAD = None
+
+# Set in pre-forked workers: exports and merges per-worker metrics, and stops the worker gracefully
+METRICS_EXPORTER = None
+GRACEFUL_STOP = None
+
+# Server-side block signatures for delta downloads, cached per file version
+SIGNATURES = SignatureCache()
+metrics.register_cache('signature', SIGNATURES)
+
+# Parsed member tables of archives browsed like folders, cached per archive version
+ARCHIVE_INDEXES = ArchiveIndexCache()
+metrics.register_cache('archive_index', ARCHIVE_INDEXES)
+
+# stat results shared by all requests for STAT_CACHE_TTL seconds
+STAT_CACHE = MetadataCache()
+metrics.register_cache('stat', STAT_CACHE)
+
+# Bodies, headers and gzip variants of small hot files, served without touching the disk
+HOT_CACHE = HotObjectCache()
+metrics.register_cache('hot_object', HOT_CACHE)
+
+# Requests slower than SLOW_REQUEST_THRESHOLD_MS, with their phase breakdown
+SLOW_LOG = SlowRequestLog()
+
+# Paces bulk transfers so one client cannot take the whole uplink
+SHAPER = TransferShaper()
+
+# Per-route concurrency limits and queues; excess requests get a fast 503/429
+ADMISSION = AdmissionController()
+
+# On-demand cProfile, sampling and tracemalloc sessions started from /debug/profile
+PROFILER = Profiler()
 
 class FileServer(http.server.SimpleHTTPRequestHandler):
+    # Persistent connections; every response is framed by Content-Length,
+    # chunked encoding or closing the connection
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits for the client's delayed ACK on a reused connection
+    disable_nagle_algorithm = True
+    
     def __init__(self, *args, **kwargs):
-        self.utils = FileServerUtils()
+        self.fs = RequestStats(STAT_CACHE)
+        self.utils = FileServerUtils(self.fs)
         self.template_renderer = TemplateRenderer()
+        self.request_route = None
+        self.response_status = None
+        self.headers_sent = False
+        self.body_pending = False
+        self.stream_buffer = None
+        self.stream_chunked = False
+        self.username = None
+        self.session_cookie = None
+        self.shaped = False
+        self.admission_ticket = None
+        self.continue_pending = False
+        self.timer = PhaseTimer()
+        self.profile_state = None
         super().__init__(*args, **kwargs)
     
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+        self.requests_handled = 0
+    
+    def parse_request(self):
+        """Start tracking a request once its request line and headers are parsed"""
+        if not super().parse_request():
+            return False
+        self.connection.settimeout(REQUEST_TIMEOUT)
+        self.requests_handled += 1
+        # A body we never read would be parsed as the next request, so such
+        # responses close the connection (handlers clear this once they read it)
+        self.body_pending = (self.headers.get('Content-Length', '0').strip() not in ('', '0')
+                             or 'Transfer-Encoding' in self.headers)
+        self.request_route = route_name(urllib.parse.urlparse(self.path).path)
+        self.timer = PhaseTimer()
+        # Each path is resolved and statted at most once per request
+        self.fs = self.utils.fs = RequestStats(STAT_CACHE)
+        self.request_start = self.timer.start
+        self.request_bytes_start = self.wfile.bytes_written
+        self.request_write_start = self.wfile.write_seconds
+        self.response_status = None
+        metrics.IN_FLIGHT.inc(self.request_route)
+        self.profile_state = PROFILER.request_started(self.request_route)
+        return True
+    
+    def handle_expect_100(self):
+        """Hold back 100 Continue for uploads until their size has been checked"""
+        if self.command == 'POST' and urllib.parse.urlparse(self.path).path == '/upload':
+            self.continue_pending = True
+            return True
+        self.wfile.write(f"{self.protocol_version} 100 Continue\r\n\r\n".encode('latin-1'))
+        self.wfile.flush()
+        return True
+    
+    def send_continue(self):
+        """Ask a client waiting on Expect: 100-continue to send the body"""
+        if self.continue_pending:
+            self.continue_pending = False
+            self.wfile.write(f"{self.protocol_version} 100 Continue\r\n\r\n".encode('latin-1'))
+            self.wfile.flush()
+    
+    def handle_one_request(self):
+        self.response_status = None
+        self.headers_sent = False
+        self.stream_buffer = None
+        self.username = None
+        self.session_cookie = None
+        self.shaped = False
+        self.continue_pending = False
+        # Wait at most KEEPALIVE_TIMEOUT for the next request on an idle connection
+        self.connection.settimeout(KEEPALIVE_TIMEOUT)
+        try:
+            if not self.rfile.peek(1):
+                self.close_connection = True
+                return
+        except (TimeoutError, ConnectionError):
+            self.close_connection = True
+            return
+        try:
+            super().handle_one_request()
+        finally:
+            if self.request_route is not None:
+                self.finish_request()
+    
+    def finish_request(self):
+        """Record metrics and the slow log entry for the request that just finished"""
+        route = self.request_route
+        self.request_route = None
+        if self.admission_ticket is not None:
+            ADMISSION.release(self.admission_ticket)
+            self.admission_ticket = None
+        PROFILER.request_finished(self.profile_state, route, self.path)
+        self.profile_state = None
+        status = str(self.response_status or 0)
+        elapsed = time.perf_counter() - self.request_start
+        self.timer.add('write', self.wfile.write_seconds - self.request_write_start)
+        SLOW_LOG.record(elapsed * 1000, method=self.command, path=self.path, route=route,
+                        status=self.response_status, bytes_out=self.wfile.bytes_written - self.request_bytes_start,
+                        phases=self.timer.breakdown_ms())
+        metrics.IN_FLIGHT.dec(route)
+        metrics.LATENCY.observe(route, value=elapsed)
+        metrics.REQUESTS.inc(route, self.command, status)
+        if self.response_status and self.response_status >= 400:
+            metrics.ERRORS.inc(route, status)
+        metrics.BYTES_OUT.inc(route, amount=self.wfile.bytes_written - self.request_bytes_start)
+        if not self.shaped:
+            SHAPER.charge(self.wfile.bytes_written - self.request_bytes_start)
+        try:
+            body_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            body_length = 0
+        if body_length > 0:
+            metrics.BYTES_IN.inc(route, amount=body_length)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def end_headers(self):
+        if SERVER_TIMING_ENABLED:
+            self.send_header('Server-Timing', self.timer.server_timing_header())
+        if self.session_cookie is not None:
+            self.send_header('Set-Cookie', self.session_cookie)
+            self.session_cookie = None
+        if not self.close_connection:
+            if (self.body_pending or self.requests_handled >= KEEPALIVE_MAX_REQUESTS
+                    or (GRACEFUL_STOP is not None and GRACEFUL_STOP.requested.is_set())):
+                self.send_header('Connection', 'close')
+            else:
+                self.send_header('Keep-Alive', f"timeout={KEEPALIVE_TIMEOUT}, "
+                                               f"max={KEEPALIVE_MAX_REQUESTS - self.requests_handled}")
+        self.headers_sent = True
+        super().end_headers()
+    
+    def send_error(self, code, message=None, explain=None):
+        """Send an error page framed with Content-Length, keeping the connection open when safe"""
+        if self.headers_sent:
+            # Part of the response is already on the wire; all we can do is drop the connection
+            self.log_error("code %d after the response started, closing connection: %s", code, message)
+            self.close_connection = True
+            return
+        if self.response_status is not None:
+            self._headers_buffer = []   # discard a response that was being built
+        
+        try:
+            short_message, long_message = self.responses[code]
+        except KeyError:
+            short_message, long_message = '???', '???'
+        if message is None:
+            message = short_message
+        if explain is None:
+            explain = long_message
+        self.log_error("code %d, message %s", code, message)
+        self.send_response(code, message)
+        
+        body = b''
+        if code >= 200 and code not in (HTTPStatus.NO_CONTENT, HTTPStatus.RESET_CONTENT, HTTPStatus.NOT_MODIFIED):
+            content = self.error_message_format % {
+                'code': code,
+                'message': html.escape(message, quote=False),
+                'explain': html.escape(explain, quote=False),
+            }
+            body = content.encode('UTF-8', 'replace')
+            self.send_header('Content-Type', self.error_content_type)
+        if self.request_route is None:
+            # The request itself could not be parsed, so the stream is out of sync
+            self.send_header('Connection', 'close')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD' and body:
+            self.wfile.write(body)
+    
+    def send_html(self, html_content, status=200):
+        """Send an HTML page"""
+        body = html_content.encode('utf-8') if isinstance(html_content, str) else html_content
+        self.send_response(status)
+        self.send_header('Content-type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def start_stream(self):
+        """Frame a body of unknown length; call before end_headers, then write_stream/end_stream"""
+        self.stream_chunked = self.request_version >= 'HTTP/1.1'
+        if self.stream_chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Connection', 'close')
+        self.stream_buffer = bytearray()
+    
+    def write_stream(self, data):
+        """Buffer small writes and send them as STREAM_CHUNK_SIZE chunks"""
+        self.stream_buffer += data
+        if len(self.stream_buffer) >= STREAM_CHUNK_SIZE:
+            self._flush_stream()
+    
+    def _flush_stream(self):
+        if not self.stream_buffer:
+            return
+        if not self.stream_chunked:
+            self.wfile.write(self.stream_buffer)
+        else:
+            self.wfile.write(b'%x\r\n' % len(self.stream_buffer) + self.stream_buffer + b'\r\n')
+        self.stream_buffer = bytearray()
+    
+    def end_stream(self):
+        self._flush_stream()
+        if self.stream_chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        self.stream_buffer = None
+    
+    @contextmanager
+    def bulk_transfer(self, size=None):
+        """Shape the response body written inside this block if it is large (or of unknown size)"""
+        if not SHAPER.enabled or (size is not None and size < SHAPING_BULK_THRESHOLD):
+            yield
+            return
+        client = self.client_address[0]
+        raw = self.wfile
+        self.wfile = ShapedWriter(raw, SHAPER, client, self.timer)
+        self.shaped = True
+        SHAPER.start(client)
+        try:
+            yield
+        finally:
+            SHAPER.finish(client)
+            self.wfile = raw
+    
     def do_authhead(self):
+        body = b'Authentication required. <a href="/login">Sign in</a>'
         self.send_response(401)
         self.send_header('WWW-Authenticate', 'Basic realm="File Server"')
         self.send_header('Content-type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
+        self.wfile.write(body)
+    
+    def admit_request(self):
+        """Wait for an admission slot for this route; sends 503/429 and returns False if turned away"""
+        try:
+            with self.timer.phase('queue'):
+                self.admission_ticket, _ = ADMISSION.admit(self.request_route, self.client_address[0])
+        except Rejected as rejected:
+            self.send_rejection(rejected)
+            return False
+        return True
+    
+    def send_rejection(self, rejected):
+        """Turn a request away cheaply, telling the client when to try again"""
+        if rejected.status == 429:
+            body = f"Too many concurrent requests from this client; retry in {rejected.retry_after}s\n"
+        else:
+            body = f"Server busy ({rejected.reason}); retry in {rejected.retry_after}s\n"
+        body = body.encode('utf-8')
+        self.log_message('"%s" rejected: %s', self.requestline, rejected.reason)
+        self.send_response(rejected.status)
+        self.send_header('Retry-After', str(rejected.retry_after))
+        self.send_header('Content-type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     
     def check_auth(self):
+        """Accept a valid session cookie, else Basic credentials (which start a session)"""
+        if SESSIONS is not None:
+            self.username = SESSIONS.verify(cookie_value(self.headers.get('Cookie'), SESSION_COOKIE))
+            if self.username is not None:
+                return True
+        
         if 'Authorization' not in self.headers:
             return False
         
@@ -45,40 +382,92 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
         try:
             credentials = base64.b64decode(auth_header[6:]).decode('utf-8')
             username, password = credentials.split(':', 1)
-            return username == USERNAME and password == PASSWORD
         except:
             return False
+        
+        if SESSIONS is None:
+            return username == USERNAME and password == PASSWORD
+        token = SESSIONS.login(username, password)
+        if token is None:
+            return False
+        # Browsers keep sending Basic credentials, but the cookie is checked first
+        self.session_cookie = SESSIONS.cookie_header(token)
+        self.username = username
+        return True
     
     def do_GET(self):
-        if not self.check_auth():
+        parsed_path = urllib.parse.urlparse(self.path)
+        if parsed_path.path == '/login':
+            self.send_login_page(urllib.parse.parse_qs(parsed_path.query).get('next', ['/'])[0])
+            return
+        if parsed_path.path == '/logout':
+            self.handle_logout()
+            return
+        
+        with self.timer.phase('auth'):
+            authorized = self.check_auth()
+        if not authorized:
             self.do_authhead()
-            self.wfile.write(b'Authentication required')
+            return
+        if not self.admit_request():
             return
         
-        parsed_path = urllib.parse.urlparse(self.path)
         path = urllib.parse.unquote(parsed_path.path)
         
         # Route requests
         if path == '/' or path == '':
             self.send_main_page()
         elif path == '/upload':
-            self.send_upload_page()
+            self.send_upload_page(urllib.parse.parse_qs(parsed_path.query))
+        elif path == '/search':
+            self.search_files(urllib.parse.parse_qs(parsed_path.query))
+        elif path == '/metrics':
+            self.send_metrics()
+        elif path == '/changes':
+            self.send_changes(urllib.parse.parse_qs(parsed_path.query))
+        elif path == '/batch':
+            self.send_batch(urllib.parse.parse_qs(parsed_path.query))
+        elif path.startswith('/debug/profile'):
+            self.send_profile(path.replace('/debug/profile', '', 1))
         elif path.startswith('/browse'):
             browse_path = path.replace('/browse', '', 1)
             if browse_path == '' or browse_path == '/':
                 browse_path = BROWSE_ROOT
             else:
                 browse_path = os.path.join(BROWSE_ROOT, browse_path.lstrip('/'))
-            self.browse_directory(browse_path)
+            query_params = urllib.parse.parse_qs(parsed_path.query)
+            output_format = query_params.get('format', ['html'])[0]
+            member = query_params.get('member', [None])[0]
+            if member is not None or (archive_kind(browse_path) and self.fs.stat(browse_path).is_file):
+                self.browse_archive(browse_path, member or '', output_format)
+            else:
+                self.browse_directory(browse_path, output_format)
         elif path.startswith('/view'):
             file_path = path.replace('/view', '', 1)
-            self.view_file(os.path.join(BROWSE_ROOT, file_path.lstrip('/')))
+            member = urllib.parse.parse_qs(parsed_path.query).get('member', [None])[0]
+            if member is not None:
+                self.view_archive_member(os.path.join(BROWSE_ROOT, file_path.lstrip('/')), member)
+            else:
+                self.view_file(os.path.join(BROWSE_ROOT, file_path.lstrip('/')))
+        elif path.startswith('/checksum'):
+            file_path = path.replace('/checksum', '', 1)
+            self.send_checksum(os.path.join(BROWSE_ROOT, file_path.lstrip('/')),
+                               urllib.parse.parse_qs(parsed_path.query))
+        elif path.startswith('/signature'):
+            file_path = path.replace('/signature', '', 1)
+            self.send_signature(os.path.join(BROWSE_ROOT, file_path.lstrip('/')),
+                                urllib.parse.parse_qs(parsed_path.query))
         elif path.startswith('/download'):
             file_path = path.replace('/download', '', 1)
-            self.download_file(os.path.join(BROWSE_ROOT, file_path.lstrip('/')))
+            member = urllib.parse.parse_qs(parsed_path.query).get('member', [None])[0]
+            if member is not None:
+                self.download_archive_member(os.path.join(BROWSE_ROOT, file_path.lstrip('/')), member)
+            else:
+                self.download_file(os.path.join(BROWSE_ROOT, file_path.lstrip('/')))
         elif path.startswith('/zip'):
             folder_path = path.replace('/zip', '', 1)
-            self.download_folder_as_zip(os.path.join(BROWSE_ROOT, folder_path.lstrip('/')))
+            self.download_folder_as_zip(os.path.join(BROWSE_ROOT, folder_path.lstrip('/')),
+                                        urllib.parse.parse_qs(parsed_path.query))
         elif path.startswith('/uploads'):
             file_path = path.replace('/uploads', '', 1)
             self.serve_uploaded_file(os.path.join(UPLOAD_DIR, file_path.lstrip('/')))
@@ -86,48 +475,131 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
             self.send_error(404)
     
     def do_POST(self):
-        if not self.check_auth():
+        parsed_path = urllib.parse.urlparse(self.path)
+        if parsed_path.path == '/login':
+            self.handle_login()
+            return
+        if parsed_path.path == '/logout':
+            self.handle_logout()
+            return
+        
+        with self.timer.phase('auth'):
+            authorized = self.check_auth()
+        if not authorized:
             self.do_authhead()
-            self.wfile.write(b'Authentication required')
+            return
+        if not self.admit_request():
             return
         
-        if self.path == '/upload':
+        path = urllib.parse.unquote(parsed_path.path)
+        
+        if path == '/upload':
             self.handle_upload()
+        elif path == '/batch':
+            self.handle_batch_form()
+        elif path.startswith('/debug/profile'):
+            self.start_profile(path.replace('/debug/profile', '', 1),
+                               urllib.parse.parse_qs(parsed_path.query))
+        elif path.startswith('/delta'):
+            file_path = path.replace('/delta', '', 1)
+            self.send_delta(os.path.join(BROWSE_ROOT, file_path.lstrip('/')))
         else:
             self.send_error(404)
     
+    def send_login_page(self, next_url='/', error=None, status=200):
+        """Send the login form"""
+        if not next_url.startswith('/') or next_url.startswith('//'):
+            next_url = '/'
+        context = {
+            'next': html.escape(next_url, quote=True),
+            'error': html.escape(error) if error else '',
+        }
+        self.send_html(self.template_renderer.render_login_page(context), status)
+    
+    def handle_login(self):
+        """Check the login form and start a session"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > LOGIN_MAX_BODY:
+                self.send_error(413, "Login form too large")
+                return
+            form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8', 'replace'))
+            self.body_pending = False
+            
+            username = form.get('username', [''])[0]
+            password = form.get('password', [''])[0]
+            next_url = form.get('next', ['/'])[0]
+            if not next_url.startswith('/') or next_url.startswith('//'):
+                next_url = '/'
+            
+            if SESSIONS is None:
+                self.send_error(503, "Sessions are not available")
+                return
+            
+            with self.timer.phase('auth'):
+                token = SESSIONS.login(username, password)
+            if token is None:
+                self.send_login_page(next_url, "Invalid username or password", status=401)
+                return
+            
+            self.session_cookie = SESSIONS.cookie_header(token)
+            self.send_response(303)
+            self.send_header('Location', next_url)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            
+        except ValueError:
+            self.send_error(400, "Invalid login form")
+        except Exception as e:
+            self.send_error(500, f"Login failed: {str(e)}")
+    
+    def handle_logout(self):
+        """End the session and return to the login form"""
+        if SESSIONS is not None:
+            SESSIONS.revoke(cookie_value(self.headers.get('Cookie'), SESSION_COOKIE))
+            self.session_cookie = SESSIONS.clear_cookie_header()
+        self.send_response(303)
+        self.send_header('Location', '/login')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+    
     def send_main_page(self):
         """Send main dashboard page"""
         try:
-            uploaded_files = os.listdir(UPLOAD_DIR) if os.path.exists(UPLOAD_DIR) else []
-            uploaded_count = len([f for f in uploaded_files if os.path.isfile(os.path.join(UPLOAD_DIR, f))])
+            if UPLOADS is not None:
+                uploaded_count = UPLOADS.count
+            else:
+                # The catalog is still loading
+                uploaded_files = os.listdir(UPLOAD_DIR) if os.path.exists(UPLOAD_DIR) else []
+                uploaded_count = len([f for f in uploaded_files if os.path.isfile(os.path.join(UPLOAD_DIR, f))])
             
             context = {
                 'uploaded_count': uploaded_count,
                 'browse_root': BROWSE_ROOT,
-                'server_address': f"{SERVER_IP}:{PORT}",
+                'server_address': f"{get_server_ip()}:{PORT}",
                 'upload_dir': os.path.abspath(UPLOAD_DIR),
             }
             
             html_content = self.template_renderer.render_dashboard(context)
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_html(html_content)
             
         except Exception as e:
             self.send_error(500, f"Error loading dashboard: {str(e)}")
     
-    def browse_directory(self, dir_path):
+    def browse_directory(self, dir_path, output_format='html'):
         """Browse and display directory contents"""
         try:
             # Security check
-            if not self.utils.is_safe_path(dir_path, BROWSE_ROOT):
+            with self.timer.phase('resolve'):
+                is_safe = self.utils.is_safe_path(dir_path, BROWSE_ROOT)
+            if not is_safe:
                 self.send_error(403, "Access denied - path outside allowed directory")
                 return
             
-            if not os.path.exists(dir_path) or not os.path.isdir(dir_path):
+            with self.timer.phase('stat'):
+                is_dir = self.fs.stat(dir_path).is_dir
+            if not is_dir:
                 self.send_error(404, "Directory not found")
                 return
             
@@ -138,7 +610,8 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
             
             # Get directory contents
             try:
-                items = sorted(os.listdir(dir_path))
+                with self.timer.phase('listdir'):
+                    items = sorted(self.utils.list_dir(dir_path, BROWSE_ROOT))
             except PermissionError:
                 self.send_error(403, "Permission denied")
                 return
@@ -147,22 +620,61 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
             directories = []
             files = []
             
+            # Per-entry stat calls and text sniffing are timed separately
+            loop_start = time.perf_counter()
+            sniff_seconds = 0.0
             for item in items:
                 item_path = os.path.join(dir_path, item)
+                item_rel_path = f"{rel_path}/{item}" if rel_path else item
                 try:
-                    if os.path.isdir(item_path):
-                        directories.append(item)
-                    elif os.path.isfile(item_path):
+                    info = self.fs.stat(item_path)
+                    if info.is_dir:
+                        # Totals come from the background accounting, never computed inline
+                        totals = DIR_SIZES.get(item_rel_path) if DIR_SIZES is not None else None
+                        directories.append({
+                            'name': item,
+                            'path': item_rel_path,
+                            'total_size': totals[0] if totals else None,
+                            'file_count': totals[1] if totals else None,
+                        })
+                    elif info.is_file:
+                        file_size = info.size
+                        sniff_start = time.perf_counter()
+                        can_view = self.utils.is_text_file(item_path, BROWSE_ROOT)
+                        sniff_seconds += time.perf_counter() - sniff_start
                         file_info = {
                             'name': item,
-                            'size': self.utils.format_file_size(os.path.getsize(item_path)),
+                            'size': self.utils.format_file_size(file_size),
+                            'size_bytes': file_size,
                             'icon': self.utils.get_file_icon(os.path.splitext(item)[1].lower()),
-                            'can_view': self.utils.is_text_file(item_path),
-                            'path': f"{rel_path}/{item}" if rel_path else item
+                            'can_view': can_view,
+                            'can_browse': archive_kind(item) is not None,
+                            'path': item_rel_path
                         }
                         files.append(file_info)
                 except (OSError, PermissionError):
                     continue
+            self.timer.add('stat', time.perf_counter() - loop_start - sniff_seconds)
+            self.timer.add('sniff', sniff_seconds)
+            
+            if output_format == 'json':
+                self.send_json({
+                    'path': rel_path,
+                    'directories': directories,
+                    'files': [
+                        {'name': f['name'], 'path': f['path'], 'size': f['size_bytes'], 'can_view': f['can_view'],
+                         'is_archive': f['can_browse']}
+                        for f in files
+                    ],
+                })
+                return
+            
+            for directory in directories:
+                if directory['total_size'] is None:
+                    directory['details'] = "Folder · calculating size…"
+                else:
+                    directory['details'] = (f"Folder · {self.utils.format_file_size(directory['total_size'])}"
+                                            f" · {directory['file_count']:,} files")
             
             context = {
                 'rel_path': rel_path,
@@ -172,125 +684,711 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
                 'has_parent': bool(rel_path)
             }
             
-            html_content = self.template_renderer.render_browser(context)
+            with self.timer.phase('render'):
+                html_content = self.template_renderer.render_browser(context).encode('utf-8')
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_html(html_content)
             
         except Exception as e:
             self.send_error(500, f"Error browsing directory: {str(e)}")
     
+    def open_archive(self, archive_path):
+        """Checked, cached index of an archive, or None after sending an error; release() it when done"""
+        with self.timer.phase('resolve'):
+            is_safe = self.utils.is_safe_path(archive_path, BROWSE_ROOT)
+        if not is_safe:
+            self.send_error(403, "Access denied")
+            return None
+        with self.timer.phase('stat'):
+            is_file = self.fs.stat(archive_path).is_file
+        if not is_file:
+            self.send_error(404, "Archive not found")
+            return None
+        try:
+            with self.timer.phase('index'):
+                return ARCHIVE_INDEXES.get(archive_path, BROWSE_ROOT)
+        except PermissionError:
+            self.send_error(403, "Access denied")
+            return None
+        except ArchiveError as e:
+            self.send_error(415, str(e))
+            return None
+    
+    def browse_archive(self, archive_path, folder, output_format='html'):
+        """List a folder inside a ZIP or tar archive like a directory"""
+        index = None
+        try:
+            index = self.open_archive(archive_path)
+            if index is None:
+                return
+            
+            listing = index.listing(folder)
+            if listing is None:
+                self.send_error(404, "Folder not found in archive")
+                return
+            folder = folder.strip('/')
+            folders, members = listing
+            rel_path = os.path.relpath(archive_path, BROWSE_ROOT)
+            
+            if output_format == 'json':
+                self.send_json({
+                    'path': rel_path,
+                    'member': folder,
+                    'directories': [{'name': os.path.basename(m.name), 'member': m.name} for m in folders],
+                    'files': [
+                        {'name': os.path.basename(m.name), 'member': m.name, 'size': m.size,
+                         'mtime': m.mtime, 'mode': m.mode, 'link': m.link}
+                        for m in members
+                    ],
+                })
+                return
+            
+            archive_url = urllib.parse.quote(rel_path)
+            def member_url(route, name):
+                return f"/{route}/{archive_url}?member={urllib.parse.quote(name, safe='/')}"
+            
+            directories = [{
+                'name': html.escape(os.path.basename(m.name)),
+                'path': html.escape(m.name),
+                'details': "Folder in archive",
+                'url': member_url('browse', m.name + '/'),
+            } for m in folders]
+            files = []
+            for m in members:
+                name = os.path.basename(m.name)
+                ext = os.path.splitext(name)[1].lower()
+                files.append({
+                    'name': html.escape(name),
+                    'path': html.escape(m.name),
+                    'size': f"→ {html.escape(m.link)}" if m.link is not None else self.utils.format_file_size(m.size),
+                    'icon': '🔗' if m.link is not None else self.utils.get_file_icon(ext),
+                    'can_view': m.is_file and m.size <= MAX_VIEW_FILE_SIZE,
+                    'can_download': m.is_file,
+                    'view_url': member_url('view', m.name),
+                    'download_url': member_url('download', m.name),
+                })
+            
+            parent_folder = folder.rpartition('/')[0]
+            context = {
+                'rel_path': f"{rel_path}/{folder}" if folder else rel_path,
+                'breadcrumbs': self.utils.generate_archive_breadcrumbs(rel_path, folder),
+                'directories': directories,
+                'files': files,
+                'has_parent': True,
+                'parent_url': member_url('browse', parent_folder + '/') if folder
+                              else f"/browse/{urllib.parse.quote(os.path.dirname(rel_path))}",
+                'in_archive': True,
+            }
+            
+            with self.timer.phase('render'):
+                html_content = self.template_renderer.render_browser(context).encode('utf-8')
+            
+            self.send_html(html_content)
+            
+        except Exception as e:
+            self.send_error(500, f"Error browsing archive: {str(e)}")
+        finally:
+            if index is not None:
+                index.release()
+    
+    def view_archive_member(self, archive_path, name):
+        """Display one text member of an archive"""
+        index = None
+        try:
+            index = self.open_archive(archive_path)
+            if index is None:
+                return
+            member = index.member(name)
+            if member is None or not member.is_file:
+                self.send_error(404, "File not found in archive")
+                return
+            rel_path = os.path.relpath(archive_path, BROWSE_ROOT)
+            download_url = f"/download/{urllib.parse.quote(rel_path)}?member={urllib.parse.quote(member.name, safe='/')}"
+            
+            with self.timer.phase('read'):
+                data = None
+                if member.size <= MAX_VIEW_FILE_SIZE:
+                    with index.open(member) as f:
+                        data = f.read()
+            content = self.utils.decode_text(data, member.name) if data is not None else None
+            if content is None:
+                # Binary or too large: download instead
+                self.send_response(302)
+                self.send_header('Location', download_url)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            
+            with self.timer.phase('escape'):
+                escaped_content = html.escape(content)
+            
+            folder = member.name.rpartition('/')[0]
+            context = {
+                'filename': html.escape(os.path.basename(member.name)),
+                'file_size': self.utils.format_file_size(member.size),
+                'language': self.utils.get_language_for_syntax_highlighting(member.name),
+                'content': escaped_content,
+                'rel_path': rel_path,
+                'parent_dir': os.path.dirname(rel_path),
+                'breadcrumbs': self.utils.generate_archive_breadcrumbs(rel_path, folder, os.path.basename(member.name)),
+                'download_url': download_url,
+                'back_url': f"/browse/{urllib.parse.quote(rel_path)}?member={urllib.parse.quote(folder + '/', safe='/')}",
+            }
+            
+            with self.timer.phase('render'):
+                html_content = self.template_renderer.render_file_viewer(context).encode('utf-8')
+            
+            self.send_html(html_content)
+            
+        except Exception as e:
+            self.send_error(500, f"Error viewing archive member: {str(e)}")
+        finally:
+            if index is not None:
+                index.release()
+    
+    def download_archive_member(self, archive_path, name):
+        """Stream one member of an archive, reading only its bytes"""
+        index = None
+        try:
+            index = self.open_archive(archive_path)
+            if index is None:
+                return
+            member = index.member(name)
+            if member is None or not member.is_file:
+                self.send_error(404, "File not found in archive")
+                return
+            
+            filename = os.path.basename(member.name)
+            content_type, _ = mimetypes.guess_type(filename)
+            
+            with index.open(member) as f:
+                self.send_response(200)
+                self.send_header('Content-Type', content_type or 'application/octet-stream')
+                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+                self.send_header('Content-Length', str(member.size))
+                self.end_headers()
+                
+                with self.bulk_transfer(member.size):
+                    while True:
+                        chunk = f.read(65536)
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+            
+        except Exception as e:
+            self.send_error(500, f"Error downloading archive member: {str(e)}")
+        finally:
+            if index is not None:
+                index.release()
+    
+    def search_files(self, query_params):
+        """Search the path index and return matches as HTML or JSON"""
+        try:
+            query = query_params.get('q', [''])[0].strip()
+            scope = query_params.get('dir', [''])[0].strip('/')
+            output_format = query_params.get('format', ['html'])[0]
+
+            results, truncated = [], False
+            start = time.perf_counter()
+            if query and PATH_INDEX is not None:
+                results, truncated = PATH_INDEX.search(query, scope)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            index_ready = PATH_INDEX is not None and PATH_INDEX.ready
+
+            if output_format == 'json':
+                payload = {
+                    'query': query,
+                    'dir': scope,
+                    'results': [{'path': rel_path, 'is_dir': is_dir} for rel_path, is_dir in results],
+                    'truncated': truncated,
+                    'index_ready': index_ready,
+                    'elapsed_ms': round(elapsed_ms, 3),
+                }
+                self.send_json(payload)
+                return
+
+            matches = []
+            for rel_path, is_dir in results:
+                parent_dir = os.path.dirname(rel_path)
+                ext = os.path.splitext(rel_path)[1].lower()
+                matches.append({
+                    'name': html.escape(os.path.basename(rel_path)),
+                    'path': html.escape(rel_path),
+                    'url': urllib.parse.quote(rel_path),
+                    'parent_url': urllib.parse.quote(parent_dir),
+                    'is_dir': is_dir,
+                    'icon': '📁' if is_dir else self.utils.get_file_icon(ext),
+                    'can_view': not is_dir and ext in TEXT_EXTENSIONS,
+                })
+
+            context = {
+                'query': html.escape(query, quote=True),
+                'scope': html.escape(scope, quote=True),
+                'matches': matches,
+                'truncated': truncated,
+                'index_ready': index_ready,
+                'elapsed_ms': f"{elapsed_ms:.1f}",
+            }
+
+            html_content = self.template_renderer.render_search_results(context)
+
+            self.send_html(html_content)
+
+        except Exception as e:
+            self.send_error(500, f"Error searching files: {str(e)}")
+
+    def send_changes(self, query_params):
+        """Send journal entries since a cursor, or the full snapshot without one"""
+        try:
+            if CHANGE_JOURNAL is None:
+                self.send_error(503, "Change journal is not available")
+                return
+
+            cursor = query_params.get('since', [None])[0]
+            if cursor is None:
+                self.send_json(CHANGE_JOURNAL.snapshot_listing())
+                return
+
+            limit = min(int(query_params.get('limit', [CHANGE_FEED_PAGE_SIZE])[0]), CHANGE_FEED_PAGE_SIZE)
+            self.send_json(CHANGE_JOURNAL.changes_since(cursor, max(limit, 1)))
+
+        except ValueError:
+            self.send_error(400, "Invalid limit")
+        except Exception as e:
+            self.send_error(500, f"Error reading changes: {str(e)}")
+
+    def send_metrics(self):
+        """Send all metrics in the Prometheus text format"""
+        text = METRICS_EXPORTER.aggregate() if METRICS_EXPORTER is not None else METRICS.render()
+        body = text.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_profile(self, subpath):
+        """Send the profiling status, or download one of the result files"""
+        try:
+            if not PROFILING_ENABLED:
+                self.send_error(404)
+                return
+            
+            if subpath in ('', '/'):
+                self.send_json(PROFILER.status())
+                return
+            
+            if not subpath.startswith('/files/'):
+                self.send_error(404)
+                return
+            
+            file_path = PROFILER.file_path(subpath[len('/files/'):])
+            if file_path is None:
+                self.send_error(404, "Profile not found")
+                return
+            
+            with open(file_path, 'rb') as f:
+                body = f.read()
+            content_type = 'text/plain; charset=utf-8' if file_path.endswith(('.txt', '.folded')) else \
+                'application/json' if file_path.endswith('.json') else 'application/octet-stream'
+            
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(file_path)}"')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            self.send_error(500, f"Error reading profile: {str(e)}")
+
+    def start_profile(self, subpath, query_params):
+        """Start (or stop) a profiling session"""
+        try:
+            if not PROFILING_ENABLED:
+                self.send_error(404)
+                return
+            
+            route = query_params.get('route', [None])[0] or None
+            if route is not None and route not in metrics.ROUTES.values():
+                raise ValueError(f"Unknown route, use one of: {', '.join(sorted(set(metrics.ROUTES.values())))}")
+            if subpath == '/cprofile':
+                requests = int(query_params.get('requests', ['10'])[0])
+                if not 1 <= requests <= PROFILE_MAX_REQUESTS:
+                    raise ValueError(f"requests must be between 1 and {PROFILE_MAX_REQUESTS}")
+                session = PROFILER.start_cprofile(requests, route)
+            elif subpath == '/tracemalloc':
+                requests = int(query_params.get('requests', ['10'])[0])
+                if not 1 <= requests <= PROFILE_MAX_REQUESTS:
+                    raise ValueError(f"requests must be between 1 and {PROFILE_MAX_REQUESTS}")
+                session = PROFILER.start_tracemalloc(requests, route)
+            elif subpath == '/sample':
+                seconds = float(query_params.get('seconds', ['10'])[0])
+                interval = float(query_params.get('interval_ms', [PROFILE_SAMPLE_INTERVAL * 1000])[0]) / 1000
+                if not 0 < seconds <= PROFILE_MAX_SECONDS or interval <= 0:
+                    raise ValueError(f"seconds must be between 0 and {PROFILE_MAX_SECONDS}")
+                session = PROFILER.start_sampler(seconds, interval)
+            elif subpath == '/stop':
+                PROFILER.stop_all()
+                self.send_json(PROFILER.status())
+                return
+            else:
+                self.send_error(404)
+                return
+            
+            self.send_json(session.status(), status=202)
+            
+        except ValueError as e:
+            self.send_error(400, str(e))
+        except Exception as e:
+            self.send_error(500, f"Error starting profile: {str(e)}")
+
+    def send_json(self, payload, status=200):
+        """Send a JSON response"""
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def view_file(self, file_path):
         """Display file content in browser with syntax highlighting"""
         try:
             # Security check
-            if not self.utils.is_safe_path(file_path, BROWSE_ROOT):
+            with self.timer.phase('resolve'):
+                is_safe = self.utils.is_safe_path(file_path, BROWSE_ROOT)
+            if not is_safe:
                 self.send_error(403, "Access denied")
                 return
             
-            if not os.path.exists(file_path) or not os.path.isfile(file_path):
-                self.send_error(404, "File not found")
-                return
+            with self.timer.phase('cache'):
+                cached = HOT_CACHE.get(file_path)
+            if cached is None:
+                with self.timer.phase('stat'):
+                    info = self.fs.stat(file_path)
+                if not info.is_file:
+                    self.send_error(404, "File not found")
+                    return
+                if HOT_CACHE.cacheable(info.size):
+                    with self.timer.phase('read'), self.utils.open_file(file_path, BROWSE_ROOT) as f:
+                        cached = HOT_CACHE.put(file_path, f.read(), info.st)
             
-            if not self.utils.is_text_file(file_path):
+            if cached is not None:
+                # Small files are decoded once and viewed from memory
+                if cached.text is None:
+                    with self.timer.phase('sniff'):
+                        text = self.utils.decode_text(cached.body, file_path)
+                        cached.text = False if text is None else text
+                can_view = cached.text is not False
+            else:
+                with self.timer.phase('sniff'):
+                    can_view = self.utils.is_text_file(file_path, BROWSE_ROOT)
+            if not can_view:
                 # Redirect to download for binary files
                 rel_path = os.path.relpath(file_path, BROWSE_ROOT)
                 download_url = f"/download/{rel_path}"
                 self.send_response(302)
                 self.send_header('Location', download_url)
+                self.send_header('Content-Length', '0')
                 self.end_headers()
                 return
             
             # Read file content
-            content = self.utils.read_file_content(file_path)
+            if cached is not None:
+                content = cached.text
+            else:
+                with self.timer.phase('read'):
+                    content = self.utils.read_file_content(file_path, BROWSE_ROOT)
             if content is None:
                 self.send_error(500, "Could not read file with any encoding")
                 return
             
             # Get file info
             filename = os.path.basename(file_path)
-            file_size = self.utils.format_file_size(os.path.getsize(file_path))
+            file_size = self.utils.format_file_size(len(cached.body) if cached is not None
+                                                    else self.fs.stat(file_path).size)
             rel_path = os.path.relpath(file_path, BROWSE_ROOT)
             parent_dir = os.path.dirname(rel_path) if os.path.dirname(rel_path) != '.' else ''
             language = self.utils.get_language_for_syntax_highlighting(file_path)
             
+            with self.timer.phase('escape'):
+                escaped_content = html.escape(content)
+            
             context = {
                 'filename': filename,
                 'file_size': file_size,
                 'language': language,
-                'content': html.escape(content),
+                'content': escaped_content,
                 'rel_path': rel_path,
                 'parent_dir': parent_dir,
                 'breadcrumbs': self.utils.generate_file_breadcrumbs(rel_path)
             }
             
-            html_content = self.template_renderer.render_file_viewer(context)
+            with self.timer.phase('render'):
+                html_content = self.template_renderer.render_file_viewer(context).encode('utf-8')
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_html(html_content)
             
+        except PermissionError:
+            self.send_error(403, "Access denied")
         except Exception as e:
             self.send_error(500, f"Error viewing file: {str(e)}")
     
     def download_file(self, file_path):
         """Download a single file"""
         try:
-            if not self.utils.is_safe_path(file_path, BROWSE_ROOT):
+            with self.timer.phase('resolve'):
+                is_safe = self.utils.is_safe_path(file_path, BROWSE_ROOT)
+            if not is_safe:
                 self.send_error(403, "Access denied")
                 return
             
-            if not os.path.exists(file_path) or not os.path.isfile(file_path):
+            with self.timer.phase('cache'):
+                cached = HOT_CACHE.get(file_path)
+            if cached is not None:
+                self.send_cached_file(cached)
+                return
+            
+            with self.timer.phase('stat'):
+                info = self.fs.stat(file_path)
+            if not info.is_file:
                 self.send_error(404, "File not found")
                 return
             
+            if HOT_CACHE.cacheable(info.size):
+                with self.timer.phase('read'), self.utils.open_file(file_path, BROWSE_ROOT) as f:
+                    body = f.read()
+                self.send_cached_file(HOT_CACHE.put(file_path, body, info.st))
+                return
+            
             # Determine content type
             content_type, _ = mimetypes.guess_type(file_path)
             if content_type is None:
                 content_type = 'application/octet-stream'
             
             filename = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
+            file_size = info.size
+            
+            # Opened before the headers go out, so a file that moved out of the root is still a 403
+            with self.utils.open_file(file_path, BROWSE_ROOT) as f:
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+                self.send_header('Content-Length', str(file_size))
+                self.send_digest_headers(file_path, info.st, BROWSE_ROOT)
+                self.end_headers()
+                
+                with self.bulk_transfer(file_size):
+                    while True:
+                        chunk = f.read(8192)
+                        if not chunk:
+                            break
+                        self.wfile.write(chunk)
+                    
+        except PermissionError:
+            self.send_error(403, "Access denied")
+        except Exception as e:
+            self.send_error(500, f"Error downloading file: {str(e)}")
+    
+    def send_cached_file(self, entry):
+        """Send a download from the hot cache, gzip-encoded when the client accepts it"""
+        use_gzip = entry.gzip_body is not None and self.accepts_gzip()
+        body = entry.gzip_body if use_gzip else entry.body
+        self.send_response(200)
+        for name, value in entry.headers:
+            self.send_header(name, value)
+        if entry.gzip_body is not None:
+            self.send_header('Vary', 'Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        else:
+            # The digests describe the uncompressed file
+            self.send_digest_headers(entry.path, entry.stat, BROWSE_ROOT)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        with self.bulk_transfer(len(body)):
+            self.wfile.write(body)
+    
+    def accepts_gzip(self):
+        """Whether the request's Accept-Encoding allows gzip"""
+        for coding in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = coding.strip().partition(';')
+            if name.strip().lower() in ('gzip', 'x-gzip'):
+                return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+        return False
+    
+    def send_digest_headers(self, file_path, st=None, root=None):
+        """Add Digest headers when the file's checksum is cached, else start hashing it (opened through root)"""
+        if CHECKSUMS is None:
+            return
+        with self.timer.phase('digest'):
+            hexdigest = CHECKSUMS.cached(file_path, st=st)
+            if hexdigest is None:
+                try:
+                    CHECKSUMS.submit(file_path, root=root)
+                except Exception as e:
+                    self.log_message("Could not queue checksum for %s: %s", file_path, e)
+                return
+        value = digest_header_value('sha256', hexdigest)
+        self.send_header('Digest', value)
+        name, _, encoded = value.partition('=')
+        self.send_header('Repr-Digest', f"{name}=:{encoded}:")
+    
+    def send_checksum(self, file_path, query_params):
+        """Send the checksum of a file as JSON"""
+        try:
+            if not self.utils.is_safe_path(file_path, BROWSE_ROOT):
+                self.send_error(403, "Access denied")
+                return
+            
+            if not self.fs.stat(file_path).is_file:
+                self.send_error(404, "File not found")
+                return
+            
+            if CHECKSUMS is None:
+                self.send_error(503, "Checksum service is not available")
+                return
+            
+            algorithm = query_params.get('algorithm', ['sha256'])[0].lower()
+            if algorithm not in SUPPORTED_ALGORITHMS:
+                self.send_error(400, f"Unsupported algorithm, use one of: {', '.join(SUPPORTED_ALGORITHMS)}")
+                return
+            
+            payload = {
+                'path': os.path.relpath(file_path, BROWSE_ROOT),
+                'size': self.fs.stat(file_path).size,
+                'algorithm': algorithm,
+            }
+            
+            hexdigest = CHECKSUMS.cached(file_path, algorithm)
+            if hexdigest is None:
+                future = CHECKSUMS.submit(file_path, algorithm, BROWSE_ROOT)
+                if query_params.get('wait', ['1'])[0] == '0':
+                    # Let the client poll instead of holding the connection
+                    payload['status'] = 'pending'
+                    self.send_json(payload, status=202)
+                    return
+                hexdigest = future.result()
+            
+            payload['status'] = 'ready'
+            payload['digest'] = hexdigest
+            payload['digest_header'] = digest_header_value(algorithm, hexdigest)
+            self.send_json(payload)
+            
+        except PermissionError:
+            self.send_error(403, "Access denied")
+        except Exception as e:
+            self.send_error(500, f"Error computing checksum: {str(e)}")
+    
+    def send_signature(self, file_path, query_params):
+        """Send the server's block signature of a file"""
+        try:
+            if not self.utils.is_safe_path(file_path, BROWSE_ROOT):
+                self.send_error(403, "Access denied")
+                return
+            
+            if not self.fs.stat(file_path).is_file:
+                self.send_error(404, "File not found")
+                return
+            
+            block_size = int(query_params.get('block_size', ['0'])[0]) or None
+            if block_size is not None and not DELTA_MIN_BLOCK_SIZE <= block_size <= DELTA_MAX_BLOCK_SIZE:
+                self.send_error(400, f"block_size must be between {DELTA_MIN_BLOCK_SIZE} and {DELTA_MAX_BLOCK_SIZE}")
+                return
+            
+            body = encode_signature(*SIGNATURES.get(file_path, block_size, BROWSE_ROOT))
             
             self.send_response(200)
-            self.send_header('Content-Type', content_type)
-            self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
-            self.send_header('Content-Length', str(file_size))
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
+            self.wfile.write(body)
             
-            with open(file_path, 'rb') as f:
-                while True:
-                    chunk = f.read(8192)
-                    if not chunk:
-                        break
-                    self.wfile.write(chunk)
-                    
+        except ValueError:
+            self.send_error(400, "Invalid block_size")
+        except PermissionError:
+            self.send_error(403, "Access denied")
         except Exception as e:
-            self.send_error(500, f"Error downloading file: {str(e)}")
+            self.send_error(500, f"Error computing signature: {str(e)}")
     
-    def download_folder_as_zip(self, folder_path):
-        """Download folder as ZIP archive"""
+    def send_delta(self, file_path):
+        """Stream the delta between the client's old copy (given as a signature) and a file"""
         try:
+            if not self.utils.is_safe_path(file_path, BROWSE_ROOT):
+                self.send_error(403, "Access denied")
+                return
+            
+            if not self.fs.stat(file_path).is_file:
+                self.send_error(404, "File not found")
+                return
+            
+            length = int(self.headers.get('Content-Length', 0))
+            if length <= 0 or length > DELTA_MAX_SIGNATURE_SIZE:
+                self.send_error(413 if length > 0 else 411, "Signature body missing or too large")
+                return
+            
+            body = self.rfile.read(length)
+            self.body_pending = False
+            try:
+                client_signature = decode_signature(body)
+            except ValueError as e:
+                self.send_error(400, f"Invalid signature: {str(e)}")
+                return
+            
+            server_signature = SIGNATURES.get(file_path, client_signature[0], BROWSE_ROOT)
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(file_path)}.delta"')
+            self.start_stream()
+            self.end_headers()
+            
+            with self.bulk_transfer():
+                generate_delta(file_path, client_signature, self.write_stream, server_signature, BROWSE_ROOT)
+                self.end_stream()
+            
+        except PermissionError:
+            self.send_error(403, "Access denied")
+        except Exception as e:
+            self.send_error(500, f"Error creating delta: {str(e)}")
+    
+    def download_folder_as_zip(self, folder_path, params=None):
+        """Download folder as ZIP archive, or streamed as tar / tar.gz with ?format="""
+        import zipfile
+        import tempfile
+        try:
+            archive_format = (params or {}).get('format', ['zip'])[0]
+            if archive_format not in ARCHIVE_FORMATS:
+                self.send_error(400, f"Unsupported format, use one of: {', '.join(ARCHIVE_FORMATS)}")
+                return
+            
             if not self.utils.is_safe_path(folder_path, BROWSE_ROOT):
                 self.send_error(403, "Access denied")
                 return
             
-            if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
+            if not self.fs.stat(folder_path).is_dir:
                 self.send_error(404, "Folder not found")
                 return
             
-            folder_name = os.path.basename(folder_path)
+            folder_name = os.path.basename(folder_path.rstrip(os.sep))
+            if archive_format != 'zip':
+                # Tar entries keep the folder name as their top directory, like `tar -C parent folder`
+                self.stream_archive(archive_format, os.path.dirname(folder_path.rstrip(os.sep)),
+                                    [folder_name], folder_name + ARCHIVE_FORMATS[archive_format][0])
+                return
+            
             zip_filename = f"{folder_name}.zip"
             
             # Create temporary ZIP file
             with tempfile.NamedTemporaryFile(delete=False) as temp_zip:
-                with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                with self.timer.phase('archive'), zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zipf:
                     for root, dirs, files in os.walk(folder_path):
                         for file in files:
                             file_path = os.path.join(root, file)
+                            # Checked in full: zipfile opens the path itself
+                            if not self.utils.is_safe_path(file_path, BROWSE_ROOT, strict=True):
+                                continue
                             arcname = os.path.relpath(file_path, folder_path)
                             zipf.write(file_path, arcname)
                 
@@ -302,7 +1400,7 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
                 self.send_header('Content-Length', str(zip_size))
                 self.end_headers()
                 
-                with open(temp_zip.name, 'rb') as f:
+                with self.bulk_transfer(zip_size), open(temp_zip.name, 'rb') as f:
                     while True:
                         chunk = f.read(8192)
                         if not chunk:
@@ -315,10 +1413,76 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Error creating ZIP: {str(e)}")
     
+    def handle_batch_form(self):
+        """Read the browser's multi-select form and stream the selection"""
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length > BATCH_MAX_BODY:
+                self.send_error(413, "Selection too large")
+                return
+            form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8', 'replace'))
+            self.body_pending = False
+        except ValueError:
+            self.send_error(400, "Invalid selection form")
+            return
+        self.send_batch(form)
+    
+    def send_batch(self, params):
+        """Stream the selected files and folders (repeated `path` parameters) as one archive"""
+        try:
+            rel_paths = [p.strip('/') for p in params.get('path', []) if p.strip('/')]
+            archive_format = params.get('format', ['zip'])[0]
+            if archive_format not in ARCHIVE_FORMATS:
+                self.send_error(400, f"Unsupported format, use one of: {', '.join(ARCHIVE_FORMATS)}")
+                return
+            if not rel_paths:
+                self.send_error(400, "No paths selected")
+                return
+            if len(rel_paths) > BATCH_MAX_PATHS:
+                self.send_error(413, f"At most {BATCH_MAX_PATHS} paths can be selected")
+                return
+            
+            # Check every selected path before the response starts; folder
+            # contents are checked one by one while they are streamed
+            with self.timer.phase('resolve'):
+                for rel_path in rel_paths:
+                    abs_path = os.path.join(BROWSE_ROOT, rel_path)
+                    if not self.utils.is_safe_path(abs_path, BROWSE_ROOT):
+                        self.send_error(403, "Access denied")
+                        return
+                    if not os.path.lexists(abs_path):
+                        self.send_error(404, f"Not found: {rel_path}")
+                        return
+            
+            self.stream_archive(archive_format, BROWSE_ROOT, rel_paths,
+                                archive_filename(rel_paths, archive_format))
+            
+        except Exception as e:
+            self.send_error(500, f"Error creating archive: {str(e)}")
+    
+    def stream_archive(self, archive_format, root, rel_paths, filename):
+        """Send rel_paths (under root, already checked) as a chunked archive built while it is sent"""
+        self.send_response(200)
+        self.send_header('Content-Type', ARCHIVE_FORMATS[archive_format][1])
+        self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+        self.start_stream()
+        self.end_headers()
+        
+        # Every entry is resolved in full, since the archive writers open paths directly
+        entries = iter_entries(root, rel_paths,
+                               lambda path: self.utils.is_safe_path(path, BROWSE_ROOT, strict=True))
+        def skipped(path, error):
+            self.log_message("Skipped %s in archive: %s", path, error)
+        
+        with self.bulk_transfer(), self.timer.phase('archive'):
+            write_archive(archive_format, entries, ArchiveSink(self.write_stream), on_skip=skipped)
+            self.end_stream()
+    
     def serve_uploaded_file(self, file_path):
         """Serve uploaded files"""
         try:
-            if not os.path.exists(file_path) or not os.path.isfile(file_path):
+            info = self.fs.stat(file_path)
+            if not info.is_file:
                 self.send_error(404, "File not found")
                 return
             
@@ -327,15 +1491,16 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
                 content_type = 'application/octet-stream'
             
             filename = os.path.basename(file_path)
-            file_size = os.path.getsize(file_path)
+            file_size = info.size
             
             self.send_response(200)
             self.send_header('Content-Type', content_type)
             self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
             self.send_header('Content-Length', str(file_size))
+            self.send_digest_headers(file_path, info.st)
             self.end_headers()
             
-            with open(file_path, 'rb') as f:
+            with self.bulk_transfer(file_size), open(file_path, 'rb') as f:
                 while True:
                     chunk = f.read(8192)
                     if not chunk:
@@ -345,64 +1510,137 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Error serving file: {str(e)}")
     
-    def send_upload_page(self):
-        """Send file upload page"""
+    def send_upload_page(self, query_params=None):
+        """Send file upload page with one page of previously uploaded files"""
         try:
-            uploaded_files = []
-            if os.path.exists(UPLOAD_DIR):
-                for filename in sorted(os.listdir(UPLOAD_DIR)):
-                    filepath = os.path.join(UPLOAD_DIR, filename)
-                    if os.path.isfile(filepath):
-                        size = self.utils.format_file_size(os.path.getsize(filepath))
-                        uploaded_files.append({'name': filename, 'size': size})
+            page = max(int((query_params or {}).get('page', ['1'])[0]), 1)
+            if UPLOADS is not None:
+                files_count, total_bytes = UPLOADS.count, UPLOADS.total_bytes
+                entries = UPLOADS.page((page - 1) * UPLOAD_PAGE_SIZE, UPLOAD_PAGE_SIZE)
+            else:
+                # The catalog is still loading
+                entries = []
+                if os.path.exists(UPLOAD_DIR):
+                    for filename in sorted(os.listdir(UPLOAD_DIR)):
+                        filepath = os.path.join(UPLOAD_DIR, filename)
+                        if os.path.isfile(filepath):
+                            entries.append((filename, os.path.getsize(filepath), None))
+                files_count, total_bytes = len(entries), sum(size for _, size, _ in entries)
+                entries = entries[(page - 1) * UPLOAD_PAGE_SIZE:page * UPLOAD_PAGE_SIZE]
+            
+            uploaded_files = [{
+                'name': html.escape(name),
+                'url': urllib.parse.quote(name),
+                'size': self.utils.format_file_size(size),
+            } for name, size, _ in entries]
             
             context = {
                 'uploaded_files': uploaded_files,
-                'files_count': len(uploaded_files)
+                'files_count': files_count,
+                'total_size': self.utils.format_file_size(total_bytes),
+                'page': page,
+                'pages': max((files_count + UPLOAD_PAGE_SIZE - 1) // UPLOAD_PAGE_SIZE, 1),
             }
+            if QUOTAS is not None and QUOTAS.user_limit:
+                used, limit = QUOTAS.usage(self.username or USERNAME)
+                context['quota'] = (f"{self.utils.format_file_size(used)} of "
+                                    f"{self.utils.format_file_size(limit)} used")
             
             html_content = self.template_renderer.render_upload_page(context)
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_html(html_content)
             
+        except ValueError:
+            self.send_error(400, "Invalid page")
         except Exception as e:
             self.send_error(500, f"Error loading upload page: {str(e)}")
     
+    def reserve_upload(self):
+        """Hold space for the upload declared by Content-Length before any of its body is read.
+
+        Returns (length, reservation); the reservation is None while the quota service starts.
+        """
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            # Chunked bodies cannot be checked up front
+            raise QuotaExceeded(411, 'length', "Uploads need a Content-Length")
+        if length < 0:
+            raise QuotaExceeded(400, 'length', "Invalid Content-Length")
+        reservation = None
+        if QUOTAS is not None:
+            reservation = QUOTAS.reserve(self.username or USERNAME, length)
+        self.send_continue()
+        return length, reservation
+    
+    def save_upload_part(self, part, reservation):
+        """Write one file part to UPLOAD_DIR as it arrives; returns the saved name"""
+        safe_filename = os.path.basename(part.filename.replace('\\', '/'))
+        if safe_filename in ('', '.', '..'):
+            part.drain()
+            return None
+        file_path = os.path.join(UPLOAD_DIR, safe_filename)
+        # Received into a hidden folder (ignored by the catalog) and moved into
+        # place when complete, so a failed upload never replaces an existing file
+        partial_dir = os.path.join(UPLOAD_DIR, UPLOAD_PARTIAL_DIR)
+        os.makedirs(partial_dir, exist_ok=True)
+        # Thread idents only differ within a process, and other workers write here too
+        partial_path = os.path.join(partial_dir, f"{safe_filename}.{os.getpid()}.{threading.get_ident()}")
+        
+        # Hash while writing so the checksum is ready as soon as the upload is
+        digest = hashlib.sha256()
+        try:
+            with open(partial_path, 'wb') as f:
+                for chunk in part.chunks():
+                    if reservation is not None:
+                        reservation.consume(len(chunk))
+                    digest.update(chunk)
+                    f.write(chunk)
+            os.replace(partial_path, file_path)
+        except BaseException:
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+            raise
+        self.fs.forget(file_path)
+        
+        st = os.stat(file_path)
+        if reservation is not None:
+            reservation.saved(safe_filename, st.st_size)
+        if UPLOADS is not None:
+            UPLOADS.record(safe_filename, st.st_size, st.st_mtime)
+        if CHECKSUMS is not None:
+            CHECKSUMS.store(st, 'sha256', digest.hexdigest())
+        return safe_filename
+    
     def handle_upload(self):
         """Handle file upload"""
         try:
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST'}
-            )
-            
-            if "files" not in form:
-                raise ValueError("No files uploaded")
+            length, reservation = self.reserve_upload()
+        except QuotaExceeded as e:
+            # The body was never read, so send_error closes the connection
+            self.log_message('"%s" rejected: %s', self.requestline, e.reason)
+            self.send_error(e.status, str(e))
+            return
+        
+        try:
+            if self.headers.get_content_type() != 'multipart/form-data':
+                raise ValueError("Expected a multipart/form-data body")
+            reader = MultipartReader(self.rfile, self.headers.get_param('boundary'), length)
             
             uploaded_files = []
-            files_field = form["files"]
-            
-            # Handle single or multiple files
-            if isinstance(files_field, list):
-                files_to_process = files_field
-            else:
-                files_to_process = [files_field]
-            
-            for file_item in files_to_process:
-                if hasattr(file_item, 'filename') and file_item.filename:
-                    # Save the uploaded file
-                    safe_filename = os.path.basename(file_item.filename)
-                    file_path = os.path.join(UPLOAD_DIR, safe_filename)
-                    
-                    with open(file_path, 'wb') as f:
-                        f.write(file_item.file.read())
-                    
-                    uploaded_files.append(safe_filename)
+            with self.timer.phase('receive'):
+                for part in reader:
+                    if part.name == 'files' and part.filename:
+                        saved = self.save_upload_part(part, reservation)
+                        if saved is not None:
+                            uploaded_files.append(saved)
+                reader.discard_rest()
+                self.body_pending = False
             
+            if reservation is not None:
+                reservation.finish()
             if not uploaded_files:
                 raise ValueError("No valid files uploaded")
             
@@ -413,13 +1651,25 @@ class FileServer(http.server.SimpleHTTPRequestHandler):
             
             html_content = self.template_renderer.render_upload_success(context)
             
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_html(html_content)
             
+        except QuotaExceeded as e:
+            self.send_error(e.status, str(e))
+        except BodyTruncated:
+            # The client went away mid-upload; there is nobody to answer
+            self.log_error("upload from %s ended early", self.client_address[0])
+            self.close_connection = True
+        except OSError as e:
+            if e.errno in (errno.ENOSPC, errno.EDQUOT):
+                self.send_error(507, "Upload failed: not enough disk space")
+            else:
+                self.send_error(400, f"Upload failed: {str(e)}")
         except Exception as e:
             self.send_error(400, f"Upload failed: {str(e)}")
+        finally:
+            # Charge the files that were saved and release the rest of the reservation (once)
+            if reservation is not None:
+                reservation.finish()
 
 def get_directory_from_user():
     """Prompt user to select the browse directory during startup"""
@@ -462,41 +1712,229 @@ def get_directory_from_user():
         print("Configuration cancelled.")
         return None
 
-def main():
+def start_background_services(state_dir=STATE_DIR, shared_state_dir=None):
+    """Create the shared services that run alongside the request handlers.
+
+    Each service is published in its global only once it is ready, and the
+    handlers treat a service that is still None as unavailable, so this can
+    run in a thread while the server is already answering requests.
+
+    Pre-forked workers pass a shared_state_dir that all of them use: the
+    change journal and session revocations live there, and upload
+    reservations are published there. Everything else goes in state_dir.
+    """
+    global CHANGE_WATCHER, PATH_INDEX, CHANGE_JOURNAL, DIR_SIZES, CHECKSUMS, SESSIONS, UPLOADS, QUOTAS
+
+    SESSIONS = SessionManager(revoked_path=os.path.join(shared_state_dir or state_dir, 'revoked_sessions'))
+
+    CHANGE_WATCHER = create_watcher({'browse': BROWSE_ROOT, 'uploads': UPLOAD_DIR})
+    HOT_CACHE.track(CHANGE_WATCHER)
+    STAT_CACHE.track(CHANGE_WATCHER)
+    resolver = resolver_for(BROWSE_ROOT)
+    resolver.track(CHANGE_WATCHER, 'browse')
+    metrics.register_cache('path_resolve', resolver)
+
+    PATH_INDEX = PathIndex(BROWSE_ROOT)
+    CHANGE_WATCHER.subscribe(PATH_INDEX.apply_change, root='browse')
+    PATH_INDEX.start(interval=None)
+
+    journal = ChangeJournal(BROWSE_ROOT, state_dir=shared_state_dir or state_dir)
+    journal.open()
+    CHANGE_WATCHER.subscribe(journal.apply_change, root='browse')
+    journal.start()
+    CHANGE_JOURNAL = journal
+
+    DIR_SIZES = DirectorySizes(BROWSE_ROOT)
+    CHANGE_WATCHER.subscribe(DIR_SIZES.apply_change, root='browse')
+    DIR_SIZES.start()
+
+    uploads = UploadCatalog(UPLOAD_DIR, state_dir=state_dir)
+    if UPLOAD_CATALOG_PERSIST:
+        uploads.load()
+    else:
+        uploads.scan()
+    CHANGE_WATCHER.subscribe(uploads.apply_change, root='uploads')
+    UPLOADS = uploads
+
+    quotas = UploadQuota(uploads, UPLOAD_DIR, state_dir=state_dir, shared_dir=shared_state_dir)
+    quotas.load()
+    CHANGE_WATCHER.subscribe(quotas.apply_change, root='uploads')
+    QUOTAS = quotas
+
+    checksums = ChecksumService(state_dir=state_dir)
+    checksums.load()
+    metrics.register_cache('checksum', checksums)
+    CHECKSUMS = checksums
+
+    METRICS.collector('sheri_path_index_entries', 'Paths in the search index',
+                      lambda: len(PATH_INDEX.ids))
+    METRICS.collector('sheri_change_events_total', 'Filesystem changes published by the watcher',
+                      lambda: CHANGE_WATCHER.events_published, kind='counter')
+    METRICS.collector('sheri_change_journal_sequence', 'Latest change journal sequence number',
+                      lambda: CHANGE_JOURNAL.last_seq)
+    METRICS.collector('sheri_dirsize_pending', 'Directories waiting for size accounting',
+                      lambda: len(DIR_SIZES.pending))
+    METRICS.collector('sheri_hot_cache_bytes', 'Memory used by the hot-object cache',
+                      lambda: HOT_CACHE.bytes_used)
+    METRICS.collector('sheri_hot_cache_evictions_total', 'Files evicted from the hot-object cache',
+                      lambda: HOT_CACHE.evictions, kind='counter')
+    METRICS.collector('sheri_shaping_active_transfers', 'Bulk transfers currently being shaped',
+                      lambda: SHAPER.active_transfers)
+    METRICS.collector('sheri_shaping_bytes_total', 'Bytes sent through the bandwidth shaper',
+                      lambda: SHAPER.bytes_shaped, kind='counter')
+    METRICS.collector('sheri_shaping_wait_seconds_total', 'Time bulk transfers waited for bandwidth',
+                      lambda: round(SHAPER.wait_seconds, 6), kind='counter')
+    METRICS.collector('sheri_admission_queue_depth', 'Requests waiting for an admission slot',
+                      ADMISSION.queue_depths, ('route',))
+    METRICS.collector('sheri_admission_active', 'Requests holding an admission slot',
+                      ADMISSION.active_counts, ('route',))
+    METRICS.collector('sheri_admission_rejected_total', 'Requests turned away by admission control',
+                      ADMISSION.rejections, ('route', 'reason'), kind='counter')
+    METRICS.collector('sheri_upload_reserved_bytes', 'Bytes reserved by uploads in progress',
+                      lambda: QUOTAS.reserved_total)
+    METRICS.collector('sheri_upload_rejected_total', 'Uploads refused by quota or disk-space checks',
+                      lambda: dict(QUOTAS.rejected), ('reason',), kind='counter')
+
+def start_background_services_async(state_dir=STATE_DIR, shared_state_dir=None, on_ready=None):
+    """Start the services in a thread so the server can accept connections right away"""
+    global STARTUP_THREAD
+
+    def run():
+        start_background_services(state_dir, shared_state_dir)
+        if on_ready is not None:
+            on_ready()
+
+    STARTUP_THREAD = threading.Thread(target=run, name='startup', daemon=True)
+    STARTUP_THREAD.start()
+
+def stop_background_services():
+    """Stop the shared services and persist their state"""
+    if STARTUP_THREAD is not None:
+        STARTUP_THREAD.join()
+    PROFILER.stop_all()
+    if CHANGE_WATCHER is not None:
+        CHANGE_WATCHER.stop()
+    if PATH_INDEX is not None:
+        PATH_INDEX.stop()
+    if CHANGE_JOURNAL is not None:
+        CHANGE_JOURNAL.stop()
+    if DIR_SIZES is not None:
+        DIR_SIZES.stop()
+    if CHECKSUMS is not None:
+        CHECKSUMS.stop()
+    if UPLOADS is not None and UPLOAD_CATALOG_PERSIST:
+        UPLOADS.stop()
+    if QUOTAS is not None:
+        QUOTAS.save()
+
+class ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """One thread per connection, so idle keep-alive connections do not block others"""
+    daemon_threads = True
+    allow_reuse_address = True
+
+def create_server(host, port, listener=None):
+    """Create the listening server, optionally on an existing socket; also used by the benchmarks"""
+    if listener is None:
+        return ThreadingServer((host, port), FileServer)
+    httpd = ThreadingServer((host, port), FileServer, bind_and_activate=False)
+    httpd.socket.close()
+    httpd.socket = listener
+    httpd.server_address = listener.getsockname()
+    return httpd
+
+def requests_in_flight():
+    return sum(metrics.IN_FLIGHT.values.values())
+
+def run_worker(slot, listener):
+    """Body of one pre-forked worker process, see prefork.Supervisor"""
+    global METRICS_EXPORTER, GRACEFUL_STOP
+    # Each slot keeps its own checksum cache and upload catalog, so a
+    # restarted worker continues where its predecessor stopped; the change
+    # journal, upload reservations and revoked sessions are shared by all.
+    # The watcher, search index and folder sizes are deliberately per worker
+    # (see README, Multi-Process Mode): each needs them current for its own
+    # caches, and building them before the fork would fork running threads
+    start_background_services_async(state_dir=os.path.join(STATE_DIR, f"worker-{slot}"),
+                                    shared_state_dir=STATE_DIR)
+    METRICS_EXPORTER = MetricsExporter(slot, METRICS.render)
+    METRICS_EXPORTER.start()
+    with create_server(HOST, PORT, listener) as httpd:
+        GRACEFUL_STOP = GracefulStop(httpd, requests_in_flight)
+        GRACEFUL_STOP.install()
+        httpd.serve_forever()
+        # A replacement worker may already export under this slot
+        METRICS_EXPORTER.stop()
+        GRACEFUL_STOP.wait_for_requests()
+    stop_background_services()
+
+def parse_args(argv=None):
+    """Command line options; each defaults to its SHERI_* environment variable or config.py"""
+    parser = argparse.ArgumentParser(description="Enhanced File Server")
+    parser.add_argument('browse_root', nargs='?', default=BROWSE_ROOT,
+                        help="directory to serve (SHERI_BROWSE_ROOT); asked for interactively when omitted")
+    parser.add_argument('--host', default=HOST, help=f"address to listen on (SHERI_HOST, default {HOST})")
+    parser.add_argument('--port', type=int, default=PORT, help=f"port to listen on (SHERI_PORT, default {PORT})")
+    parser.add_argument('--upload-dir', default=UPLOAD_DIR, help="upload directory (SHERI_UPLOAD_DIR)")
+    parser.add_argument('--workers', type=int, default=PREFORK_WORKERS,
+                        help="worker processes, 0 = one per CPU core (SHERI_WORKERS)")
+    parser.add_argument('--quiet', action='store_true', help="print a short status line instead of the banner")
+    return parser.parse_args(argv)
+
+def print_ready():
+    """Print the addresses to open; detecting the machine's IP happens here, after startup"""
+    print("\n🎯 READY! Open your browser and navigate to:")
+    print(f"   🏠 Main Dashboard: {get_server_ip()}:{PORT}")
+    print(f"   📤 Upload Page: {get_server_ip()}:{PORT}/upload") 
+    print(f"   📁 Browse Files: {get_server_ip()}:{PORT}/browse")
+    print("\n⚠️  Press Ctrl+C to stop the server")
+    print("-" * 70)
+
+def main(argv=None):
     """Main function to start the server"""
-    global BROWSE_ROOT
+    global BROWSE_ROOT, UPLOAD_DIR, HOST, PORT
+    
+    args = parse_args(argv)
+    HOST, PORT, UPLOAD_DIR = args.host, args.port, args.upload_dir
     
-    # Get directory selection from user
-    BROWSE_ROOT = get_directory_from_user()
+    if args.browse_root:
+        BROWSE_ROOT = os.path.abspath(args.browse_root)
+    elif sys.stdin.isatty():
+        # Get directory selection from user
+        BROWSE_ROOT = get_directory_from_user()
+    else:
+        print("❌ No browse directory: pass one as an argument or set SHERI_BROWSE_ROOT")
+        return 2
     
     if BROWSE_ROOT is None:
         print("Exiting...")
         return
     
-    print("\n" + "=" * 70)
-    print("🚀 ENHANCED FILE SERVER STARTING")
-    print("=" * 70)
-    print(f"📂 Upload Directory: {os.path.abspath(UPLOAD_DIR)}")
-    print(f"📁 Browse Directory: {BROWSE_ROOT}")
-    print(f"🌐 Server Address: {SERVER_IP}:{PORT}")
-    print(f"📝 Username: {USERNAME}")
-    print(f"🔒 Password: {PASSWORD}")
-    print("=" * 70)
-    print("✨ FEATURES:")
-    print("   📤 File Upload")
-    print("   📁 Directory Browsing") 
-    print("   👁️  File Viewing (with syntax highlighting)")
-    print("   ⬇️  File Downloads")
-    print("   📦 Folder ZIP Downloads")
-    print("   🔒 Password Protection")
-    print("=" * 70)
+    if not args.quiet:
+        print("\n" + "=" * 70)
+        print("🚀 ENHANCED FILE SERVER STARTING")
+        print("=" * 70)
+        print(f"📂 Upload Directory: {os.path.abspath(UPLOAD_DIR)}")
+        print(f"📁 Browse Directory: {BROWSE_ROOT}")
+        print(f"🌐 Listening on: {HOST}:{PORT}")
+        print(f"📝 Username: {USERNAME}")
+        print(f"🔒 Password: {PASSWORD}")
+        print("=" * 70)
+        print("✨ FEATURES:")
+        print("   📤 File Upload")
+        print("   📁 Directory Browsing") 
+        print("   👁️  File Viewing (with syntax highlighting)")
+        print("   ⬇️  File Downloads")
+        print("   📦 Folder ZIP Downloads")
+        print("   🔍 Path Search")
+        print("   🔒 Password Protection")
+        print("=" * 70)
     
     # Check if browse directory exists
-    if not os.path.exists(BROWSE_ROOT):
+    if not os.path.isdir(BROWSE_ROOT):
         print(f"⚠️  WARNING: Browse directory '{BROWSE_ROOT}' does not exist!")
         print(f"   Please create it or restart the server.")
-        return
-    else:
+        return 1
+    elif not args.quiet:
         print(f"✅ Browse directory verified: {BROWSE_ROOT}")
     
     # Create upload directory and sample file
@@ -516,22 +1954,41 @@ def main():
             f.write("• Directory access control\n\n")
             f.write(f"Server started: {datetime.datetime.now()}\n")
             f.write(f"Browse directory: {BROWSE_ROOT}\n")
-        print(f"📝 Created sample file: {sample_file}")
+        if not args.quiet:
+            print(f"📝 Created sample file: {sample_file}")
     
-    print("\n🎯 READY! Open your browser and navigate to:")
-    print(f"   🏠 Main Dashboard: {SERVER_IP}:{PORT}")
-    print(f"   📤 Upload Page: {SERVER_IP}:{PORT}/upload") 
-    print(f"   📁 Browse Files: {SERVER_IP}:{PORT}/browse")
-    print("\n⚠️  Press Ctrl+C to stop the server")
-    print("-" * 70)
+    workers = worker_count(args.workers)
+    if workers > 1:
+        # Create the session key before forking so every worker signs with the same one
+        sessions.load_secret()
+        if args.quiet:
+            print(f"Serving {BROWSE_ROOT} on {HOST}:{PORT} with {workers} workers (pid {os.getpid()})")
+        else:
+            print_ready()
+            print(f"   Send SIGHUP to pid {os.getpid()} to replace the workers gracefully")
+        Supervisor(run_worker, HOST, PORT, workers=workers).run()
+        if not args.quiet:
+            print("\n" + "=" * 70)
+            print("🛑 SERVER STOPPED GRACEFULLY")
+            print("=" * 70)
+        return
     
-    with socketserver.TCPServer((HOST, PORT), FileServer) as httpd:
+    # Listen first: the services load in the background and the address is
+    # only detected once the server already accepts connections
+    with create_server(HOST, PORT) as httpd:
+        if args.quiet:
+            print(f"Serving {BROWSE_ROOT} on {HOST}:{PORT}", flush=True)
+            start_background_services_async()
+        else:
+            start_background_services_async(on_ready=print_ready)
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
-            print("\n" + "=" * 70)
-            print("🛑 SERVER STOPPED GRACEFULLY")
-            print("=" * 70)
+            stop_background_services()
+            if not args.quiet:
+                print("\n" + "=" * 70)
+                print("🛑 SERVER STOPPED GRACEFULLY")
+                print("=" * 70)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,200 @@
+"""
+Login sessions for the Enhanced File Server
+Credentials are checked once, at login, by a pluggable credential backend.
+Afterwards the browser presents an HMAC-signed, expiring session cookie that
+is verified with a single HMAC and a constant-time comparison.
+"""
+
+import os
+import abc
+import hmac
+import fcntl
+import time
+import base64
+import hashlib
+import secrets
+import importlib
+import threading
+from config import *
+
+
+class CredentialBackend(abc.ABC):
+    """Checks a username and password; subclasses implement verify()"""
+
+    @abc.abstractmethod
+    def verify(self, username, password):
+        """True if the password is right for username"""
+
+
+class ConfigCredentials(CredentialBackend):
+    """The single USERNAME / PASSWORD pair from config.py"""
+
+    def verify(self, username, password):
+        # Compare both fields so the time taken does not reveal which one was wrong
+        user_ok = hmac.compare_digest(username.encode('utf-8'), USERNAME.encode('utf-8'))
+        password_ok = hmac.compare_digest(password.encode('utf-8'), PASSWORD.encode('utf-8'))
+        return user_ok and password_ok
+
+
+def load_backend(spec=CREDENTIAL_BACKEND):
+    """Instantiate a backend from a "module:Class" spec"""
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def load_secret(path=SESSION_SECRET_FILE):
+    """Read the signing key, creating it on first use.
+
+    Keeping it on disk lets sessions survive restarts and be shared by
+    several server processes.
+    """
+    try:
+        with open(path, 'rb') as f:
+            secret = f.read()
+        if len(secret) >= 32:
+            return secret
+    except OSError:
+        pass
+    secret = secrets.token_bytes(32)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+def cookie_value(cookie_header, name):
+    """Return one cookie from a Cookie header without building a SimpleCookie"""
+    if not cookie_header:
+        return None
+    prefix = name + '='
+    for part in cookie_header.split(';'):
+        part = part.strip()
+        if part.startswith(prefix):
+            return part[len(prefix):]
+    return None
+
+
+class SessionManager:
+    """Issues and verifies session tokens.
+
+    A token is "<expires>.<nonce>.<signature>.<user>", where the user is
+    base64url encoded and the signature is HMAC-SHA256 over everything else.
+    Verifying one costs a split, one HMAC and a compare_digest; nothing is
+    stored per session except revoked (logged out) signatures.
+
+    Revocations are appended to revoked_path, so a logout handled by one
+    worker process applies to all of them (and survives a restart); each
+    process re-reads the file when its size or inode changes.
+    """
+
+    def __init__(self, backend=None, secret=None, lifetime=SESSION_LIFETIME, revoked_path=SESSION_REVOKED_FILE):
+        self.backend = backend or load_backend()
+        self.secret = secret or load_secret()
+        self.lifetime = lifetime
+        self.lock = threading.Lock()
+        self.revoked = {}         # signature -> expiry, until the token would expire anyway
+        self.revoked_path = revoked_path
+        self.revoked_version = None   # (inode, size) of the revocation file last read
+        self.revoked_rewrite_size = 64 * 1024  # compact the file once it grows past this
+
+    def _sign(self, expires, nonce, user):
+        message = f"{expires}.{nonce}.{user}".encode('ascii')
+        digest = hmac.new(self.secret, message, hashlib.sha256).digest()
+        return base64.urlsafe_b64encode(digest).rstrip(b'=').decode('ascii')
+
+    def login(self, username, password):
+        """Check credentials with the backend; returns a new token or None"""
+        if not self.backend.verify(username, password):
+            return None
+        return self.issue(username)
+
+    def issue(self, username):
+        expires = int(time.time()) + self.lifetime
+        nonce = secrets.token_urlsafe(9)
+        user = base64.urlsafe_b64encode(username.encode('utf-8')).rstrip(b'=').decode('ascii')
+        return f"{expires}.{nonce}.{self._sign(expires, nonce, user)}.{user}"
+
+    def verify(self, token):
+        """Return the username of a valid, unexpired token, else None"""
+        # Cookies are client input: anything non-ASCII cannot be one of our tokens
+        if not token or not token.isascii():
+            return None
+        parts = token.split('.')
+        if len(parts) != 4:
+            return None
+        expires, nonce, signature, user = parts
+        if not expires.isdecimal() or int(expires) < time.time():
+            return None
+        if not hmac.compare_digest(signature, self._sign(expires, nonce, user)):
+            return None
+        if self.revoked_path is not None:
+            self._sync_revoked()
+        if self.revoked and signature in self.revoked:
+            return None
+        return base64.urlsafe_b64decode(user + '=' * (-len(user) % 4)).decode('utf-8')
+
+    def revoke(self, token):
+        """Invalidate a token before it expires (used by logout)"""
+        if not token or not token.isascii():
+            return
+        parts = token.split('.')
+        if len(parts) != 4 or not parts[0].isdecimal():
+            return
+        now = time.time()
+        with self.lock:
+            self.revoked = {sig: expires for sig, expires in self.revoked.items() if expires > now}
+            self.revoked[parts[2]] = int(parts[0])
+        if self.revoked_path is not None:
+            self._append_revoked(parts[2], int(parts[0]))
+
+    def _sync_revoked(self):
+        """Pick up revocations written by other processes"""
+        try:
+            st = os.stat(self.revoked_path)
+        except OSError:
+            return
+        if (st.st_ino, st.st_size) == self.revoked_version:
+            return
+        now = time.time()
+        revoked = {}
+        try:
+            with open(self.revoked_path, 'r', encoding='ascii', errors='replace') as f:
+                for line in f:
+                    signature, _, expires = line.strip().partition(' ')
+                    if expires.isdecimal() and int(expires) > now:
+                        revoked[signature] = int(expires)
+        except OSError:
+            return
+        with self.lock:
+            self.revoked.update(revoked)
+            self.revoked_version = (st.st_ino, st.st_size)
+
+    def _append_revoked(self, signature, expires):
+        os.makedirs(os.path.dirname(self.revoked_path) or '.', exist_ok=True)
+        # Appends and rewrites take the same lock, so no revocation is lost to a rewrite
+        with open(self.revoked_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with open(self.revoked_path, 'a', encoding='ascii') as f:
+                f.write(f"{signature} {expires}\n")
+            if os.path.getsize(self.revoked_path) > self.revoked_rewrite_size:
+                # Drop revocations of tokens that have expired anyway
+                self.revoked_version = None
+                self._sync_revoked()
+                with self.lock:
+                    live = dict(self.revoked)
+                temp_path = self.revoked_path + '.tmp'
+                with open(temp_path, 'w', encoding='ascii') as f:
+                    f.writelines(f"{sig} {exp}\n" for sig, exp in live.items())
+                os.replace(temp_path, self.revoked_path)
+                self.revoked_rewrite_size = max(64 * 1024, 2 * os.path.getsize(self.revoked_path))
+
+    def cookie_header(self, token):
+        """Set-Cookie value for a new session"""
+        flags = f"Path=/; Max-Age={self.lifetime}; HttpOnly; SameSite=Lax"
+        if SESSION_COOKIE_SECURE:
+            flags += "; Secure"
+        return f"{SESSION_COOKIE}={token}; {flags}"
+
+    def clear_cookie_header(self):
+        return f"{SESSION_COOKIE}=; Path=/; Max-Age=0; HttpOnly; SameSite=Lax"
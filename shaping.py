@@ -0,0 +1,169 @@
+"""
+Outbound bandwidth shaping for the Enhanced File Server
+Token buckets cap the total and per-client send rate of bulk transfers
+(downloads, ZIP archives, deltas), and a start-time fair queue hands out the
+global budget so every client gets an equal share no matter how many
+transfers it runs. Small responses skip the queue so pages stay fast while
+bulk transfers are running.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+from config import *
+
+
+class TokenBucket:
+    """Reservation-style token bucket: take() may run into debt that later callers wait out"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount):
+        """Remove tokens and return how long the caller should wait before sending"""
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def time_until_available(self):
+        """Seconds until the bucket is out of debt"""
+        with self.lock:
+            self._refill()
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class FairQueue:
+    """Start-time fair queuing of send grants over a shared token bucket.
+
+    Each grant gets a start tag max(virtual time, the flow's last finish tag)
+    and grants are released in tag order whenever the bucket is out of debt.
+    A flow (client) that already sent a lot therefore waits behind flows
+    that sent little, which shares the rate equally between clients.
+    """
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.cond = threading.Condition()
+        self.waiting = []             # heap of (start tag, sequence)
+        self.finish_tags = {}         # flow -> finish tag of its last grant
+        self.virtual_time = 0.0
+        self.sequence = itertools.count()
+
+    def acquire(self, flow, amount):
+        with self.cond:
+            start = max(self.virtual_time, self.finish_tags.get(flow, 0.0))
+            self.finish_tags[flow] = start + amount
+            entry = (start, next(self.sequence))
+            heapq.heappush(self.waiting, entry)
+            while True:
+                if self.waiting[0] == entry:
+                    delay = self.bucket.time_until_available()
+                    if delay <= 0:
+                        break
+                    self.cond.wait(delay)
+                else:
+                    self.cond.wait()
+            heapq.heappop(self.waiting)
+            self.bucket.take(amount)
+            self.virtual_time = start
+            self.cond.notify_all()
+
+    def forget(self, flow):
+        with self.cond:
+            self.finish_tags.pop(flow, None)
+
+
+class TransferShaper:
+    """Paces bulk transfers with a global fair queue and per-client buckets"""
+
+    def __init__(self, global_rate=SHAPING_GLOBAL_RATE, client_rate=SHAPING_CLIENT_RATE,
+                 burst=SHAPING_BURST, quantum=SHAPING_QUANTUM):
+        self.quantum = quantum
+        self.client_rate = client_rate
+        self.burst = burst
+        self.global_bucket = TokenBucket(global_rate, burst) if global_rate else None
+        self.queue = FairQueue(self.global_bucket) if self.global_bucket else None
+        self.lock = threading.Lock()
+        self.clients = {}             # client -> [active transfers, TokenBucket or None]
+        self.active_transfers = 0
+        self.bytes_shaped = 0
+        self.wait_seconds = 0.0
+
+    @property
+    def enabled(self):
+        return self.global_bucket is not None or bool(self.client_rate)
+
+    def start(self, client):
+        with self.lock:
+            state = self.clients.get(client)
+            if state is None:
+                bucket = TokenBucket(self.client_rate, self.burst) if self.client_rate else None
+                state = self.clients[client] = [0, bucket]
+            state[0] += 1
+            self.active_transfers += 1
+
+    def finish(self, client):
+        with self.lock:
+            state = self.clients.get(client)
+            if state is None:
+                return
+            state[0] -= 1
+            self.active_transfers -= 1
+            if state[0] > 0:
+                return
+            del self.clients[client]
+        if self.queue is not None:
+            self.queue.forget(client)
+
+    def acquire(self, client, amount):
+        """Block until `amount` bytes may be sent for client; returns the seconds waited"""
+        started = time.monotonic()
+        state = self.clients.get(client)
+        if state is not None and state[1] is not None:
+            delay = state[1].take(amount)
+            if delay > 0:
+                time.sleep(delay)
+        if self.queue is not None:
+            self.queue.acquire(client, amount)
+        waited = time.monotonic() - started
+        with self.lock:
+            self.bytes_shaped += amount
+            self.wait_seconds += waited
+        return waited
+
+    def charge(self, amount):
+        """Count unshaped (small, priority) response bytes against the global budget"""
+        if self.global_bucket is not None and amount > 0:
+            self.global_bucket.take(amount)
+
+
+class ShapedWriter:
+    """Wraps a handler's wfile for the duration of one bulk transfer"""
+
+    def __init__(self, raw, shaper, client, timer):
+        self.raw = raw
+        self.shaper = shaper
+        self.client = client
+        self.timer = timer
+
+    def write(self, data):
+        view = memoryview(data)
+        for offset in range(0, len(view), self.shaper.quantum):
+            piece = view[offset:offset + self.shaper.quantum]
+            self.timer.add('shaping', self.shaper.acquire(self.client, len(piece)))
+            self.raw.write(piece)
+        return len(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
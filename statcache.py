@@ -0,0 +1,144 @@
+"""
+Shared file metadata for the Enhanced File Server
+Collapses the repeated exists/isfile/getsize calls a request makes on the
+same path: a request-scoped view stats each path at most once per request, backed by a short-TTL process-wide cache that the change
+watcher invalidates. This matters most on network filesystems, where every
+metadata call is a round trip.
+"""
+
+import os
+import stat
+import time
+import threading
+from collections import OrderedDict
+from config import *
+
+
+class PathInfo:
+    """Result of one stat (following symlinks); st is None when the path does not exist"""
+
+    __slots__ = ('path', 'st')
+
+    def __init__(self, path, st):
+        self.path = path
+        self.st = st
+
+    @property
+    def exists(self):
+        return self.st is not None
+
+    @property
+    def is_file(self):
+        return self.st is not None and stat.S_ISREG(self.st.st_mode)
+
+    @property
+    def is_dir(self):
+        return self.st is not None and stat.S_ISDIR(self.st.st_mode)
+
+    @property
+    def size(self):
+        return self.st.st_size if self.st is not None else None
+
+    @property
+    def mtime(self):
+        return self.st.st_mtime if self.st is not None else None
+
+
+def stat_path(path):
+    try:
+        return PathInfo(path, os.stat(path))
+    except (OSError, ValueError):
+        return PathInfo(path, None)
+
+
+class MetadataCache:
+    """Process-wide stat results, kept for STAT_CACHE_TTL seconds"""
+
+    def __init__(self, ttl=STAT_CACHE_TTL, max_entries=STAT_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.stats = OrderedDict()    # path -> (expires, PathInfo)
+        self.generation = 0           # bumped by every invalidation
+        self.hits = 0
+        self.misses = 0
+
+    def stat(self, path):
+        path = os.path.normpath(path)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.stats.get(path)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self.stats.move_to_end(path)
+                return entry[1]
+            self.misses += 1
+            generation = self.generation
+        info = stat_path(path)
+        if self.ttl > 0:
+            with self.lock:
+                if generation != self.generation:
+                    # Something changed while we looked; the result may already be stale
+                    return info
+                self.stats[path] = (now + self.ttl, info)
+                self.stats.move_to_end(path)
+                while len(self.stats) > self.max_entries:
+                    self.stats.popitem(last=False)
+        return info
+
+    def invalidate(self, path, subtree=True):
+        """Forget path and, with subtree, everything below it (a changed folder or symlink moves its whole subtree)"""
+        path = os.path.normpath(path)
+        prefix = path + os.sep
+        with self.lock:
+            self.generation += 1
+            if not subtree:
+                self.stats.pop(path, None)
+                return
+            for key in [k for k in self.stats if k == path or k.startswith(prefix)]:
+                del self.stats[key]
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.stats.clear()
+
+    def track(self, watcher):
+        watcher.subscribe(self.apply_change)
+
+    def apply_change(self, event):
+        if event.kind == 'rescan':
+            self.clear()
+            return
+        path = os.path.normpath(event.path)
+        with self.lock:
+            entry = self.stats.get(path)
+            was_dir = entry is not None and entry[1].is_dir
+        # Plain file events (most of a bulk copy) only drop their own entry;
+        # the subtree scan is kept for folders and symlinks
+        self.invalidate(path, subtree=event.is_dir or was_dir or os.path.islink(path))
+
+
+class RequestStats:
+    """Metadata lookups for one request: every path is statted at most once.
+
+    Without a cache the lookups go straight to the filesystem (still
+    memoized for the request).
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._stats = {}
+
+    def stat(self, path):
+        info = self._stats.get(path)
+        if info is None:
+            info = self.cache.stat(path) if self.cache is not None else stat_path(path)
+            self._stats[path] = info
+        return info
+
+    def forget(self, path):
+        """Drop a path this request has just changed (e.g. written)"""
+        self._stats.pop(path, None)
+        if self.cache is not None:
+            self.cache.invalidate(path)
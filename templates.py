@@ -4,6 +4,7 @@ Contains HTML templates and rendering functions
 """
 
 import os
+import html
 from config import PORT
 
 class TemplateRenderer:
@@ -112,6 +113,19 @@ class TemplateRenderer:
                 padding: 8px 12px;
                 border-radius: 4px;
             }
+            .search-form { display: flex; gap: 8px; flex: 1; max-width: 420px; }
+            .search-form input[type="text"] {
+                flex: 1;
+                padding: 10px 12px;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+                font-size: 14px;
+            }
+            .search-summary { 
+                padding: 20px 30px 0; 
+                color: #666; 
+                font-size: 14px;
+            }
             .breadcrumbs { 
                 margin-top: 10px;
                 font-size: 14px;
@@ -232,6 +246,49 @@ class TemplateRenderer:
                 margin-top: 10px;
                 font-style: italic;
             }
+            .login-form {
+                display: flex;
+                flex-direction: column;
+                gap: 12px;
+                max-width: 360px;
+                margin: 40px auto;
+            }
+            .login-form input {
+                padding: 12px;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+                font-size: 14px;
+            }
+            .login-error {
+                color: #721c24;
+                background: #f8d7da;
+                border: 1px solid #f5c6cb;
+                border-radius: 6px;
+                padding: 10px;
+            }
+            .batch-bar {
+                display: flex;
+                align-items: center;
+                gap: 10px;
+                margin-bottom: 15px;
+                color: #666;
+            }
+            .batch-bar select {
+                padding: 6px;
+                border: 1px solid #ddd;
+                border-radius: 6px;
+            }
+            .select-box {
+                margin-right: 10px;
+            }
+            .pager {
+                display: flex;
+                align-items: center;
+                justify-content: center;
+                gap: 10px;
+                margin-top: 15px;
+                color: #666;
+            }
             @media (max-width: 768px) {
                 .dashboard-grid { grid-template-columns: 1fr; }
                 .toolbar { flex-direction: column; align-items: stretch; }
@@ -400,6 +457,7 @@ class TemplateRenderer:
                         <li><strong>Browse Directory:</strong> {context['browse_root']}</li>
                         <li><strong>Features:</strong> Upload, Download, File Viewing, Directory Browsing, ZIP Archives</li>
                     </ul>
+                    <a href="/logout" class="btn btn-secondary">Log Out</a>
                 </div>
             </div>
         </body>
@@ -410,10 +468,14 @@ class TemplateRenderer:
         """Render the file browser page"""
         # Generate parent directory link
         parent_link = ""
+        # Inside an archive entries carry their own URLs and cannot be selected or zipped
+        in_archive = context.get('in_archive', False)
+        rel_path_html = html.escape(context['rel_path'], quote=True)
         if context['has_parent']:
             parent_path = os.path.dirname(context['rel_path'])
             if parent_path == '.':
                 parent_path = ''
+            parent_url = context.get('parent_url', f"/browse/{parent_path}")
             parent_link = f"""
             <div class="file-item folder">
                 <div class="file-info">
@@ -421,24 +483,27 @@ class TemplateRenderer:
                     <span class="name">..</span>
                     <span class="details">Parent Directory</span>
                 </div>
-                <a href="/browse/{parent_path}" class="btn-small">Back</a>
+                <a href="{parent_url}" class="btn-small">Back</a>
             </div>
             """
         
         # Generate directories listing
         directories_html = ""
         for directory in context['directories']:
-            browse_path = f"{context['rel_path']}/{directory}" if context['rel_path'] else directory
+            select_box = '' if in_archive else f'<input type="checkbox" name="path" value="{html.escape(directory["path"], quote=True)}" class="select-box" form="batch-form">'
+            archive_buttons = '' if in_archive else f"""
+                    <a href="/zip/{directory['path']}" class="btn-small btn-zip">ZIP</a>
+                    <a href="/zip/{directory['path']}?format=tar.gz" class="btn-small btn-zip">TAR.GZ</a>"""
             directories_html += f"""
             <div class="file-item folder">
                 <div class="file-info">
+                    {select_box}
                     <span class="icon">📁</span>
-                    <span class="name">{directory}</span>
-                    <span class="details">Folder</span>
+                    <span class="name">{directory['name']}</span>
+                    <span class="details">{directory['details']}</span>
                 </div>
                 <div class="actions">
-                    <a href="/browse/{browse_path}" class="btn-small">Open</a>
-                    <a href="/zip/{browse_path}" class="btn-small btn-zip">ZIP</a>
+                    <a href="{directory.get('url', '/browse/' + directory['path'])}" class="btn-small">Open</a>{archive_buttons}
                 </div>
             </div>
             """
@@ -446,17 +511,24 @@ class TemplateRenderer:
         # Generate files listing
         files_html = ""
         for file_info in context['files']:
-            view_button = f'<a href="/view/{file_info["path"]}" class="btn-small btn-view">View</a>' if file_info['can_view'] else ''
+            view_url = file_info.get('view_url', f"/view/{file_info['path']}")
+            download_url = file_info.get('download_url', f"/download/{file_info['path']}")
+            view_button = f'<a href="{view_url}" class="btn-small btn-view">View</a>' if file_info['can_view'] else ''
+            browse_button = f'<a href="/browse/{file_info["path"]}" class="btn-small">Open</a>' if file_info.get('can_browse') else ''
+            download_button = f'<a href="{download_url}" class="btn-small btn-download">Download</a>' if file_info.get('can_download', True) else ''
+            select_box = '' if in_archive else f'<input type="checkbox" name="path" value="{html.escape(file_info["path"], quote=True)}" class="select-box" form="batch-form">'
             files_html += f"""
             <div class="file-item file">
                 <div class="file-info">
+                    {select_box}
                     <span class="icon">{file_info['icon']}</span>
                     <span class="name">{file_info['name']}</span>
                     <span class="details">{file_info['size']}</span>
                 </div>
                 <div class="actions">
+                    {browse_button}
                     {view_button}
-                    <a href="/download/{file_info['path']}" class="btn-small btn-download">Download</a>
+                    {download_button}
                 </div>
             </div>
             """
@@ -465,11 +537,26 @@ class TemplateRenderer:
         if not listing_html.strip():
             listing_html = "<p class='empty-dir'>This directory is empty or you don't have permission to view its contents.</p>"
         
+        # Checked entries are posted to /batch and downloaded as one archive
+        batch_bar = ""
+        if (directories_html or files_html) and not in_archive:
+            batch_bar = """
+                <form action="/batch" method="post" id="batch-form" class="batch-bar">
+                    <span>Selected items:</span>
+                    <select name="format">
+                        <option value="zip">ZIP</option>
+                        <option value="tar">tar</option>
+                        <option value="tar.gz">tar.gz</option>
+                    </select>
+                    <button type="submit" class="btn btn-secondary">Download Selected</button>
+                </form>
+            """
+        
         return f"""
         <!DOCTYPE html>
         <html>
         <head>
-            <title>Browse: /{context['rel_path']}</title>
+            <title>Browse: /{rel_path_html}</title>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
             <style>
@@ -486,9 +573,15 @@ class TemplateRenderer:
                 <div class="toolbar">
                     <a href="/" class="btn btn-primary">Home</a>
                     <a href="/upload" class="btn btn-secondary">Upload</a>
-                    <span class="path-info">Current: /{context['rel_path'] or 'root'}</span>
+                    <form action="/search" method="get" class="search-form">
+                        <input type="text" name="q" placeholder="Search names, *.glob or ext:py">
+                        <input type="hidden" name="dir" value="{rel_path_html}">
+                        <button type="submit" class="btn btn-secondary">Search</button>
+                    </form>
+                    <span class="path-info">Current: /{rel_path_html or 'root'}</span>
                 </div>
                 
+                {batch_bar}
                 <div class="file-listing">
                     {listing_html}
                 </div>
@@ -497,8 +590,87 @@ class TemplateRenderer:
         </html>
         """
     
+    def render_search_results(self, context):
+        """Render the path search results page"""
+        results_html = ""
+        for match in context['matches']:
+            if match['is_dir']:
+                actions = f"""
+                    <a href="/browse/{match['url']}" class="btn-small">Open</a>
+                    <a href="/zip/{match['url']}" class="btn-small btn-zip">ZIP</a>
+                """
+            else:
+                view_button = f'<a href="/view/{match["url"]}" class="btn-small btn-view">View</a>' if match['can_view'] else ''
+                actions = f"""
+                    {view_button}
+                    <a href="/download/{match['url']}" class="btn-small btn-download">Download</a>
+                    <a href="/browse/{match['parent_url']}" class="btn-small">Folder</a>
+                """
+            results_html += f"""
+            <div class="file-item {'folder' if match['is_dir'] else 'file'}">
+                <div class="file-info">
+                    <span class="icon">{match['icon']}</span>
+                    <span class="name">{match['name']}</span>
+                    <span class="details">/{match['path']}</span>
+                </div>
+                <div class="actions">
+                    {actions}
+                </div>
+            </div>
+            """
+
+        if context['query'] and not results_html:
+            results_html = "<p class='empty-dir'>No matching files or folders.</p>"
+
+        summary = f"{len(context['matches'])} result(s) in {context['elapsed_ms']} ms"
+        if context['truncated']:
+            summary += " (showing the first matches only, refine your search)"
+        if not context['index_ready']:
+            summary += " - the search index is still being built, results may be incomplete"
+
+        return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Search: {context['query']}</title>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <style>
+                {self.get_base_css()}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h1>Search Files</h1>
+                    <p>Searching in /{context['scope']}</p>
+                </div>
+                
+                <div class="toolbar">
+                    <a href="/" class="btn btn-primary">Home</a>
+                    <a href="/browse/{context['scope']}" class="btn btn-secondary">Back to Folder</a>
+                    <form action="/search" method="get" class="search-form">
+                        <input type="text" name="q" value="{context['query']}" placeholder="Search names, *.glob or ext:py">
+                        <input type="hidden" name="dir" value="{context['scope']}">
+                        <button type="submit" class="btn btn-secondary">Search</button>
+                    </form>
+                </div>
+                
+                <div class="search-summary">{summary}</div>
+                
+                <div class="file-listing">
+                    {results_html}
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+    
     def render_file_viewer(self, context):
         """Render the file viewer page"""
+        # Archive members pass their own URLs
+        download_url = context.get('download_url', f"/download/{context['rel_path']}")
+        back_url = context.get('back_url', f"/browse/{context['parent_dir']}")
         return f"""
         <!DOCTYPE html>
         <html>
@@ -528,8 +700,8 @@ class TemplateRenderer:
                     <div class="file-actions">
                         <button onclick="copyToClipboard()" class="btn-small btn-copy">Copy All</button>
                         <button onclick="selectAll()" class="btn-small">Select All</button>
-                        <a href="/download/{context['rel_path']}" class="btn-small btn-download">Download</a>
-                        <a href="/browse/{context['parent_dir']}" class="btn-small">Back to Folder</a>
+                        <a href="{download_url}" class="btn-small btn-download">Download</a>
+                        <a href="{back_url}" class="btn-small">Back to Folder</a>
                     </div>
                 </div>
                 
@@ -647,6 +819,37 @@ class TemplateRenderer:
         </html>
         """
     
+    def render_login_page(self, context):
+        """Render the login form"""
+        error_html = f'<p class="login-error">{context["error"]}</p>' if context['error'] else ''
+        
+        return f"""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <title>Sign In</title>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+            <style>{self.get_base_css()}</style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h1>File Server</h1>
+                    <p>Sign in to browse, upload and download files</p>
+                </div>
+                <form action="/login" method="post" class="login-form">
+                    {error_html}
+                    <input type="hidden" name="next" value="{context['next']}">
+                    <input type="text" name="username" placeholder="Username" autocomplete="username" required autofocus>
+                    <input type="password" name="password" placeholder="Password" autocomplete="current-password" required>
+                    <button type="submit" class="btn btn-primary">Sign In</button>
+                </form>
+            </div>
+        </body>
+        </html>
+        """
+    
     def render_upload_page(self, context):
         """Render the upload page"""
         files_html = ""
@@ -657,13 +860,29 @@ class TemplateRenderer:
                 <li>
                     <span class="file-name">{file_info['name']}</span>
                     <span class="file-size">{file_info['size']}</span>
-                    <a href="/uploads/{file_info['name']}" class="btn-small">Download</a>
+                    <a href="/uploads/{file_info.get('url', file_info['name'])}" class="btn-small">Download</a>
                 </li>
                 """
             files_html += "</ul>"
         else:
             files_html = "<p class='no-files'>No uploaded files yet.</p>"
         
+        # Large upload directories are shown one page at a time
+        page, pages = context.get('page', 1), context.get('pages', 1)
+        pager_html = ""
+        if pages > 1:
+            previous_link = f'<a href="/upload?page={page - 1}" class="btn-small">Previous</a>' if page > 1 else ''
+            next_link = f'<a href="/upload?page={page + 1}" class="btn-small">Next</a>' if page < pages else ''
+            pager_html = f"""
+                    <div class="pager">
+                        {previous_link}
+                        <span class="page-info">Page {page} of {pages}</span>
+                        {next_link}
+                    </div>
+            """
+        total_size = f" · {context['total_size']}" if 'total_size' in context else ''
+        quota_html = f'<p class="page-info">Your upload quota: {context["quota"]}</p>' if 'quota' in context else ''
+        
         return f"""
         <!DOCTYPE html>
         <html>
@@ -702,12 +921,14 @@ class TemplateRenderer:
                                 <button type="submit" class="btn btn-primary">Upload Files</button>
                             </div>
                         </form>
+                        {quota_html}
                     </div>
                 </div>
                 
                 <div class="uploaded-section">
-                    <h3>Previously Uploaded Files ({context['files_count']})</h3>
+                    <h3>Previously Uploaded Files ({context['files_count']}{total_size})</h3>
                     {files_html}
+                    {pager_html}
                 </div>
             </div>
         </body>
@@ -0,0 +1,76 @@
+"""
+Shared change journal: with several processes on one state directory, one
+writes the journal and the others follow it, so every process serves the
+same cursors; a follower takes over when the writer goes away.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from changelog import ChangeJournal
+from watcher import ChangeEvent
+
+
+class SharedJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        with open(os.path.join(self.root, 'a'), 'w') as f:
+            f.write('a')
+        self.writer = self.journal()
+        self.follower = self.journal()
+
+    def journal(self):
+        journal = ChangeJournal(self.root, state_dir=self.state_dir, max_entries=10)
+        journal.open()
+        self.addCleanup(journal.stop)
+        return journal
+
+    def create(self, name):
+        path = os.path.join(self.root, name)
+        with open(path, 'w') as f:
+            f.write(name)
+        # Every process's watcher sees the change; only the writer journals it
+        for journal in (self.writer, self.follower):
+            journal.apply_change(ChangeEvent('created', 'browse', path, name, False))
+
+    def test_one_writer(self):
+        self.assertFalse(self.writer.following)
+        self.assertTrue(self.follower.following)
+
+    def test_follower_serves_the_writers_cursors(self):
+        cursor = self.follower.cursor()
+        self.assertEqual(cursor, self.writer.cursor())
+        for name in ('b', 'c'):
+            self.create(name)
+        changes = self.follower.changes_since(cursor)
+        self.assertEqual([change['path'] for change in changes['changes']], ['b', 'c'])
+        self.assertEqual(changes['cursor'], self.writer.cursor())
+
+    def test_follower_survives_compaction(self):
+        cursor = self.writer.cursor()
+        for index in range(25):
+            self.create(f"f{index}")
+        self.assertEqual(self.follower.changes_since(cursor), self.writer.changes_since(cursor))
+        self.assertEqual(self.follower.snapshot_listing(), self.writer.snapshot_listing())
+
+    def test_follower_takes_over(self):
+        self.assertFalse(self.follower.take_over())
+        # What the writer process exiting does
+        self.writer.stop()
+        self.writer._lock_file.close()
+        self.assertTrue(self.follower.take_over())
+        cursor = self.follower.cursor()
+        path = os.path.join(self.root, 'new')
+        open(path, 'w').close()
+        self.follower.apply_change(ChangeEvent('created', 'browse', path, 'new', False))
+        self.assertEqual([c['path'] for c in self.follower.changes_since(cursor)['changes']], ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
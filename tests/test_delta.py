@@ -0,0 +1,97 @@
+"""
+Delta round trips: a client's old copy plus the delta generated against its
+signature must rebuild the server's file byte for byte.
+"""
+
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from delta import (compute_signature, encode_signature, decode_signature,
+                   generate_delta, apply_delta, SignatureCache)
+
+
+class DeltaRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.random = random.Random(31)
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def round_trip(self, old, new, block_size=None, server_signature=False):
+        old_path = self.write('old', old)
+        new_path = self.write('new', new)
+        signature = decode_signature(encode_signature(*compute_signature(old_path, block_size)))
+        delta = io.BytesIO()
+        server = compute_signature(new_path, signature[0]) if server_signature else None
+        generate_delta(new_path, signature, delta.write, server)
+        delta.seek(0)
+        out = io.BytesIO()
+        with open(old_path, 'rb') as old_file:
+            size = apply_delta(old_file, delta, out)
+        self.assertEqual(out.getvalue(), new)
+        self.assertEqual(size, len(new))
+        return len(delta.getvalue())
+
+    def test_unchanged_file_is_all_copies(self):
+        data = self.random.randbytes(200000)
+        self.assertLess(self.round_trip(data, data), 1000)
+
+    def test_inserted_bytes_shift_the_rest(self):
+        old = self.random.randbytes(300000)
+        new = old[:1000] + b'inserted' + old[1000:]
+        self.assertLess(self.round_trip(old, new, block_size=2048), 10000)
+
+    def test_edits_with_server_signature(self):
+        old = self.random.randbytes(100000)
+        new = bytearray(old)
+        new[5000:5010] = b'x' * 10
+        new += b'appended tail'
+        self.round_trip(old, bytes(new), block_size=2048, server_signature=True)
+
+    def test_short_last_block_and_empty_files(self):
+        old = self.random.randbytes(5000)
+        self.round_trip(old, old[:4500])
+        self.round_trip(b'', old)
+        self.round_trip(old, b'')
+
+    def test_file_truncated_during_delta_fails_before_end_record(self):
+        old_path = self.write('old', self.random.randbytes(50000))
+        new_path = self.write('new', self.random.randbytes(4 * 1024 * 1024))
+        written = []
+
+        def write(data):
+            if not written:
+                os.truncate(new_path, 1000)
+            written.append(data)
+        with self.assertRaises(OSError):
+            generate_delta(new_path, compute_signature(old_path), write)
+        self.assertFalse(b''.join(written[-1:]).startswith(b'E'))
+
+    def test_signature_cache_follows_file_versions(self):
+        path = self.write('file', b'a' * 9000)
+        cache = SignatureCache()
+        first = cache.get(path, 2048)
+        self.assertIs(cache.get(path, 2048), first)
+        self.write('file', b'b' * 10000)
+        self.assertNotEqual(cache.get(path, 2048), first)
+
+    def test_malformed_signature(self):
+        with self.assertRaises(ValueError):
+            decode_signature(b'nope')
+        body = encode_signature(*compute_signature(self.write('x', b'123' * 2000), 2048))
+        with self.assertRaises(ValueError):
+            decode_signature(body[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+"""
+Streaming multipart parsing and upload reservations: parts are found no
+matter how the body is split across reads, bodies that end early or are
+malformed are refused, and reservations cannot be overrun.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from multipart import MultipartReader, MultipartError, BodyTruncated
+from quota import UploadQuota, QuotaExceeded
+
+BOUNDARY = 'xYzBoundary'
+
+
+def body(*parts):
+    out = b''
+    for name, filename, content in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        out += (f'--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n\r\n').encode() + content + b'\r\n'
+    return out + f'--{BOUNDARY}--\r\n'.encode()
+
+
+class TrickleReader(io.RawIOBase):
+    """Returns at most `step` bytes per read, like a slow connection"""
+
+    def __init__(self, data, step):
+        self.data = data
+        self.pos = 0
+        self.step = step
+
+    def read(self, size=-1):
+        size = min(self.step, len(self.data) - self.pos) if size < 0 else min(size, self.step)
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+def parse(data, step=1 << 20, chunk_size=64, length=None):
+    reader = MultipartReader(TrickleReader(data, step), BOUNDARY, len(data) if length is None else length, chunk_size)
+    return [(part.name, part.filename, b''.join(part.chunks())) for part in reader]
+
+
+class MultipartReaderTest(unittest.TestCase):
+
+    def test_boundary_split_across_reads(self):
+        # Content that nearly repeats the delimiter, read in every split position
+        content = b'a\r\n--xYzBoundar' + b'b' * 100 + b'\r\n--xYz'
+        data = body(('note', None, b'hello'), ('file', 'a.bin', content))
+        for step in range(1, 40):
+            with self.subTest(step=step):
+                self.assertEqual(parse(data, step=step, chunk_size=32),
+                                 [('note', None, b'hello'), ('file', 'a.bin', content)])
+
+    def test_large_part_is_streamed_in_chunks(self):
+        content = bytes(range(256)) * 100
+        data = body(('file', 'big', content))
+        reader = MultipartReader(TrickleReader(data, 1000), BOUNDARY, len(data), 256)
+        part = next(iter(reader))
+        chunks = list(part.chunks())
+        self.assertGreater(len(chunks), 10)
+        self.assertTrue(all(len(chunk) <= 256 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), content)
+
+    def test_client_stopping_early_is_truncation(self):
+        data = body(('file', 'a', b'x' * 500))
+        with self.assertRaises(BodyTruncated):
+            parse(data[:200], length=len(data))
+
+    def test_body_without_closing_boundary_is_malformed(self):
+        data = body(('file', 'a', b'x' * 500))[:300]
+        with self.assertRaises(MultipartError) as raised:
+            parse(data)
+        self.assertNotIsInstance(raised.exception, BodyTruncated)
+
+    def test_missing_boundary(self):
+        with self.assertRaises(MultipartError):
+            MultipartReader(io.BytesIO(b''), '', 0)
+
+
+class EmptyCatalog:
+    total_bytes = 0
+    files = {}
+
+
+class UploadQuotaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.upload_dir = tempfile.mkdtemp()
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        self.quota = UploadQuota(EmptyCatalog(), self.upload_dir, self.state_dir,
+                                 user_limit=1000, total_limit=1500, min_free=0, max_upload=0)
+
+    def test_reservations_count_until_closed(self):
+        first = self.quota.reserve('bob', 800)
+        with self.assertRaises(QuotaExceeded) as raised:
+            self.quota.reserve('bob', 300)
+        self.assertEqual((raised.exception.status, raised.exception.reason), (413, 'user_quota'))
+        with self.assertRaises(QuotaExceeded) as raised:
+            self.quota.reserve('amy', 800)
+        self.assertEqual(raised.exception.reason, 'total_quota')
+        first.cancel()
+        self.quota.reserve('amy', 800).cancel()
+        self.assertEqual(self.quota.reserved_total, 0)
+
+    def test_finish_charges_only_saved_files(self):
+        reservation = self.quota.reserve('bob', 800)
+        reservation.consume(300)
+        reservation.saved('a.txt', 300)
+        reservation.finish()
+        reservation.finish()
+        self.assertEqual(self.quota.usage('bob'), (300, 1000))
+        self.assertEqual((self.quota.reserved_total, self.quota.unwritten), (0, 0))
+
+    def test_writing_past_the_reservation_is_refused(self):
+        reservation = self.quota.reserve('bob', 100)
+        reservation.consume(100)
+        with self.assertRaises(QuotaExceeded):
+            reservation.consume(1)
+        reservation.cancel()
+
+    def test_other_workers_reservations_count(self):
+        shared = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, shared)
+        other = UploadQuota(EmptyCatalog(), self.upload_dir, tempfile.mkdtemp(dir=shared),
+                            user_limit=1000, min_free=0, max_upload=0, shared_dir=shared)
+        mine = UploadQuota(EmptyCatalog(), self.upload_dir, tempfile.mkdtemp(dir=shared),
+                           user_limit=1000, min_free=0, max_upload=0, shared_dir=shared)
+        reservation = other.reserve('bob', 800)
+        # Both live in this process; pose as another worker by publishing under the parent's pid
+        published = os.path.join(shared, 'upload_quota', f"{os.getpid()}.json")
+        os.replace(published, os.path.join(shared, 'upload_quota', f"{os.getppid()}.json"))
+        with self.assertRaises(QuotaExceeded):
+            mine.reserve('bob', 300)
+        reservation.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+"""
+Root confinement: paths below the browse root are opened through its
+directory descriptor, so a folder swapped for a symlink to somewhere else
+is refused even while the resolver still has the folder cached.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from pathres import PathResolver, open_file, resolver_for
+from checksums import hash_file
+from delta import compute_signature, generate_delta
+from archive_index import ArchiveIndexCache
+from utils import FileServerUtils
+
+
+class SymlinkSwapTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.outside = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.addCleanup(shutil.rmtree, self.outside)
+        os.makedirs(os.path.join(self.root, 'data'))
+        for folder in (os.path.join(self.root, 'data'), self.outside):
+            with open(os.path.join(folder, 'file.txt'), 'w') as f:
+                f.write('secret' if folder == self.outside else 'inside')
+            with zipfile.ZipFile(os.path.join(folder, 'files.zip'), 'w') as archive:
+                archive.writestr('member.txt', 'x')
+        self.resolver = resolver_for(self.root)
+        self.path = os.path.join(self.root, 'data', 'file.txt')
+        # Cache the folder, then swap it without telling the resolver
+        self.assertTrue(self.resolver.is_within(self.path))
+        shutil.rmtree(os.path.join(self.root, 'data'))
+        os.symlink(self.outside, os.path.join(self.root, 'data'))
+
+    def test_cached_check_is_stale_but_strict_check_is_not(self):
+        self.assertTrue(self.resolver.is_within(self.path))
+        self.assertFalse(self.resolver.is_within(self.path, strict=True))
+
+    def test_open_and_listdir_refuse(self):
+        with self.assertRaises(PermissionError):
+            open_file(self.path, self.root)
+        with self.assertRaises(PermissionError):
+            self.resolver.listdir(os.path.join(self.root, 'data'))
+
+    def test_readers_refuse(self):
+        utils = FileServerUtils()
+        with self.assertRaises(PermissionError):
+            utils.read_file_content(self.path, self.root)
+        with self.assertRaises(PermissionError):
+            hash_file(self.path, 'sha256', self.root)
+        with self.assertRaises(PermissionError):
+            compute_signature(self.path, root=self.root)
+        with self.assertRaises(PermissionError):
+            generate_delta(self.path, (1024, 0, []), lambda data: None, root=self.root)
+        with self.assertRaises(PermissionError):
+            ArchiveIndexCache().get(os.path.join(self.root, 'data', 'files.zip'), self.root)
+
+    def test_sibling_with_common_prefix_is_outside(self):
+        sibling = self.root.rstrip(os.sep) + '2'
+        os.makedirs(sibling, exist_ok=True)
+        self.addCleanup(shutil.rmtree, sibling)
+        self.assertFalse(PathResolver(self.root).is_within(os.path.join(sibling, 'x')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Session tokens: valid tokens verify, forged, expired, malformed and
+revoked ones do not, and a logout reaches every process sharing the
+revocation file.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sessions import SessionManager, CredentialBackend
+
+
+class Accept(CredentialBackend):
+
+    def verify(self, username, password):
+        return password == 'right'
+
+
+class SessionManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.state_dir)
+        self.revoked_path = os.path.join(self.state_dir, 'revoked_sessions')
+        self.sessions = self.manager()
+
+    def manager(self, **kwargs):
+        kwargs.setdefault('revoked_path', self.revoked_path)
+        return SessionManager(Accept(), b'k' * 32, **kwargs)
+
+    def test_login_and_verify(self):
+        self.assertIsNone(self.sessions.login('bob', 'wrong'))
+        token = self.sessions.login('bøb', 'right')
+        self.assertEqual(self.sessions.verify(token), 'bøb')
+
+    def test_forged_expired_and_malformed_tokens(self):
+        token = self.sessions.issue('bob')
+        expires, nonce, signature, user = token.split('.')
+        other_user = self.sessions.issue('amy').split('.')[3]
+        self.assertIsNone(self.sessions.verify(f"{expires}.{nonce}.{signature}.{other_user}"))
+        self.assertIsNone(SessionManager(Accept(), b'z' * 32, revoked_path=None).verify(token))
+        self.assertIsNone(self.manager(lifetime=-1).verify(self.manager(lifetime=-1).issue('bob')))
+        for bad in ('', 'a.b.c', 'x.y.z.w', token + 'é', '١٢.' + token.split('.', 1)[1]):
+            self.assertIsNone(self.sessions.verify(bad))
+            self.sessions.revoke(bad)
+
+    def test_revoked_token_is_rejected(self):
+        token = self.sessions.issue('bob')
+        other = self.sessions.issue('bob')
+        self.sessions.revoke(token)
+        self.assertIsNone(self.sessions.verify(token))
+        self.assertEqual(self.sessions.verify(other), 'bob')
+
+    def test_revocation_reaches_other_processes_and_restarts(self):
+        worker = self.manager()
+        token = self.sessions.issue('bob')
+        self.assertEqual(worker.verify(token), 'bob')
+        self.sessions.revoke(token)
+        self.assertIsNone(worker.verify(token))
+        self.assertIsNone(self.manager().verify(token))
+
+    def test_revocation_file_drops_expired_tokens(self):
+        live = self.sessions.issue('bob')
+        self.sessions.revoke(live)
+        expired = self.manager(lifetime=-10)
+        expired.revoked_rewrite_size = 2048
+        # About 55 bytes per revocation: the file passes 2048 bytes once, and
+        # the rewrite keeps only the live revocation
+        for _ in range(50):
+            expired.revoke(expired.issue('bob'))
+        self.assertLess(os.path.getsize(self.revoked_path), 2048)
+        self.assertIsNone(self.manager().verify(live))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+Per-request phase timing for the Enhanced File Server
+Measures where a request spends its time (auth, path resolution, stat calls,
+sniffing, rendering, socket writes), reports it in a Server-Timing header and
+logs slow requests with their breakdown
+"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from config import *
+
+
+class PhaseTimer:
+    """Accumulates durations per named phase for one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}          # phase name -> seconds, in first-seen order
+
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing_header(self):
+        """Format the phases so far as a Server-Timing header value (milliseconds)"""
+        parts = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in self.phases.items()]
+        parts.append(f"total;dur={self.elapsed() * 1000:.3f}")
+        return ', '.join(parts)
+
+    def breakdown_ms(self):
+        return {name: round(seconds * 1000, 3) for name, seconds in self.phases.items()}
+
+
+class SlowRequestLog:
+    """Appends requests slower than a threshold to a JSON-lines file"""
+
+    def __init__(self, path=SLOW_REQUEST_LOG, threshold_ms=SLOW_REQUEST_THRESHOLD_MS):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.lock = threading.Lock()
+        self.logged = 0
+
+    def record(self, total_ms, **details):
+        if self.threshold_ms is None or total_ms < self.threshold_ms:
+            return
+        entry = {'time': round(time.time(), 3), 'total_ms': round(total_ms, 3)}
+        entry.update(details)
+        line = json.dumps(entry) + '\n'
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+            self.logged += 1
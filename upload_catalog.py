@@ -0,0 +1,144 @@
+"""
+Upload catalog for the Enhanced File Server
+Keeps the list of uploaded files in memory, sorted by name, together with
+running totals, so the dashboard count is O(1) and the upload page shows
+one page of files without listing or stat-ing the upload directory. The
+catalog is updated by uploads and by the change watcher, and saved to the
+state directory so a restart does not have to rescan a large directory.
+"""
+
+import os
+import json
+import stat
+import bisect
+import threading
+from config import *
+
+
+class UploadCatalog:
+    """Name-sorted catalog of the files directly inside the upload directory"""
+
+    def __init__(self, upload_dir=UPLOAD_DIR, state_dir=STATE_DIR):
+        self.upload_dir = upload_dir
+        self.catalog_path = os.path.join(state_dir, 'uploads.json')
+        self.lock = threading.Lock()
+        self.names = []               # sorted file names
+        self.files = {}               # name -> (size, mtime)
+        self.total_bytes = 0
+
+    @property
+    def count(self):
+        return len(self.names)
+
+    def _dir_version(self):
+        try:
+            return os.stat(self.upload_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self):
+        """Use the saved catalog if the directory and every file are unchanged since it was written, else rescan.
+
+        The directory's mtime only covers names being added and removed; a
+        file rewritten in place is caught by comparing its size and mtime.
+        That is one stat per file, but no listing of a large directory.
+        """
+        try:
+            with open(self.catalog_path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('dir_version') is not None and saved['dir_version'] == self._dir_version():
+                files = {name: (size, mtime) for name, size, mtime in saved['files']}
+                if all(self._unchanged(name, size, mtime) for name, (size, mtime) in files.items()):
+                    with self.lock:
+                        self._replace(files)
+                    return
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        self.scan()
+
+    def _unchanged(self, name, size, mtime):
+        try:
+            st = os.stat(os.path.join(self.upload_dir, name))
+        except OSError:
+            return False
+        return stat.S_ISREG(st.st_mode) and st.st_size == size and st.st_mtime == mtime
+
+    def scan(self):
+        """Rebuild the catalog from one pass over the upload directory"""
+        files = {}
+        try:
+            with os.scandir(self.upload_dir) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            st = entry.stat()
+                            files[entry.name] = (st.st_size, st.st_mtime)
+                    except OSError:
+                        continue
+        except OSError:
+            pass
+        with self.lock:
+            self._replace(files)
+
+    def _replace(self, files):
+        self.files = files
+        self.names = sorted(files)
+        self.total_bytes = sum(size for size, _ in files.values())
+
+    def record(self, name, size, mtime):
+        """Add or update one uploaded file"""
+        with self.lock:
+            old = self.files.get(name)
+            if old is None:
+                bisect.insort(self.names, name)
+            else:
+                self.total_bytes -= old[0]
+            self.files[name] = (size, mtime)
+            self.total_bytes += size
+
+    def remove(self, name):
+        with self.lock:
+            old = self.files.pop(name, None)
+            if old is None:
+                return
+            index = bisect.bisect_left(self.names, name)
+            del self.names[index]
+            self.total_bytes -= old[0]
+
+    def page(self, offset, limit):
+        """[(name, size, mtime)] for `limit` files starting at `offset` in name order"""
+        with self.lock:
+            return [(name,) + self.files[name] for name in self.names[offset:offset + limit]]
+
+    def apply_change(self, event):
+        """Follow uploads and deletions made outside the upload form"""
+        if event.kind == 'rescan':
+            self.scan()
+            return
+        if not event.rel_path or '/' in event.rel_path or event.is_dir:
+            return
+        if event.kind == 'deleted':
+            self.remove(event.rel_path)
+            return
+        try:
+            st = os.stat(event.path)
+        except OSError:
+            self.remove(event.rel_path)
+            return
+        if os.path.isfile(event.path):
+            self.record(event.rel_path, st.st_size, st.st_mtime)
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({
+                'dir_version': self._dir_version(),
+                'files': [[name, size, mtime] for name, (size, mtime) in self.files.items()],
+            })
+        temp_path = self.catalog_path + '.tmp'
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, self.catalog_path)
+
+    def stop(self):
+        self.save()
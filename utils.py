@@ -4,28 +4,49 @@ Contains helper functions for file operations, security, and formatting
 """
 
 import os
+import html
 import mimetypes
 import math
+import urllib.parse
 from config import *
+from pathres import resolver_for, open_file
 
 class FileServerUtils:
-    def __init__(self):
-        pass
+    def __init__(self, fs=None):
+        # Request-scoped metadata (statcache.RequestStats); the server sets it
+        # per request, without it every lookup goes to the filesystem
+        self.fs = fs
     
-    def is_safe_path(self, file_path, browse_root):
-        """Check if a file path is within the allowed directory"""
+    def file_size(self, file_path):
+        """Size of a file, or None if it does not exist"""
+        if self.fs is not None:
+            return self.fs.stat(file_path).size
         try:
-            real_path = os.path.realpath(file_path)
-            real_browse_root = os.path.realpath(browse_root)
-            return real_path.startswith(real_browse_root)
+            return os.path.getsize(file_path)
+        except OSError:
+            return None
+    
+    def is_safe_path(self, file_path, browse_root, strict=False):
+        """Check if a file path is within the allowed directory (strict: without cached folders)"""
+        try:
+            return resolver_for(browse_root).is_within(file_path, strict)
         except Exception:
             return False
     
-    def is_text_file(self, file_path):
-        """Check if a file is viewable as text"""
+    def open_file(self, file_path, browse_root):
+        """Open a file for reading through browse_root's directory descriptor (PermissionError outside it)"""
+        return open_file(file_path, browse_root)
+    
+    def list_dir(self, dir_path, browse_root):
+        """Names in a folder, listed through browse_root's directory descriptor (PermissionError outside it)"""
+        return resolver_for(browse_root).listdir(dir_path)
+    
+    def is_text_file(self, file_path, browse_root=None):
+        """Check if a file is viewable as text (sniffed through browse_root's descriptor when given)"""
         try:
             # Check file size (don't try to view very large files)
-            if os.path.getsize(file_path) > MAX_VIEW_FILE_SIZE:
+            size = self.file_size(file_path)
+            if size is None or size > MAX_VIEW_FILE_SIZE:
                 return False
             
             # Check by extension first
@@ -40,7 +61,7 @@ class FileServerUtils:
             
             # Try to detect if file is text by reading a small portion
             try:
-                with open(file_path, 'rb') as f:
+                with (self.open_file(file_path, browse_root) if browse_root else open(file_path, 'rb')) as f:
                     sample = f.read(1024)
                     # Check if the sample contains mostly printable characters
                     if not sample:
@@ -63,24 +84,42 @@ class FileServerUtils:
         except Exception:
             return False
     
+    def decode_text(self, data, name=''):
+        """Decode bytes read from an archive member, or None if they look binary"""
+        ext = os.path.splitext(name)[1].lower()
+        sample = data[:1024]
+        if ext not in TEXT_EXTENSIONS and sample:
+            try:
+                sample.decode('utf-8')
+            except UnicodeDecodeError:
+                printable_chars = sum(1 for byte in sample if 32 <= byte <= 126 or byte in (9, 10, 13))
+                if printable_chars / len(sample) <= 0.7:
+                    return None
+        try:
+            return data.decode('utf-8')
+        except UnicodeDecodeError:
+            return data.decode('latin-1')
+    
     def get_language_for_syntax_highlighting(self, file_path):
         """Determine the programming language for syntax highlighting"""
         ext = os.path.splitext(file_path)[1].lower()
         return LANGUAGE_MAP.get(ext, 'text')
     
-    def read_file_content(self, file_path):
-        """Read file content with encoding fallback"""
+    def read_file_content(self, file_path, browse_root=None):
+        """Read file content with encoding fallback (through browse_root's descriptor when given)"""
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except UnicodeDecodeError:
-            try:
-                with open(file_path, 'r', encoding='latin-1') as f:
-                    return f.read()
-            except Exception:
-                return None
+            with open_file(file_path, browse_root) as f:
+                data = f.read()
+        except PermissionError:
+            raise
         except Exception:
             return None
+        # Universal newlines, as reading in text mode would give
+        try:
+            text = data.decode('utf-8')
+        except UnicodeDecodeError:
+            text = data.decode('latin-1')
+        return text.replace('\r\n', '\n').replace('\r', '\n')
     
     def get_file_icon(self, ext):
         """Get appropriate icon for file extension"""
@@ -107,10 +146,24 @@ class FileServerUtils:
         current_path = ""
         for part in parts:
             current_path = f"{current_path}/{part}" if current_path else part
-            breadcrumbs.append(f'<a href="/browse/{current_path}" class="breadcrumb">{part}</a>')
+            breadcrumbs.append(f'<a href="/browse/{urllib.parse.quote(current_path)}" '
+                               f'class="breadcrumb">{html.escape(part)}</a>')
         
         return ' / '.join(breadcrumbs)
     
+    def generate_archive_breadcrumbs(self, archive_rel_path, folder, filename=None):
+        """Breadcrumbs for a folder (or a file) inside an archive"""
+        breadcrumbs = [self.generate_breadcrumbs(archive_rel_path)]
+        archive_url = urllib.parse.quote(archive_rel_path)
+        current_path = ""
+        for part in filter(None, folder.split('/')):
+            current_path = f"{current_path}/{part}" if current_path else part
+            member = urllib.parse.quote(current_path + '/', safe='/')
+            breadcrumbs.append(f'<a href="/browse/{archive_url}?member={member}" class="breadcrumb">{html.escape(part)}</a>')
+        if filename is not None:
+            breadcrumbs.append(f'<span class="breadcrumb current">📄 {html.escape(filename)}</span>')
+        return ' / '.join(breadcrumbs)
+    
     def generate_file_breadcrumbs(self, rel_path):
         """Generate breadcrumb navigation for file viewer"""
         dir_path = os.path.dirname(rel_path) if os.path.dirname(rel_path) != '.' else ''
@@ -123,7 +176,8 @@ class FileServerUtils:
             current_path = ""
             for part in parts:
                 current_path = f"{current_path}/{part}" if current_path else part
-                breadcrumbs.append(f'<a href="/browse/{current_path}" class="breadcrumb">{part}</a>')
+                breadcrumbs.append(f'<a href="/browse/{urllib.parse.quote(current_path)}" '
+                               f'class="breadcrumb">{html.escape(part)}</a>')
         
         breadcrumbs.append(f'<span class="breadcrumb current">📄 {filename}</span>')
         return ' / '.join(breadcrumbs)
\ No newline at end of file
@@ -0,0 +1,336 @@
+"""
+Filesystem change tracking for the Enhanced File Server
+Watches the browse and upload directories (inotify on Linux, periodic
+scanning elsewhere) and publishes a change feed that caches and indexes
+subscribe to for targeted invalidation
+"""
+
+import os
+import sys
+import abc
+import struct
+import select
+import threading
+from collections import namedtuple
+from config import *
+
+# A single change. kind is 'created', 'modified', 'deleted' or 'rescan'
+# ('rescan' means events were lost and subscribers should re-check root).
+# rel_path is relative to the watched root with '/' separators.
+ChangeEvent = namedtuple('ChangeEvent', 'kind root path rel_path is_dir')
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR | IN_DONT_FOLLOW)
+
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class Subscription:
+    """A subscriber callback, optionally limited to one root and path prefix"""
+
+    def __init__(self, callback, root=None, prefix=''):
+        self.callback = callback
+        self.root = root
+        self.prefix = prefix.strip('/')
+
+    def wants(self, event):
+        if self.root is not None and event.root != self.root:
+            return False
+        if not self.prefix or event.kind == 'rescan':
+            return True
+        return event.rel_path == self.prefix or event.rel_path.startswith(self.prefix + '/')
+
+
+class ChangeWatcher(abc.ABC):
+    """Base class: keeps the watched roots and fans events out to subscribers; backends implement run()"""
+
+    backend = None
+
+    def __init__(self):
+        self.roots = {}           # root name -> absolute real path
+        self.subscriptions = []
+        self.lock = threading.Lock()
+        self.events_published = 0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def watch(self, name, path):
+        """Register a directory tree to watch under a short name"""
+        self.roots[name] = os.path.realpath(path)
+
+    def subscribe(self, callback, root=None, prefix=''):
+        """Call callback(event) for every change under root/prefix"""
+        subscription = Subscription(callback, root, prefix)
+        with self.lock:
+            self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            if subscription in self.subscriptions:
+                self.subscriptions.remove(subscription)
+
+    def covering_roots(self, path):
+        """Names of the watched roots that contain path (roots may be nested, e.g. uploads inside browse)"""
+        return [root for root, root_path in self.roots.items()
+                if path == root_path or path.startswith(root_path.rstrip(os.sep) + os.sep)]
+
+    def publish(self, kind, root, path, is_dir):
+        """Deliver one change to every interested subscriber"""
+        rel_path = os.path.relpath(path, self.roots[root]).replace(os.sep, '/')
+        if rel_path == '.':
+            rel_path = ''
+        event = ChangeEvent(kind, root, path, rel_path, is_dir)
+        self.events_published += 1
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            if subscription.wants(event):
+                try:
+                    subscription.callback(event)
+                except Exception as e:
+                    print(f"⚠️  Change subscriber failed: {e}", file=sys.stderr)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='change-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    @abc.abstractmethod
+    def run(self):
+        """Watch until stop() is called, publishing every change"""
+
+
+class InotifyWatcher(ChangeWatcher):
+    """Linux inotify backend with one watch per directory"""
+
+    backend = 'inotify'
+
+    def __init__(self):
+        super().__init__()
+        # Imported here so only servers that use inotify pay for ctypes
+        import ctypes
+        import ctypes.util
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.get_errno = ctypes.get_errno
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(self.get_errno(), 'inotify_init1 failed')
+        # One watch per directory, shared by every root that contains it:
+        # inotify returns the same descriptor when roots overlap
+        self.watches = {}         # watch descriptor -> directory path
+        self.watch_paths = {}     # directory path -> watch descriptor
+
+    def watch(self, name, path):
+        super().watch(name, path)
+        self._add_tree(self.roots[name], emit=False)
+
+    def _publish_all(self, kind, path, is_dir):
+        """Publish a change to every root that contains path"""
+        for root in self.covering_roots(path):
+            self.publish(kind, root, path, is_dir)
+
+    def _add_watch(self, dir_path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            error = self.get_errno()
+            if error in (2, 20):  # ENOENT, ENOTDIR: removed before we got to it
+                return False
+            raise OSError(error, f"inotify_add_watch failed for {dir_path}")
+        self.watches[wd] = dir_path
+        self.watch_paths[dir_path] = wd
+        return True
+
+    def _add_tree(self, top, emit):
+        """Watch top and every directory below it.
+
+        When emit is set, 'created' events are published for everything found,
+        which covers entries created before their parent's watch existed.
+        """
+        stack = [top]
+        while stack:
+            dir_path = stack.pop()
+            if not self._add_watch(dir_path):
+                continue
+            try:
+                with os.scandir(dir_path) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        if is_dir:
+                            stack.append(entry.path)
+                        if emit:
+                            self._publish_all('created', entry.path, is_dir)
+            except OSError:
+                continue
+
+    def _forget_tree(self, top):
+        """Drop watches for top and everything below it"""
+        prefix = top + os.sep
+        for dir_path in [p for p in self.watch_paths if p == top or p.startswith(prefix)]:
+            wd = self.watch_paths.pop(dir_path)
+            self.watches.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            for root, root_path in self.roots.items():
+                self.publish('rescan', root, root_path, True)
+            return
+        if mask & IN_IGNORED:
+            dir_path = self.watches.pop(wd, None)
+            if dir_path and self.watch_paths.get(dir_path) == wd:
+                del self.watch_paths[dir_path]
+            return
+        dir_path = self.watches.get(wd)
+        if dir_path is None:
+            return
+        is_dir = bool(mask & IN_ISDIR)
+
+        if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # The parent's watch reports the change; only a root needs it here
+            for root in self.covering_roots(dir_path):
+                if dir_path == self.roots[root]:
+                    self.publish('deleted', root, dir_path, True)
+            return
+
+        path = os.path.join(dir_path, name)
+        if mask & IN_CREATE:
+            self._publish_all('created', path, is_dir)
+            if is_dir:
+                self._add_tree(path, emit=True)
+        elif mask & IN_MOVED_TO:
+            self._publish_all('created', path, is_dir)
+            if is_dir:
+                self._forget_tree(path)
+                self._add_tree(path, emit=True)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            if is_dir:
+                self._forget_tree(path)
+            self._publish_all('deleted', path, is_dir)
+        elif mask & (IN_CLOSE_WRITE | IN_ATTRIB):
+            self._publish_all('modified', path, is_dir)
+
+    def run(self):
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        while not self._stop.is_set():
+            if not poller.poll(500):
+                continue
+            try:
+                data = os.read(self.fd, 256 * 1024)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                try:
+                    self._handle(wd, mask, name)
+                except OSError as e:
+                    # Usually the per-user watch limit; subscribers must re-check
+                    print(f"⚠️  inotify error: {e}", file=sys.stderr)
+                    for root, root_path in self.roots.items():
+                        self.publish('rescan', root, root_path, True)
+        os.close(self.fd)
+
+
+class PollingWatcher(ChangeWatcher):
+    """Portable backend comparing periodic snapshots of (is_dir, mtime, size)"""
+
+    backend = 'polling'
+
+    def __init__(self, interval=WATCH_POLL_INTERVAL):
+        super().__init__()
+        self.interval = interval
+        self.snapshots = {}       # root name -> {path: (is_dir, mtime_ns, size)}
+
+    def watch(self, name, path):
+        super().watch(name, path)
+        self.snapshots[name] = self._snapshot(self.roots[name])
+
+    def _snapshot(self, top):
+        snapshot = {}
+        stack = [top]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        try:
+                            is_dir = entry.is_dir(follow_symlinks=False)
+                            st = entry.stat(follow_symlinks=False)
+                        except OSError:
+                            continue
+                        snapshot[entry.path] = (is_dir, st.st_mtime_ns, 0 if is_dir else st.st_size)
+                        if is_dir:
+                            stack.append(entry.path)
+            except OSError:
+                continue
+        return snapshot
+
+    def poll(self):
+        """Scan every root once and publish the differences"""
+        for root, root_path in self.roots.items():
+            old = self.snapshots.get(root, {})
+            new = self._snapshot(root_path)
+            self.snapshots[root] = new
+            for path in old.keys() - new.keys():
+                self.publish('deleted', root, path, old[path][0])
+            for path, info in new.items():
+                previous = old.get(path)
+                if previous is None:
+                    self.publish('created', root, path, info[0])
+                elif previous[0] != info[0]:
+                    self.publish('deleted', root, path, previous[0])
+                    self.publish('created', root, path, info[0])
+                elif previous != info and not info[0]:
+                    self.publish('modified', root, path, False)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.poll()
+
+
+def create_watcher(roots):
+    """Create and start a watcher for {name: path}, preferring inotify"""
+    watcher = None
+    if sys.platform.startswith('linux') and WATCH_BACKEND in ('auto', 'inotify'):
+        try:
+            watcher = InotifyWatcher()
+            for name, path in roots.items():
+                watcher.watch(name, path)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️  inotify unavailable ({e}), falling back to periodic scanning")
+            if watcher is not None and watcher.fd >= 0:
+                os.close(watcher.fd)
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher()
+        for name, path in roots.items():
+            watcher.watch(name, path)
+    watcher.start()
+    return watcher